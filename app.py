@@ -1,24 +1,39 @@
 # app.py (Final Version with All Fixes)
+import io
 import os
 import math
 import logging
 import time
-import io
-import csv
 from datetime import datetime, date
 from functools import wraps
-from collections import Counter, defaultdict
+from collections import defaultdict
 
 import psycopg2
 import psycopg2.extras
 import requests
 from flask import (Flask, render_template, request, redirect, url_for, g,
-                   flash, session, jsonify, send_from_directory, make_response)
+                   flash, session, jsonify, Response)
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 
-from radiology_api import radiology_bp, perform_radiology_request
-from lab_api import lab_bp
+import clinical_search
+import db_pool
+import file_serving
+import file_storage
+import follow_up_state
+import image_derivatives
+import patient_api
+import patient_autocomplete
+import patient_import
+from patient_search import search_patients as search_patients_page
+from dashboard_stats import get_dashboard_stats
+from patient_export import stream_export
+from patient_record import load_patient_record, load_section, SECTIONS as PATIENT_RECORD_SECTIONS
+from radiology_api import radiology_bp
+import radiology_client
+import radiology_jobs
+import request_metrics
+import user_activity
+from lab_api import lab_bp, TEST_CATEGORIES, insert_lab_orders
 
 # --- App Configuration & Setup ---
 app = Flask(__name__)
@@ -35,51 +50,87 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
 
 logging.basicConfig(level=logging.INFO)
 
-DB_CONFIG = {
-    'dbname': 'dermatology_db', 'user': 'postgres', 'password': 'Noor@818',
-    'host': 'localhost', 'port': '5432', 'sslmode': 'disable'
-}
+DB_CONFIG = db_pool.DB_CONFIG
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-# This dictionary contains the detailed lab test structure.
-TEST_CATEGORIES = {
-    'biochemistry': {
-        'Kidney Function': ['GLU', 'UREA', 'CREATININE'],
-        'Liver Function': ['SGOT', 'SGPT', 'ALBUMIN', 'TOTAL_BILIRUBIN'],
-        'Thyroid Function': ['TSH', 'T3', 'T4'],
-        'Cardiac Markers': ['TROPONIN_I'],
-        'Lipid Profile': ['TOTAL_CHOLESTEROL', 'HDL', 'LDL'],
-        'Electrolytes': ['SODIUM', 'POTASSIUM']
-    },
-    'microbiology': {
-        'Wet Mount & Staining': ['GRAM_STAIN', 'HANGING_DROP', 'INDIA_INK', 'STOOL_OVA', 'KOH_MOUNT', 'ZN_STAIN'],
-        'Culture & Sensitivity': ['BLOOD_CULTURE', 'URINE_CULTURE', 'SPUTUM_CULTURE', 'WOUND_CULTURE', 'THROAT_CULTURE', 'CSF_CULTURE'],
-        'Fungal Culture': ['FUNGAL_CULTURE', 'FUNGAL_ID', 'ANTIFUNGAL_SENS'],
-        'Serology': ['WIDAL', 'TYPHIDOT', 'DENGUE_NS1', 'MALARIA_AG', 'HIV_ELISA', 'HBSAG']
-    },
-    'pathology': {
-        'Histopathology': ['BIOPSY_HISTOPATHOLOGY', 'SURGICAL_PATHOLOGY'],
-        'Hematology': ['CBC', 'PERIPHERAL_SMEAR', 'BONE_MARROW', 'COAGULATION'],
-        'Immunohistochemistry': ['IHC_MARKERS', 'SPECIAL_STAINS', 'MOLECULAR_PATH']
-    }
-}
-
+@app.template_global()
+def image_sources(filename):
+    """
+    srcset strings for an uploaded image's gallery derivatives (see image_derivatives.py),
+    or None while they do not exist yet, in which case the original is shown.
+    """
+    found = image_derivatives.available_derivatives(filename, app.config['UPLOAD_FOLDER'])
+    if not found:
+        return None
+    sources = {f"{extension}_srcset": ", ".join(f"{url_for('uploaded_file', filename=name)} {width}w"
+                                                 for name, width in names)
+               for extension, names in found.items()}
+    smallest = found.get('jpg') or found.get('webp')
+    sources['src'] = url_for('uploaded_file', filename=smallest[0][0])
+    return sources
 
 # --- Database Connection ---
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
 def get_db():
+    """
+    Borrows a pooled connection for the lifetime of the current request. With read
+    replicas configured (db_pool.REPLICA_CONFIG), GET requests read from a replica,
+    except in routes marked @use_primary and shortly after the session wrote.
+    """
     if 'db' not in g:
-        g.db = psycopg2.connect(**DB_CONFIG)
+        view = app.view_functions.get(request.endpoint)
+        if request.method in SAFE_METHODS and db_pool.has_replicas() and not getattr(view, 'use_primary', False):
+            wrote_at = session.get('db_wrote_at', 0)
+            g.db = db_pool.getconn_for_read(sticky=time.time() - wrote_at < db_pool.REPLICA_CONFIG['sticky_seconds'])
+        else:
+            g.db = db_pool.getconn()
     return g.db
 
+@app.after_request
+def remember_write(response):
+    # Reads of this session go to the primary for a while, so the next page shows what was just saved.
+    if request.method not in SAFE_METHODS and db_pool.has_replicas():
+        session['db_wrote_at'] = time.time()
+    return response
+
 @app.teardown_appcontext
 def close_db(error):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        # Any uncommitted work is rolled back before the connection is reused.
+        db_pool.putconn(db)
+
+# --- Request Metrics (request_metrics.py, exported at /metrics) ---
+@app.before_request
+def begin_request_metrics():
+    request_metrics.begin_request()
+
+@app.after_request
+def record_request_metrics(response):
+    return request_metrics.end_request(request, response)
+
+@app.teardown_request
+def discard_request_metrics(error):
+    request_metrics.discard_request()
+
+# --- Background Workers ---
+@app.before_request
+def start_background_workers():
+    # Started lazily so only the serving process (not the reloader parent) runs them.
+    # Set radiology_jobs.JOB_CONFIG['workers'] = 0 to run `python radiology_jobs.py` instead.
+    radiology_jobs.start_workers()
+    # Loads the patient autocomplete index and keeps it current (patient_autocomplete.py).
+    patient_autocomplete.start()
 
 # --- Decorators ---
+def use_primary(f):
+    """For GET routes that write: their get_db() connection is never a replica."""
+    f.use_primary = True
+    return f
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -116,20 +167,24 @@ def request_investigation(patient_id):
     # --- Section for handling Radiology requests ---
     if request_type == 'radiology':
         uhid = request.form.get('uhid')
-        scan_type = request.form.get('radiology_scan_type')
-        body_part = request.form.get('radiology_body_part')
+        # One order may ask for several scans: the fields repeat once per scan.
+        scans = list(zip(request.form.getlist('radiology_scan_type'), request.form.getlist('radiology_body_part')))
 
-        if not all([uhid, scan_type, body_part]):
+        if not uhid or not scans or not all(scan_type and body_part for scan_type, body_part in scans):
             flash("Missing fields for radiology scan request.", "danger")
             return redirect(url_for('patient_detail', patient_id=patient_id))
         
-        # Call the function from the radiology_api.py blueprint
-        filename, error = perform_radiology_request(db_conn, patient_id, uhid, scan_type, body_part)
-        
-        if error:
-            flash(f"Radiology request failed: {error}", "danger")
-        else:
-            flash(f"Radiology scan '{filename}' successfully requested and added to patient gallery.", "success")
+        # Each scan runs as a background job; scans are added to the gallery as they arrive.
+        try:
+            job_ids = radiology_jobs.enqueue_jobs(db_conn, patient_id, uhid, scans, session['user_id'])
+            flash(f"Radiology request {', '.join(f'#{job_id}' for job_id in job_ids)} queued. "
+                  f"Scans will appear in the patient gallery when they are ready.", "success")
+            if radiology_client.unavailable_for():
+                flash("The radiology server is currently unavailable; the order will be sent as soon as it is back.",
+                      "warning")
+        except psycopg2.Error as e:
+            db_conn.rollback()
+            flash(f"Radiology request failed: {e}", "danger")
 
     # --- Section for handling Lab requests ---
     elif request_type == 'lab':
@@ -144,10 +199,9 @@ def request_investigation(patient_id):
         
         try:
             with db_conn.cursor() as cursor:
-                # Loop through the selected tests and create a record for each one
-                for test_name in requested_tests:
-                    sql = "INSERT INTO LabReport (patient_id, requested_by_doctor_id, report_type, department, report_date, status) VALUES (%s, %s, %s, %s, %s, 'Pending')"
-                    cursor.execute(sql, (patient_id, session['user_id'], test_name, department, date.today()))
+                # One multi-row INSERT for all the selected tests
+                insert_lab_orders(cursor, session['user_id'],
+                                  [(patient_id, test_name, department) for test_name in requested_tests])
                 db_conn.commit()
             flash(f"Lab tests requested successfully.", 'success')
         except Exception as e:
@@ -204,6 +258,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/logout')
+@use_primary
 def logout():
     if 'log_id' in session:
         db = get_db()
@@ -310,91 +365,12 @@ def dashboard():
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
-    # --- 1. PATIENT LIST SEARCH & PAGINATION LOGIC (NEWLY ADDED) ---
-    page = request.args.get('page', 1, type=int)
-    PER_PAGE = 15 # Or your preferred number of patients per page
-
-    # Get search parameters from the form
-    search_name = request.args.get('name', '').strip()
-    search_patient_code = request.args.get('patient_code', '').strip()
-    search_mobile = request.args.get('mobile_number', '').strip()
-    search_status = request.args.get('status', '').strip()
-
-    # Dynamically build the WHERE clause for searching
-    where_clauses = []
-    params = []
-    if search_name:
-        where_clauses.append("name ILIKE %s")
-        params.append(f"%{search_name}%")
-    if search_patient_code:
-        where_clauses.append("patient_code ILIKE %s")
-        params.append(f"%{search_patient_code}%")
-    if search_mobile:
-        where_clauses.append("mobile_number ILIKE %s")
-        params.append(f"%{search_mobile}%")
-    if search_status == 'admitted':
-        where_clauses.append("is_admitted = TRUE")
-    elif search_status == 'discharged':
-        where_clauses.append("is_admitted = FALSE")
-
-    where_sql = ""
-    if where_clauses:
-        where_sql = "WHERE " + " AND ".join(where_clauses)
-        
-    # Get the total count of patients for pagination
-    count_sql = f"SELECT COUNT(*) FROM Patient {where_sql}"
-    cursor.execute(count_sql, tuple(params))
-    total_patients_count = cursor.fetchone()[0]
-    total_pages = math.ceil(total_patients_count / PER_PAGE)
-    offset = (page - 1) * PER_PAGE
-
-    # Fetch the paginated list of patients
-    patient_query_params = list(params)
-    patient_query_params.extend([PER_PAGE, offset])
-    # *** FIX: Calculate age from 'dob' column instead of selecting a non-existent 'age' column ***
-    patients_sql = f"""
-        SELECT id, patient_code, name, DATE_PART('year', AGE(dob)) as age, gender, diagnosis, is_admitted 
-        FROM Patient 
-        {where_sql}
-        ORDER BY id DESC 
-        LIMIT %s OFFSET %s
-    """
-    cursor.execute(patients_sql, tuple(patient_query_params))
-    patients = cursor.fetchall()
-    
-    # --- 2. EXISTING STATS AND USER LOGIC (Unchanged) ---
-    stats = {}
-    cursor.execute("SELECT COUNT(*) FROM Patient")
-    stats['total_patients'] = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM Bed WHERE status = 'Occupied'")
-    stats['occupied_beds'] = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM Bed")
-    stats['total_beds'] = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM LabReport WHERE status = 'Pending'")
-    stats['pending_reports'] = cursor.fetchone()[0]
-    cursor.execute("""
-        SELECT COUNT(DISTINCT p.id)
-        FROM Patient p
-        JOIN (
-            SELECT patient_id, MAX(next_follow_up_date) as last_follow_up_due
-            FROM Prescription
-            WHERE next_follow_up_date IS NOT NULL
-            GROUP BY patient_id
-        ) latest_prescription ON p.id = latest_prescription.patient_id
-        LEFT JOIN FollowUpVisit fv ON p.id = fv.patient_id AND fv.visit_date > latest_prescription.last_follow_up_due
-        WHERE latest_prescription.last_follow_up_due < CURRENT_DATE AND fv.id IS NULL;
-    """)
-    stats['missed_follow_ups'] = cursor.fetchone()[0]
+    # --- 1. PATIENT LIST (first page of the shared patient search) ---
+    patient_page = search_patients_page(cursor, request.args, with_count=False)
+    patients = patient_page['patients']
     
-    cursor.execute("SELECT COUNT(DISTINCT patient_id) FROM Prescription WHERE next_follow_up_date IS NOT NULL")
-    stats['total_follow_ups_scheduled'] = cursor.fetchone()[0]
-
-    cursor.execute("SELECT diagnosis FROM Patient WHERE diagnosis IS NOT NULL AND diagnosis != ''")
-    diagnoses = [row['diagnosis'].strip() for row in cursor.fetchall()]
-    disease_counts = Counter(diagnoses)
-    cursor.execute("SELECT gender FROM Patient")
-    genders = [row['gender'] for row in cursor.fetchall()]
-    gender_counts = Counter(genders)
+    # --- 2. STATS (one read of the precomputed snapshot, see dashboard_stats.py) ---
+    stats, disease_counts, gender_counts, missed_follow_up_patients = get_dashboard_stats(db)
 
     employee_summary = {}
     all_users = []
@@ -409,7 +385,7 @@ def dashboard():
                 ), 0) as active_seconds_today
             FROM Users u
             JOIN Roles r ON u.role_id = r.id
-            LEFT JOIN UserActivityLog log ON u.id = log.user_id AND log.login_time::date = CURRENT_DATE
+            LEFT JOIN UserActivityLog log ON u.id = log.user_id AND log.login_time >= CURRENT_DATE
             GROUP BY u.id, r.name
             ORDER BY u.is_active DESC, u.username;
         """
@@ -431,24 +407,6 @@ def dashboard():
             employee_summary['doctors'] = sum(1 for u in all_users if u['role_name'].lower() == 'doctor')
             employee_summary['staff'] = sum(1 for u in all_users if u['role_name'].lower() == 'staff')
 
-    cursor.execute("""
-        SELECT 
-            p.id, p.patient_code, p.name, p.mobile_number,
-            latest_prescription.last_follow_up_due,
-            (CURRENT_DATE - latest_prescription.last_follow_up_due) as days_overdue
-        FROM Patient p
-        JOIN (
-            SELECT patient_id, MAX(next_follow_up_date) as last_follow_up_due
-            FROM Prescription
-            WHERE next_follow_up_date IS NOT NULL
-            GROUP BY patient_id
-        ) latest_prescription ON p.id = latest_prescription.patient_id
-        LEFT JOIN FollowUpVisit fv ON p.id = fv.patient_id AND fv.visit_date > latest_prescription.last_follow_up_due
-        WHERE latest_prescription.last_follow_up_due < CURRENT_DATE AND fv.id IS NULL
-        ORDER BY days_overdue DESC;
-    """)
-    missed_follow_up_patients = cursor.fetchall()
-    
     cursor.close()
     
     # --- 3. PASS ALL VARIABLES (OLD AND NEW) TO THE TEMPLATE ---
@@ -461,8 +419,7 @@ def dashboard():
                             missed_follow_up_patients=missed_follow_up_patients,
                             # Add the new variables for the patient list
                             patients=patients,
-                            total_pages=total_pages,
-                            page=page)
+                            patient_page=patient_page)
 
 # --- CORRECTED and ROBUST Patient Registration Route ---
 @app.route('/register_patient', methods=['GET', 'POST'])
@@ -590,58 +547,12 @@ def list_patients():
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
-    page = request.args.get('page', 1, type=int)
-    PER_PAGE = 15
-
-    # Get search parameters
-    search_name = request.args.get('name', '').strip()
-    search_patient_code = request.args.get('patient_code', '').strip()
-    search_mobile = request.args.get('mobile_number', '').strip()
-    search_status = request.args.get('status', '').strip()
-
-    where_clauses = []
-    params = []
-    if search_name:
-        where_clauses.append("name ILIKE %s")
-        params.append(f"%{search_name}%")
-    if search_patient_code:
-        where_clauses.append("patient_code ILIKE %s")
-        params.append(f"%{search_patient_code}%")
-    if search_mobile:
-        where_clauses.append("mobile_number ILIKE %s")
-        params.append(f"%{search_mobile}%")
-    if search_status == 'admitted':
-        where_clauses.append("is_admitted = TRUE")
-    elif search_status == 'discharged':
-        where_clauses.append("is_admitted = FALSE")
-
-    where_sql = ""
-    if where_clauses:
-        where_sql = "WHERE " + " AND ".join(where_clauses)
-        
-    count_sql = f"SELECT COUNT(*) FROM Patient {where_sql}"
-    cursor.execute(count_sql, tuple(params))
-    total_patients_count = cursor.fetchone()[0]
-    total_pages = math.ceil(total_patients_count / PER_PAGE)
-    offset = (page - 1) * PER_PAGE
-
-    patient_query_params = list(params)
-    patient_query_params.extend([PER_PAGE, offset])
-    patients_sql = f"""
-        SELECT id, patient_code, name, DATE_PART('year', AGE(dob)) as age, gender, diagnosis, is_admitted 
-        FROM Patient 
-        {where_sql}
-        ORDER BY id DESC 
-        LIMIT %s OFFSET %s
-    """
-    cursor.execute(patients_sql, tuple(patient_query_params))
-    patients = cursor.fetchall()
+    patient_page = search_patients_page(cursor, request.args)
     cursor.close()
         
     return render_template('patients.html', 
-                           patients=patients, 
-                           total_pages=total_pages,
-                           page=page,
+                           patients=patient_page['patients'], 
+                           patient_page=patient_page,
                            search_params=request.args)
 
 @app.route('/patient/<int:patient_id>')
@@ -650,74 +561,51 @@ def patient_detail(patient_id):
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
-    cursor.execute("SELECT *, date_part('year', age(dob)) as age FROM Patient WHERE id = %s", (patient_id,))
-    patient = cursor.fetchone()
-    if not patient:
+    # Header plus every section rendered server-side, in a single query.
+    # The image gallery and lab report tabs are fetched lazily from
+    # patient_record_section() when the user opens them.
+    record = load_patient_record(cursor, patient_id, sections=('visits', 'prescriptions', 'admissions'))
+    cursor.close()
+    if not record:
         flash('Patient not found.', 'danger')
         return redirect(url_for('list_patients'))
+    patient = record['patient']
 
     # Check for CURRENT admission
     current_admission = None
     daily_notes = []
-    if patient['is_admitted']:
-        cursor.execute("""
-            SELECT ba.id, ba.admission_date, b.bed_number 
-            FROM BedAssignment ba
-            JOIN Bed b ON ba.bed_id = b.id
-            WHERE ba.patient_id = %s AND ba.discharge_date IS NULL
-        """, (patient_id,))
-        current_admission = cursor.fetchone()
-        
-        if current_admission:
-            cursor.execute("""
-                SELECT dpn.*, u.username as doctor_name
-                FROM DailyProgressNote dpn JOIN Users u ON dpn.doctor_id = u.id
-                WHERE dpn.assignment_id = %s ORDER BY dpn.note_date DESC
-            """, (current_admission['id'],))
-            daily_notes = cursor.fetchall()
-
-    # NEW: Fetch PAST, discharged admission history
-    cursor.execute("""
-        SELECT ba.id, ba.admission_date, ba.discharge_date, ba.discharge_summary, b.bed_number
-        FROM BedAssignment ba
-        JOIN Bed b ON ba.bed_id = b.id
-        WHERE ba.patient_id = %s AND ba.discharge_date IS NOT NULL
-        ORDER BY ba.discharge_date DESC
-    """, (patient_id,))
-    admission_history = cursor.fetchall()
-    
-    # Fetch other patient details as before
-    cursor.execute("SELECT fv.*, u.username as doctor_name FROM FollowUpVisit fv JOIN Users u ON fv.doctor_id = u.id WHERE fv.patient_id = %s ORDER BY fv.visit_date DESC", (patient_id,))
-    followup_visits = cursor.fetchall()
-    
-    cursor.execute("SELECT p.*, u.username as doctor_name FROM Prescription p JOIN Users u ON p.doctor_id = u.id WHERE p.patient_id = %s ORDER BY p.prescription_date DESC", (patient_id,))
-    prescriptions_raw = cursor.fetchall()
-    prescriptions_with_items = []
-    for p in prescriptions_raw:
-        cursor.execute("SELECT * FROM PrescriptionItem WHERE prescription_id = %s", (p['id'],))
-        items = cursor.fetchall()
-        prescriptions_with_items.append({'prescription': p, 'items': items})
-
-    cursor.execute("SELECT * FROM PatientImage WHERE patient_id = %s ORDER BY upload_date DESC", (patient_id,))
-    images = cursor.fetchall()
-
-    cursor.execute("SELECT * FROM LabReport WHERE patient_id = %s ORDER BY report_date DESC", (patient_id,))
-    lab_reports = cursor.fetchall()
-    
-    cursor.close()
+    if patient['is_admitted'] and record['admissions']['current']:
+        current_admission = record['admissions']['current']
+        daily_notes = current_admission['daily_notes']
+    admission_history = record['admissions']['history']
     
     return render_template('patient_detail.html', 
                            patient=patient, 
-                           followup_visits=followup_visits,
-                           prescriptions=prescriptions_with_items,
-                           lab_reports=lab_reports,
-                           images=images, 
+                           followup_visits=record['visits'],
+                           prescriptions=record['prescriptions'],
                            now=datetime.now(),
                            admission=current_admission,
                            daily_notes=daily_notes,
                            admission_history=admission_history,  # Pass history to template
                            lab_test_categories=TEST_CATEGORIES)
 
+@app.route('/api/patient_record/<int:patient_id>/<string:section>')
+@login_required
+def patient_record_section(patient_id, section):
+    """JSON for one patient_detail tab (visits, prescriptions, images, labs, admissions)."""
+    if section not in PATIENT_RECORD_SECTIONS:
+        return jsonify({"error": f"Unknown section '{section}'"}), 404
+    db = get_db()
+    cursor = db.cursor()
+    data = load_section(cursor, patient_id, section)
+    cursor.close()
+    if data is None:
+        return jsonify({"error": "Patient not found"}), 404
+    if section == 'images':
+        for image in data:
+            image['sources'] = image_sources(image['image_filename'])
+    return jsonify({"patient_id": patient_id, "section": section, "data": data})
+
 # In app.py, add this new function
 
 @app.route('/assignment/<int:assignment_id>/add_note', methods=['POST'])
@@ -800,25 +688,37 @@ def upload_patient_image(patient_id):
         return redirect(url_for('patient_detail', patient_id=patient_id))
     file = request.files['patient_image']
     if file.filename and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        stored = file_storage.store_upload(file, app.config['UPLOAD_FOLDER'])
         db = get_db()
         cursor = db.cursor()
         # Corrected to use 'image_filename' and 'notes'
         cursor.execute(
-            "INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes) VALUES (%s, %s, %s, %s)",
-            (patient_id, filename, date.today(), 'Clinical Photo')
+            "INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes, content_sha256, size_bytes, original_filename) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (patient_id, stored['path'], date.today(), 'Clinical Photo', stored['sha256'], stored['size'], stored['original_filename'])
         )
         db.commit()
         cursor.close()
+        image_derivatives.submit(stored['path'], app.config['UPLOAD_FOLDER'])
         flash('Image uploaded successfully', 'success')
     else:
         flash('Invalid file type or no file selected.', 'danger')
     return redirect(url_for('patient_detail', patient_id=patient_id))
 
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
+@login_required
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serves a patient image / lab report file (or a derivative of one); see file_serving.py."""
+    source = file_serving.source_name(filename)
+    found, original_filename = False, None
+    if source:
+        db = get_db()
+        cursor = db.cursor()
+        found, original_filename = file_serving.find_upload_owner(cursor, source)
+        cursor.close()
+    if not found:
+        return "File not found.", 404
+    return file_serving.serve_upload(app.config['UPLOAD_FOLDER'], filename,
+                                     download_name=original_filename if source == filename else None)
 
 # --- Follow-up Visits ---
 @app.route('/patient/<int:patient_id>/add_visit', methods=['GET', 'POST'])
@@ -829,16 +729,17 @@ def add_follow_up_visit(patient_id):
         cursor = db.cursor()
         try:
             sql = """
-                INSERT INTO FollowUpVisit (patient_id, doctor_id, visit_date, complaints, 
-                                           examination_findings, diagnosis, treatment_plan, notes) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO FollowUpVisit (patient_id, doctor_id, visit_date, updated_complaints,
+                                           updated_examination, diagnosis, updated_treatment_plan)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
             """
+            visit_date = date.today()
             cursor.execute(sql, (
-                patient_id, session['user_id'], date.today(),
+                patient_id, session['user_id'], visit_date,
                 request.form.get('complaints'), request.form.get('examination_findings'),
-                request.form.get('diagnosis'), request.form.get('updated_treatment_plan'),
-                request.form.get('notes')
+                request.form.get('diagnosis'), request.form.get('updated_treatment_plan')
             ))
+            follow_up_state.record_visit(cursor, patient_id, visit_date)
             db.commit()
             flash('Follow-up visit recorded successfully.', 'success')
         except Exception as e:
@@ -904,6 +805,7 @@ def create_prescription():
                 sql_item = "INSERT INTO PrescriptionItem (prescription_id, medication_name, dosage, frequency, duration, notes) VALUES (%s, %s, %s, %s, %s, %s)"
                 cursor.execute(sql_item, (prescription_id, med_name, request.form.get(f'med_dosage_{med_index}'), request.form.get(f'med_frequency_{med_index}'), request.form.get(f'med_duration_{med_index}'), request.form.get(f'med_notes_{med_index}')))
             med_index += 1
+        follow_up_state.record_prescription(cursor, patient_id, next_follow_up_date)
         db.commit()
         flash('Prescription created.', 'success')
         return redirect(url_for('patient_detail', patient_id=patient_id))
@@ -987,11 +889,13 @@ def upload_lab_report(report_id):
             flash('No selected file', 'danger')
             return redirect(request.url)
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            stored = file_storage.store_upload(file, app.config['UPLOAD_FOLDER'])
             
-            cursor.execute("UPDATE LabReport SET file_path = %s, status = 'Completed' WHERE id = %s", (filename, report_id))
+            cursor.execute("""
+                UPDATE LabReport
+                SET file_path = %s, content_sha256 = %s, size_bytes = %s, original_filename = %s, status = 'Completed'
+                WHERE id = %s
+            """, (stored['path'], stored['sha256'], stored['size'], stored['original_filename'], report_id))
             db.commit()
             flash('Report file uploaded successfully', 'success')
             cursor.close()
@@ -1123,6 +1027,21 @@ def toggle_user_status(user_id):
     return redirect(url_for('dashboard'))
 
 # --- API Endpoints ---
+@app.route('/api/db_pool_stats')
+@login_required
+@admin_required
+def db_pool_stats():
+    """Runtime statistics for the shared database connection pool (and the replicas, if any)."""
+    return jsonify({**db_pool.stats(), 'read_routing': db_pool.replica_stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Request, SQL, radiology and pool metrics in the Prometheus text format."""
+    if session.get('role_id') != 1 and not request_metrics.scrape_authorized(request):
+        return Response("Forbidden\n", status=403, mimetype='text/plain')
+    return Response(request_metrics.render(db_pool.stats(), db_pool.replica_stats()),
+                    mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/weekly_registrations')
 @login_required
 def weekly_registrations():
@@ -1163,206 +1082,87 @@ def weekly_registrations():
 @login_required
 @admin_required
 def get_user_activity(user_id):
+    """
+    One page of a user's activity, newest first (see user_activity.py).
+    Query string: type (repeatable), from / to (YYYY-MM-DD), q (patient name), after (cursor).
+    """
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    all_activities = []
-
     try:
-        # --- The existing queries for patient activities remain the same ---
-        # Patient Registrations
-        cursor.execute("""
-            SELECT 'Patient Registration' as type, p.name, p.id as patient_id, 
-                   p.date_of_registration::timestamp as activity_date 
-            FROM Patient p WHERE p.registered_by_doctor_id = %s
-        """, (user_id,))
-        for reg in cursor.fetchall(): all_activities.append(dict(reg))
-
-        # Follow-up Visits
-        cursor.execute("""
-            SELECT 'Follow-up Visit' as type, p.name, p.id as patient_id, 
-                   fv.visit_date::timestamp as activity_date 
-            FROM FollowUpVisit fv JOIN Patient p ON fv.patient_id = p.id WHERE fv.doctor_id = %s
-        """, (user_id,))
-        for followup in cursor.fetchall(): all_activities.append(dict(followup))
-
-        # Prescriptions
-        cursor.execute("""
-            SELECT 'Prescription Created' as type, p.name, p.id as patient_id, 
-                   pr.prescription_date as activity_date 
-            FROM Prescription pr JOIN Patient p ON pr.patient_id = p.id WHERE pr.doctor_id = %s
-        """, (user_id,))
-        for prescription in cursor.fetchall(): all_activities.append(dict(prescription))
-
-        # --- NEW: Query for Login and Logout Events ---
-        # Get all login times
-        cursor.execute("""
-            SELECT 'Login' as type, login_time as activity_date 
-            FROM UserActivityLog WHERE user_id = %s
-        """, (user_id,))
-        for login in cursor.fetchall():
-            all_activities.append({'type': 'Login', 'name': 'System Access', 'patient_id': None, 'activity_date': login['activity_date']})
-
-        # Get all logout times
-        cursor.execute("""
-            SELECT 'Logout' as type, logout_time as activity_date 
-            FROM UserActivityLog WHERE user_id = %s AND logout_time IS NOT NULL
-        """, (user_id,))
-        for logout in cursor.fetchall():
-            all_activities.append({'type': 'Logout', 'name': 'System Access', 'patient_id': None, 'activity_date': logout['activity_date']})
-        # --- END NEW SECTION ---
-        
+        page = user_activity.activity_page(cursor, user_id, request.args)
     except Exception as e:
         logging.error(f"Error fetching user activity for user {user_id}: {e}")
         return jsonify({"error": "Failed to fetch user activity"}), 500
     finally:
         cursor.close()
 
-    # Sort all activities together by date (newest first)
-    all_activities.sort(key=lambda x: x['activity_date'], reverse=True)
+    return jsonify(activities=page['activities'], next_cursor=page['next_cursor'])
     
-    return jsonify(all_activities)
+@app.route('/api/clinical_search')
+@login_required
+def clinical_search_api():
+    """
+    Ranked full-text search over clinical notes (see clinical_search.py).
+    Query string: q, source (repeatable), patient_id, page.
+    """
+    if not request.args.get('q', '').strip():
+        return jsonify({"error": "A search query (q) is required."}), 400
+    db = get_db()
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        page = clinical_search.search(cursor, request.args)
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Clinical search failed for {request.args.get('q')!r}: {e}")
+        return jsonify({"error": "Search failed"}), 500
+    finally:
+        cursor.close()
+
+    return jsonify(page)
     
 @app.route('/api/patient/<string:uhid>', methods=['GET'])
 def get_dermatology_data(uhid):
     """
     API endpoint for easy browser access. It first checks for dummy data,
     then queries the live database. NO API KEY IS REQUIRED.
+    Answers carry an ETag; polls with If-None-Match get a 304 while the
+    patient is unchanged (see patient_api.py).
     """
-    DUMMY_API_DATA = {
-        "DERM001": {
-            "department": "Dermatology Department",
-            "medical_records": {
-                "diagnosis": "Chronic Plaque Psoriasis",
-                "record_date": "2025-08-29",
-                "record_id": "REC-73451",
-                "follow_up_visit_count": 0, # dummy value
-                "test_results": {
-                    "bsa": 1.85,
-                    "affected_bsa_percent": 12.5,
-                    "skin_examination": "Erythematous plaques with well-defined borders and silvery scales on elbows, knees, and scalp."
-                },
-                "lab_reports": [
-                    {
-                        "report_name": "Skin Biopsy",
-                        "result": "Consistent with psoriasis, showing parakeratosis and Munro's microabscesses."
-                    }
-                ],
-                "prescription": [
-                    {
-                        "name": "Clobetasol Propionate Cream", "dosage": "0.05%",
-                        "frequency": "Twice daily", "duration": "4 weeks"
-                    }
-                ],
-                "treatment_summary": "Combination topical therapy with high-potency corticosteroids and vitamin D analogues. Phototherapy recommended if no improvement."
-            }
-        },
-        "DERM002": {
-            "department": "Dermatology Department",
-            "medical_records": {
-                "diagnosis": "Nodulocystic Acne",
-                "record_date": "2025-07-15",
-                "record_id": "REC-73109",
-                "follow_up_visit_count": 2, # dummy value
-                "test_results": {
-                    "bsa": 1.60,
-                    "affected_bsa_percent": 4.0,
-                    "skin_examination": "Multiple inflammatory nodules and cysts on the face, neck, and upper back. Significant scarring present."
-                },
-                "lab_reports": [
-                    { "report_name": "Hormone Panel", "result": "Within normal limits." }
-                ],
-                "prescription": [
-                    { "name": "Isotretinoin", "dosage": "40mg", "frequency": "Once daily with food", "duration": "6 months" }
-                ],
-                "treatment_summary": "Systemic therapy with oral isotretinoin initiated due to severity and scarring. Patient counseled on side effects."
-            }
-        }
-    }
-
-    if uhid in DUMMY_API_DATA:
-        return jsonify(DUMMY_API_DATA[uhid])
-
     db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    cursor.execute("SELECT * FROM Patient WHERE patient_code = %s", (uhid,))
-    patient = cursor.fetchone()
-    if not patient:
-        cursor.close()
-        return jsonify({"error": f"Patient with UHID '{uhid}' not found"}), 404
+    cursor = db.cursor()
+    response = patient_api.patient_response(cursor, request, uhid)
+    cursor.close()
+    return response
 
-    # Fetch latest prescription
-    cursor.execute("""
-        SELECT pi.medication_name, pi.dosage, pi.frequency, pi.duration
-        FROM PrescriptionItem pi
-        JOIN Prescription p ON pi.prescription_id = p.id
-        WHERE p.patient_id = %s ORDER BY p.prescription_date DESC
-    """, (patient['id'],))
-    prescriptions_db = cursor.fetchall()
-    prescription_list = [
-        {"name": item['medication_name'], "dosage": item['dosage'], 
-         "frequency": item['frequency'], "duration": item['duration']}
-        for item in prescriptions_db
-    ]
-
-    # Fetch lab reports
-    cursor.execute("SELECT report_type, file_path FROM LabReport WHERE patient_id = %s", (patient['id'],))
-    lab_reports_db = cursor.fetchall()
-    lab_reports_list = [
-        {"report_name": report['report_type'], "result": f"Report available at {report['file_path']}" if report['file_path'] else "Pending"}
-        for report in lab_reports_db
-    ]
-    cursor.execute("SELECT COUNT(id) as visit_count FROM FollowUpVisit WHERE patient_id = %s", (patient['id'],))
-    visit_count_result = cursor.fetchone()
-    visit_count = visit_count_result['visit_count'] if visit_count_result else 0
-
-    response = {
-        "department": "Dermatology Department",
-        "medical_records": {
-            "diagnosis": patient['diagnosis'],
-            "record_date": patient['date_of_registration'].strftime('%Y-%m-%d') if patient['date_of_registration'] else None,
-            "record_id": f"REC-{patient['id']}",
-            "follow_up_visit_count": visit_count,  # Placeholder; implement actual count if needed
-            "test_results": {
-                "bsa": patient['initial_bsa'],
-                "affected_bsa_percent": patient['affected_bsa_percentage'],
-                "skin_examination": patient['complaints']
-            },
-            "lab_reports": lab_reports_list,
-            "prescription": prescription_list,
-            "treatment_summary": patient['initial_treatment_plan']
-        }
-    }
+@app.route('/api/patients', methods=['GET'])
+def get_dermatology_data_batch():
+    """
+    Batch form of /api/patient/<uhid> for partner systems:
+    /api/patients?uhid=DERM-00001&uhid=DERM-00002 (or uhid=DERM-00001,DERM-00002).
+    """
+    uhids = patient_api.parse_uhids(request.args.getlist('uhid'))
+    if not uhids:
+        return jsonify({"error": "Give at least one ?uhid="}), 400
+    if len(uhids) > patient_api.MAX_BATCH:
+        return jsonify({"error": f"At most {patient_api.MAX_BATCH} patients per request"}), 400
+    db = get_db()
+    cursor = db.cursor()
+    response = patient_api.batch_response(cursor, request, uhids)
     cursor.close()
-    return jsonify(response)
+    return response
     
 @app.route('/missed_follow_ups')
 @login_required
 def missed_follow_ups():
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cursor.execute("""
-        SELECT 
-            p.id, p.patient_code, p.name, p.mobile_number,
-            latest_prescription.last_follow_up_due,
-            (CURRENT_DATE - latest_prescription.last_follow_up_due) as days_overdue
-        FROM Patient p
-        JOIN (
-            SELECT patient_id, MAX(next_follow_up_date) as last_follow_up_due
-            FROM Prescription
-            WHERE next_follow_up_date IS NOT NULL
-            GROUP BY patient_id
-        ) latest_prescription ON p.id = latest_prescription.patient_id
-        LEFT JOIN FollowUpVisit fv ON p.id = fv.patient_id AND fv.visit_date > latest_prescription.last_follow_up_due
-        WHERE latest_prescription.last_follow_up_due < CURRENT_DATE AND fv.id IS NULL
-        ORDER BY days_overdue DESC;
-    """)
-    
-    missed_patients = cursor.fetchall()
+    # Read from the per-patient follow-up state (see follow_up_state.py).
+    page = follow_up_state.missed_follow_ups_page(cursor, request.args)
+    total_missed = follow_up_state.count_missed(cursor)
     cursor.close()
     
-    return render_template('missed_follow_ups.html', patients=missed_patients)
+    return render_template('missed_follow_ups.html', patients=page['patients'], page=page,
+                           total_missed=total_missed)
 
 
 # --- Diagnostic Center (Image Gallery) ---
@@ -1410,18 +1210,17 @@ def diagnostic_center_upload():
         return redirect(url_for('diagnostic_center'))
         
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        stored = file_storage.store_upload(file, app.config['UPLOAD_FOLDER'])
         
         db = get_db()
         cursor = db.cursor()
         cursor.execute(
-            "INSERT INTO PatientImage (patient_id, file_path, upload_date, caption) VALUES (%s, %s, %s, %s)",
-            (patient_id, filename, datetime.now(), caption)
+            "INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes, content_sha256, size_bytes, original_filename) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (patient_id, stored['path'], datetime.now(), caption or 'Diagnostic Image', stored['sha256'], stored['size'], stored['original_filename'])
         )
         db.commit()
         cursor.close()
+        image_derivatives.submit(stored['path'], app.config['UPLOAD_FOLDER'])
         flash('Image uploaded and linked to patient successfully.', 'success')
     else:
         flash('File type not allowed.', 'danger')
@@ -1440,97 +1239,45 @@ def diagnostic_center_upload():
 @login_required
 @admin_required  # <-- ADD THIS DECORATOR
 def download_patient_data():
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    # This advanced query joins patient data with their latest follow-up and all their prescriptions
-    query = """
-        SELECT 
-            p.id, p.patient_code, p.name, p.gender, p.diagnosis,
-            to_char(p.date_of_registration, 'YYYY-MM-DD') as date_of_registration,
-            CASE 
-                WHEN p.dob IS NULL OR p.dob = 'infinity'::date OR p.dob = '-infinity'::date THEN NULL
-                ELSE date_part('year', age(p.dob))
-            END as age,
-            p.mobile_number, p.email, p.address, p.city, p.state, p.pincode,
-            p.initial_treatment_plan,
-            latest_follow_up.visit_date as last_follow_up_date,
-            prescriptions.all_medications
-        FROM 
-            Patient p
-        LEFT JOIN (
-            SELECT patient_id, MAX(visit_date) as visit_date
-            FROM FollowUpVisit
-            GROUP BY patient_id
-        ) latest_follow_up ON p.id = latest_follow_up.patient_id
-        LEFT JOIN (
-            SELECT pr.patient_id, STRING_AGG(pi.medication_name || ' (' || pi.dosage || ')', '; ') as all_medications
-            FROM Prescription pr
-            JOIN PrescriptionItem pi ON pr.id = pi.prescription_id
-            GROUP BY pr.patient_id
-        ) prescriptions ON p.id = prescriptions.patient_id
-    """
-    
-    filters = []
-    params = []
-    search_params = request.args
-    # (The filtering logic remains the same as before)
-    if search_params:
-        patient_id = search_params.get('patient_id')
-        mobile = search_params.get('mobile')
-        if patient_id:
-            filters.append("(LOWER(p.patient_code) LIKE %s OR CAST(p.id AS TEXT) LIKE %s)")
-            params.extend([f"%{patient_id.lower()}%", f"%{patient_id}%"])
-        if mobile:
-            filters.append("p.mobile_number LIKE %s")
-            params.append(f"%{mobile}%")
-            
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-    query += " ORDER BY p.id DESC"
-    
-    cursor.execute(query, tuple(params))
-    patients = cursor.fetchall()
-    cursor.close()
-
-    # --- CSV Generation Logic ---
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Define the new, more detailed header row
-    header = [
-        'Patient Code', 'Name', 'Age', 'Gender', 'Initial Diagnosis', 
-        'Registration Date', 'Mobile', 'Email', 'Initial Treatment', 
-        'Last Follow-up Date', 'Prescribed Medications'
-    ]
-    writer.writerow(header)
-    
-    # Write the new data for each row
-    for patient in patients:
-        row = [
-            patient['patient_code'], 
-            patient['name'], 
-            patient['age'], 
-            patient['gender'],
-            patient['diagnosis'], 
-            patient['date_of_registration'], 
-            patient['mobile_number'],
-            patient['email'],
-            patient['initial_treatment_plan'],
-            patient['last_follow_up_date'],
-            patient['all_medications']
-        ]
-        writer.writerow(row)
-    
-    output.seek(0)
-    
-    # Create a Flask response to send the file
-    response = make_response(output.getvalue())
-    response.headers["Content-Disposition"] = "attachment; filename=patient_detailed_export.csv"
-    response.headers["Content-type"] = "text/csv"
-    
+    # Patients with their latest follow-up and all their prescribed medications,
+    # streamed row batch by row batch (see patient_export.py). ?gzip=1 compresses it.
+    compress = request.args.get('gzip') in ('1', 'true', 'yes')
+    filename = "patient_detailed_export.csv.gz" if compress else "patient_detailed_export.csv"
+    response = Response(stream_export(request.args, compress=compress),
+                        mimetype="application/gzip" if compress else "text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["X-Accel-Buffering"] = "no"
     return response
 
+@app.route('/patients/import', methods=['POST'])
+@login_required
+@admin_required
+def import_patient_data():
+    # Bulk registration from an uploaded CSV / JSON Lines file (see patient_import.py).
+    # Returns a JSON report; rejected rows are listed with the reason.
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'Upload a CSV or JSON Lines file as "file".'}), 400
+    fmt = request.form.get('format') or patient_import.detect_format(upload.filename)
+    if fmt not in patient_import.FORMATS:
+        return jsonify({'error': 'Unknown file format; pass format=csv or format=jsonl.'}), 400
+
+    db = get_db()
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        report = patient_import.import_patients(db, stream, fmt, session.get('user_id'),
+                                                dry_run=request.form.get('dry_run') in ('1', 'true', 'yes'))
+    except ValueError as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 400
+    except psycopg2.Error as e:
+        db.rollback()
+        logging.error(f"Patient import failed: {e}")
+        return jsonify({'error': 'Database error; no patients were imported.'}), 500
+    report['rejects_truncated'] = len(report['rejects']) > patient_import.MAX_REPORTED_REJECTS
+    report['rejects'] = report['rejects'][:patient_import.MAX_REPORTED_REJECTS]
+    return jsonify(report)
+
 # --- ADD THIS NEW FUNCTION to app.py ---
 
 
@@ -1752,16 +1499,15 @@ def mobile_upload(patient_id):
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            stored = file_storage.store_upload(file, app.config['UPLOAD_FOLDER'])
             
           
             cursor.execute(
-                "INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes) VALUES (%s, %s, %s, %s)",
-                (patient_id, filename, datetime.now().date(), 'Uploaded via mobile')
+                "INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes, content_sha256, size_bytes, original_filename) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (patient_id, stored['path'], datetime.now().date(), 'Uploaded via mobile', stored['sha256'], stored['size'], stored['original_filename'])
             )
             db.commit()
+            image_derivatives.submit(stored['path'], app.config['UPLOAD_FOLDER'])
             flash(f'Image for {patient["name"]} uploaded successfully!', 'success')
         else:
             flash('File type not allowed.', 'danger')
@@ -1780,30 +1526,25 @@ def mobile_upload(patient_id):
 @login_required
 def search_patients():
     """
-    API endpoint that ONLY searches the local 'Patient' table
-    to find existing patients that can be edited.
+    Patient autocomplete: patients whose name, code or mobile number contains q.
+    Answered from the in-memory index (patient_autocomplete.py); the Patient
+    table is only queried while the index is loading.
     """
-    query = request.args.get('q', '')
-    if len(query) < 2:
-        return jsonify([])
+    started = time.perf_counter()
+    query = request.args.get('q', '').strip()
+    if len(query) < patient_autocomplete.AUTOCOMPLETE_CONFIG['min_length']:
+        return patient_autocomplete.set_response_headers(jsonify([]), query, 'none', started)
+
+    patients = patient_autocomplete.search(query)
+    source = 'memory'
+    if patients is None:
+        source = 'database'
+        db = get_db()
+        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        patients = patient_autocomplete.search_database(cursor, query)
+        cursor.close()
 
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    sql = """
-        SELECT id, patient_code, name 
-        FROM Patient
-        WHERE name ILIKE %s OR patient_code ILIKE %s
-        ORDER BY name
-        LIMIT 10;
-        
-    """
-    search_term = f"%{query}%"
-    cursor.execute(sql, (search_term, search_term))
-    patients = [dict(row) for row in cursor.fetchall()]
-    cursor.close()
-    
-    return jsonify(patients)
+    return patient_autocomplete.set_response_headers(jsonify(patients), query, source, started)
 
 
 
@@ -1829,17 +1570,19 @@ def patient_visit():
 
             # Save the visit details to the database
             sql = """
-                INSERT INTO FollowUpVisit (patient_id, doctor_id, visit_date, complaints, 
-                                           examination_findings, diagnosis, treatment_plan) 
+                INSERT INTO FollowUpVisit (patient_id, doctor_id, visit_date, updated_complaints,
+                                           updated_examination, diagnosis, updated_treatment_plan)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
             """
+            visit_date = date.today()
             cursor.execute(sql, (
-                patient_id, session['user_id'], date.today(), 
+                patient_id, session['user_id'], visit_date,
                 request.form.get('complaints'), 
                 request.form.get('examination_findings'), 
                 request.form.get('diagnosis'), 
                 request.form.get('updated_treatment_plan')
             ))
+            follow_up_state.record_visit(cursor, patient_id, visit_date)
             db.commit()
             flash('Follow-up visit recorded successfully.', 'success')
             return redirect(url_for('patient_detail', patient_id=patient_id))
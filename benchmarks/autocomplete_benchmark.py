@@ -0,0 +1,163 @@
+# benchmarks/autocomplete_benchmark.py
+# Compares the patient autocomplete answered from the in-memory trigram index
+# (patient_autocomplete.PatientIndex) with the ILIKE query it replaces.
+#
+# Seeds --patients temporary 'BENCH-A' patients (default 100,000) with realistic
+# name, code and mobile number spreads, then runs keystroke-like queries of
+# different selectivity --repeat times through both paths and reports p50 / p99 /
+# max latency. Also reports the index load time and memory, and how long a
+# committed rename takes to reach a listening index (the NOTIFY path).
+#
+#     python -m benchmarks.autocomplete_benchmark --patients 100000
+#
+# The seeded rows are removed again afterwards unless --keep is given.
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import init_db  # noqa: E402
+import patient_autocomplete  # noqa: E402
+
+FIRST_NAMES = ['Aarav', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Kavya', 'Rohan', 'Meera',
+               'Imran', 'Fatima', 'Suresh', 'Lakshmi', 'Joseph', 'Mary', 'Karthik', 'Divya', 'Naveen', 'Pooja']
+LAST_NAMES = ['Sharma', 'Reddy', 'Khan', 'Iyer', 'Nair', 'Patel', 'Gupta', 'Rao', 'Singh', 'Das',
+              'Menon', 'Pillai', 'Joshi', 'Verma', 'Fernandes', 'Kulkarni', 'Ahmed', 'Bose', 'Chopra', 'Mehta']
+
+QUERIES = [
+    ('two letters', 'an'),
+    ('name prefix', 'pri'),
+    ('full name', 'priya reddy'),
+    ('surname', 'fernandes'),
+    ('code fragment', '04217'),
+    ('full code', 'BENCH-A042170'),
+    ('mobile fragment', '98413'),
+    ('no match', 'zqxj'),
+]
+
+
+def seed(conn, patients):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO Patient (patient_code, name, dob, gender, mobile_number, date_of_registration)
+            SELECT 'BENCH-A' || lpad(g::text, 6, '0'),
+                   (%(first)s::text[])[1 + g %% 20] || ' ' || (%(last)s::text[])[1 + (g / 20) %% 20]
+                       || CASE WHEN g %% 7 = 0 THEN ' ' || chr(65 + g %% 26) ELSE '' END,
+                   DATE '1950-01-01' + g %% 25000, 'Other',
+                   '9' || lpad(((g::bigint * 7919) %% 1000000000)::text, 9, '0'),
+                   CURRENT_DATE
+            FROM generate_series(1, %(patients)s) g
+        """, {'first': FIRST_NAMES, 'last': LAST_NAMES, 'patients': patients})
+        cursor.execute("ANALYZE Patient")
+    conn.commit()
+
+def remove(conn):
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM Patient WHERE patient_code LIKE 'BENCH-A%'")
+    conn.commit()
+
+
+def _summary(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p99_ms': round(timings[max(int(len(timings) * 0.99) - 1, 0)] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+    }
+
+def run_query(conn, index, label, query, repeat):
+    memory_timings, sql_timings = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        from_index = index.search(query)
+        memory_timings.append(time.perf_counter() - started)
+    with conn.cursor() as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            from_sql = patient_autocomplete.search_database(cursor, query)
+            sql_timings.append(time.perf_counter() - started)
+    conn.rollback()
+    return {
+        'query': label,
+        'q': query,
+        'matches': len(from_index),
+        # Names can tie or sort differently under the database collation.
+        'same_names_as_sql': sorted(p['name'] for p in from_index) == sorted(p['name'] for p in from_sql),
+        'memory': _summary(memory_timings),
+        'sql': _summary(sql_timings),
+    }
+
+def notification_lag(conn, timeout=10.0):
+    """Milliseconds from committing a rename until a listening index returns it."""
+    listener = patient_autocomplete.IndexListener(resync_interval=3600.0, retry_interval=1.0)
+    listener.start()
+    try:
+        deadline = time.monotonic() + 120
+        while listener.index is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE Patient SET name = 'Qwyzzle Benchmark'
+                WHERE id = (SELECT MIN(id) FROM Patient WHERE patient_code LIKE 'BENCH-A%%')
+            """)
+        conn.commit()
+        committed = time.perf_counter()
+        while time.perf_counter() - committed < timeout:
+            if listener.index is not None and listener.index.search('qwyzzle'):
+                return round((time.perf_counter() - committed) * 1000, 1)
+            time.sleep(0.001)
+        return None
+    finally:
+        listener.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory patient autocomplete against SQL.")
+    parser.add_argument("--patients", type=int, default=100000, help="patients to seed (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=200, help="runs per query and path (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="leave the seeded patients in the database")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM Patient WHERE patient_code LIKE 'BENCH-A%'")
+            seeded = cursor.fetchone()[0] > 0
+        if not seeded:
+            print(f"Seeding {args.patients} patients...")
+            seed(conn, args.patients)
+
+        started = time.perf_counter()
+        index = patient_autocomplete.load_index(conn)
+        load_seconds = time.perf_counter() - started
+        tracemalloc.start()
+        measured = patient_autocomplete.load_index(conn)
+        index_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del measured
+
+        report = [run_query(conn, index, label, query, args.repeat) for label, query in QUERIES]
+        print(json.dumps({
+            'patients': len(index),
+            'index_load_s': round(load_seconds, 2),
+            'index_memory_mb': round(index_bytes / 2 ** 20, 1),
+            'notification_lag_ms': notification_lag(conn),
+            'queries': report,
+        }, indent=2))
+    finally:
+        if not args.keep:
+            remove(conn)
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# benchmarks/clinical_search_benchmark.py
+# Measures /api/clinical_search (clinical_search.search) on a large note set.
+#
+# Seeds --notes daily progress notes (default one million) spread over 1,000
+# temporary 'BENCH-' patients, through the normal triggers, so the insert time
+# includes indexing. The notes mix terms of very different frequency:
+#   common    "lesions", "plaques" ... in every note (ranking hits CANDIDATE_CAP)
+#   medium    "methotrexate" in 1 of 20 notes
+#   rare      "tacrolimus" in 1 of 997 notes
+# Each query is run --repeat times; p50 / p95 / max latencies are reported.
+#
+#     python -m benchmarks.clinical_search_benchmark --notes 1000000
+#
+# The seeded rows are removed again afterwards unless --keep is given.
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+import psycopg2.extras
+from werkzeug.datastructures import MultiDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clinical_search  # noqa: E402
+import init_db  # noqa: E402
+
+BATCH = 100000
+PATIENTS = 1000
+
+QUERIES = [
+    ('rare term', {'q': 'tacrolimus'}),
+    ('medium term', {'q': 'methotrexate'}),
+    ('common term', {'q': 'lesions'}),
+    ('common term, page 10', {'q': 'lesions', 'page': '10'}),
+    ('two terms', {'q': 'methotrexate nausea'}),
+    ('phrase', {'q': '"tacrolimus ointment"'}),
+    ('one patient', {'q': 'methotrexate', 'patient_id': None}),
+    ('no match', {'q': 'infliximab'}),
+]
+
+
+def seed(conn, notes):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO Users (username, password_hash, role_id) "
+                       "VALUES ('bench_search_user', '-', (SELECT MIN(id) FROM Roles)) RETURNING id")
+        doctor_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO Patient (patient_code, name, dob, gender, date_of_registration)
+            SELECT 'BENCH-S' || g, 'Search Bench ' || g, DATE '1970-01-01' + g, 'Other', CURRENT_DATE - 400
+            FROM generate_series(1, %s) g
+        """, (PATIENTS,))
+        cursor.execute("INSERT INTO Bed (bed_number, status) VALUES ('BENCH-S-BED', 'Available') RETURNING id")
+        bed_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO BedAssignment (patient_id, bed_id, admission_date, discharge_date)
+            SELECT id, %s, CURRENT_DATE - 400, CURRENT_DATE - 390
+            FROM Patient WHERE patient_code LIKE 'BENCH-S%%'
+        """, (bed_id,))
+        cursor.execute("""
+            SELECT MIN(ba.id), MAX(ba.id) FROM BedAssignment ba WHERE ba.bed_id = %s
+        """, (bed_id,))
+        first_assignment, last_assignment = cursor.fetchone()
+    conn.commit()
+
+    started = time.perf_counter()
+    for offset in range(0, notes, BATCH):
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO DailyProgressNote (assignment_id, note_date, notes, doctor_id)
+                SELECT %(first)s + g %% (%(last)s - %(first)s + 1),
+                       NOW() - g * INTERVAL '1 minute',
+                       concat_ws(' ',
+                           (ARRAY['Lesions settling, plaques thinner.',
+                                  'New lesions on forearms; plaques scaly.',
+                                  'Lesions unchanged, plaques itchy at night.',
+                                  'Fewer lesions, plaques flattening, mild erythema.'])[1 + g %% 4],
+                           CASE WHEN g %% 20 = 0 THEN 'Continue methotrexate 15mg weekly.' END,
+                           CASE WHEN g %% 60 = 0 THEN 'Complains of nausea.' END,
+                           CASE WHEN g %% 997 = 0 THEN 'Started tacrolimus ointment twice daily.' END,
+                           'Review ' || (ARRAY['tomorrow', 'in two days', 'next week'])[1 + g %% 3] || '.')
+                       , %(doctor)s
+                FROM generate_series(%(start)s, %(stop)s) g
+            """, {'first': first_assignment, 'last': last_assignment, 'doctor': doctor_id,
+                  'start': offset + 1, 'stop': min(offset + BATCH, notes)})
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE ClinicalSearchDocument")
+    conn.commit()
+    return elapsed
+
+def remove(conn):
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            DELETE FROM DailyProgressNote WHERE assignment_id IN
+                (SELECT ba.id FROM BedAssignment ba JOIN Bed b ON b.id = ba.bed_id WHERE b.bed_number = 'BENCH-S-BED')
+        """)
+        cursor.execute("DELETE FROM BedAssignment WHERE bed_id IN (SELECT id FROM Bed WHERE bed_number = 'BENCH-S-BED')")
+        cursor.execute("DELETE FROM Bed WHERE bed_number = 'BENCH-S-BED'")
+        cursor.execute("DELETE FROM Patient WHERE patient_code LIKE 'BENCH-S%'")
+        cursor.execute("DELETE FROM Users WHERE username = 'bench_search_user'")
+    conn.commit()
+
+
+def run_query(conn, label, args, repeat):
+    timings = []
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            page = clinical_search.search(cursor, MultiDict(args))
+            timings.append(time.perf_counter() - started)
+    conn.rollback()
+    timings.sort()
+    return {
+        'query': label,
+        'matches': page['total'],
+        'capped': page['capped'],
+        'p50_ms': round(statistics.median(timings) * 1000, 1),
+        'p95_ms': round(timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000, 1),
+        'max_ms': round(timings[-1] * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the clinical full-text search.")
+    parser.add_argument("--notes", type=int, default=1000000, help="progress notes to seed (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per query (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="leave the seeded notes in the database")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM Patient WHERE patient_code LIKE 'BENCH-S%'")
+            seeded = cursor.fetchone()[0] > 0
+        if not seeded:
+            print(f"Seeding {args.notes} progress notes...")
+            seconds = seed(conn, args.notes)
+            print(f"Inserted and indexed in {seconds:.1f} s ({args.notes / seconds:.0f} notes/s).")
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM ClinicalSearchDocument")
+            documents = cursor.fetchone()[0]
+            cursor.execute("SELECT MIN(id) FROM Patient WHERE patient_code LIKE 'BENCH-S%'")
+            patient_id = cursor.fetchone()[0]
+        conn.rollback()
+
+        report = []
+        for label, query in QUERIES:
+            if 'patient_id' in query:
+                query = dict(query, patient_id=str(patient_id))
+            report.append(run_query(conn, label, query, args.repeat))
+        print(json.dumps({'documents': documents, 'queries': report}, indent=2))
+    finally:
+        if not args.keep:
+            remove(conn)
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
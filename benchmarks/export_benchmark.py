@@ -0,0 +1,155 @@
+# benchmarks/export_benchmark.py
+# Compares the streamed /patients/download export with the previous implementation
+# (fetchall() into a DictCursor, whole CSV built in a StringIO) on a large dataset.
+#
+# For each mode it reports time-to-first-byte, total time, bytes produced and the
+# peak memory of the process doing the export. Every mode runs in a freshly forked
+# child process so the resident-set high-water marks do not mask each other; the
+# libpq result buffer of fetchall() is counted too (tracemalloc alone would miss it).
+#
+#     python -m benchmarks.export_benchmark --patients 100000
+#
+# The patients are seeded with init_db.seed_verification_data() ('VRFY-' codes) and
+# removed again afterwards unless --keep is given.
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import psycopg2
+import psycopg2.extras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import init_db  # noqa: E402
+import db_pool  # noqa: E402
+
+
+def legacy_export(db_conn, query):
+    """The export as it was: every row fetched, then the whole CSV built in memory."""
+    cursor = db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(query)
+    patients = cursor.fetchall()
+    cursor.close()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Patient Code', 'Name', 'Age', 'Gender', 'Initial Diagnosis',
+                     'Registration Date', 'Mobile', 'Email', 'Initial Treatment',
+                     'Last Follow-up Date', 'Prescribed Medications'])
+    for patient in patients:
+        writer.writerow([patient['patient_code'], patient['name'], patient['age'], patient['gender'],
+                         patient['diagnosis'], patient['date_of_registration'], patient['mobile_number'],
+                         patient['email'], patient['initial_treatment_plan'],
+                         patient['last_follow_up_date'], patient['all_medications']])
+    output.seek(0)
+    return [output.getvalue().encode('utf-8')]
+
+LEGACY_QUERY = """
+    SELECT
+        p.id, p.patient_code, p.name, p.gender, p.diagnosis,
+        to_char(p.date_of_registration, 'YYYY-MM-DD') as date_of_registration,
+        CASE
+            WHEN p.dob IS NULL OR p.dob = 'infinity'::date OR p.dob = '-infinity'::date THEN NULL
+            ELSE date_part('year', age(p.dob))
+        END as age,
+        p.mobile_number, p.email, p.address, p.city, p.state, p.pincode,
+        p.initial_treatment_plan,
+        latest_follow_up.visit_date as last_follow_up_date,
+        prescriptions.all_medications
+    FROM Patient p
+    LEFT JOIN (
+        SELECT patient_id, MAX(visit_date) as visit_date
+        FROM FollowUpVisit
+        GROUP BY patient_id
+    ) latest_follow_up ON p.id = latest_follow_up.patient_id
+    LEFT JOIN (
+        SELECT pr.patient_id, STRING_AGG(pi.medication_name || ' (' || pi.dosage || ')', '; ') as all_medications
+        FROM Prescription pr
+        JOIN PrescriptionItem pi ON pr.id = pi.prescription_id
+        GROUP BY pr.patient_id
+    ) prescriptions ON p.id = prescriptions.patient_id
+    ORDER BY p.id DESC
+"""
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _run_mode(mode, results):
+    import app as app_module  # imported in the child so each mode starts from the same state
+
+    baseline_kb = _max_rss_kb()
+    started = time.perf_counter()
+    if mode == 'legacy':
+        with db_pool.connection() as db_conn:
+            chunks = iter(legacy_export(db_conn, LEGACY_QUERY))
+    else:
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['role_id'] = 1
+        url = '/patients/download?gzip=1' if mode == 'streaming-gzip' else '/patients/download'
+        response = client.get(url, buffered=False)
+        chunks = response.response
+    first_byte = None
+    total_bytes = 0
+    for chunk in chunks:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - started
+        total_bytes += len(chunk)
+    if hasattr(chunks, 'close'):
+        chunks.close()
+    elapsed = time.perf_counter() - started
+    results.put({
+        'mode': mode,
+        'ttfb_ms': round((first_byte or elapsed) * 1000, 1),
+        'total_ms': round(elapsed * 1000, 1),
+        'bytes': total_bytes,
+        'peak_rss_growth_mb': round((_max_rss_kb() - baseline_kb) / 1024, 1),
+    })
+
+def run_mode(mode):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    child = ctx.Process(target=_run_mode, args=(mode, results))
+    child.start()
+    result = results.get()
+    child.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the patient CSV export.")
+    parser.add_argument("--patients", type=int, default=100000, help="patients to seed (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="leave the seeded patients in the database")
+    parser.add_argument("--modes", default="legacy,streaming,streaming-gzip",
+                        help="comma-separated modes to run (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM Patient WHERE patient_code LIKE 'VRFY-%'")
+            if cursor.fetchone()[0] == 0:
+                print(f"Seeding {args.patients} patients...")
+                init_db.seed_verification_data(cursor, args.patients)
+        conn.commit()
+
+        report = [run_mode(mode) for mode in args.modes.split(',')]
+        print(json.dumps(report, indent=2))
+    finally:
+        if not args.keep:
+            with conn.cursor() as cursor:
+                init_db.remove_verification_data(cursor)
+            conn.commit()
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
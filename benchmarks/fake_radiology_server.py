@@ -0,0 +1,319 @@
+# benchmarks/fake_radiology_server.py
+# A local stand-in for the radiology server, for trying out and load-testing the
+# radiology integration (radiology_api.py, radiology_jobs.py) without the real one.
+#
+#   POST /api/v1/get_or_request_scan   202 {"request_id"}; with --immediate, the scan itself
+#   GET  /api/request_status/<id>      {"status": "pending" | "completed", "scan_id"}
+#   GET  /api/scans/download/<scan_id> the scan (application/dicom, with Content-Length)
+#   GET  /_stats                       requests per endpoint, connections and callbacks sent
+#
+# Ordering the same uhid / type_of_scan / body_part again yields the same study and
+# scan_id. Scans carry an ETag and Last-Modified, and a request with a matching
+# If-None-Match (or, without one, If-Modified-Since) is answered 304 Not Modified,
+# like radiology_cache.py expects; immediate answers also name the X-Scan-Id.
+# Downloads send the scan's SHA-256 in Repr-Digest and honour single Range requests
+# (with If-Range) unless --no-ranges is given, as radiology_download.py uses them.
+# --bandwidth caps each response (in MB/s, like a long-distance link) and
+# --truncate-rate breaks that share of scan bodies off half way, to exercise resuming.
+# An order is ready --ready-after seconds after it was placed. If the order carried a
+# callback_url, the server then POSTs {"request_id", "status": "completed", "scan_id"}
+# to it, signed with --secret like radiology_api.RADIOLOGY_CALLBACK_CONFIG expects, and
+# retries a few times while the answer is not 2xx. --latency delays every answer and
+# --fail-rate answers that share of requests with 503, to exercise the circuit breaker.
+# It speaks HTTP/1.1 keep-alive, unlike the Flask development server.
+#
+#     python -m benchmarks.fake_radiology_server --port 5000 --ready-after 5 --secret s3cret
+#
+# Point radiology_api.RADIOLOGY_API_HOST at it. Benchmarks can also run it in-process
+# with start(), which returns the server; server.url is its address.
+import argparse
+import base64
+import email.utils
+import hashlib
+import hmac
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+CALLBACK_RETRIES = 4
+WRITE_SIZE = 64 * 1024
+
+
+class FakeRadiologyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, ready_after=3.0, latency=0.0, fail_rate=0.0, scan_size=512 * 1024,
+                 immediate=False, secret=None, ranges=True, bandwidth=None, truncate_rate=0.0):
+        super().__init__(address, _Handler)
+        self.ready_after = ready_after
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.scan_size = scan_size
+        self.immediate = immediate
+        self.secret = secret
+        self.ranges = ranges
+        self.bandwidth = bandwidth          # bytes per second per response, None: unlimited
+        self.truncate_rate = truncate_rate
+        self.url = f"http://{self.server_address[0]}:{self.server_address[1]}"
+        self._lock = threading.Lock()
+        self._orders = {}      # request_id -> (ready_at, scan_id)
+        self._studies = {}     # (uhid, type_of_scan, body_part) -> scan_id
+        self._scans = {}       # scan_id -> (bytes, etag, last_modified, repr_digest)
+        self._next_id = 0
+        self._rng = random.Random(0)
+        self.stats = Counter()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def should_fail(self):
+        with self._lock:
+            return self.fail_rate and self._rng.random() < self.fail_rate
+
+    def should_truncate(self):
+        with self._lock:
+            return self.truncate_rate and self._rng.random() < self.truncate_rate
+
+    def place_order(self, study, callback_url):
+        with self._lock:
+            self._next_id += 1
+            request_id = f"REQ-{self._next_id}"
+            scan_id = self._studies.setdefault(study, f"SCAN-{len(self._studies) + 1}")
+            self._orders[request_id] = (time.monotonic() + self.ready_after, scan_id)
+        if callback_url:
+            timer = threading.Timer(self.ready_after, self._send_callback, (callback_url, request_id, scan_id))
+            timer.daemon = True
+            timer.start()
+        return request_id, scan_id
+
+    def order_status(self, request_id):
+        with self._lock:
+            order = self._orders.get(request_id)
+        if order is None:
+            return None
+        ready_at, scan_id = order
+        return ('completed', scan_id) if time.monotonic() >= ready_at else ('pending', None)
+
+    def scan(self, scan_id):
+        """
+        A scan as (bytes, etag, last_modified, repr_digest): a DICOM preamble and
+        prefix, then deterministic filler.
+        """
+        with self._lock:
+            scan = self._scans.get(scan_id)
+            if scan is None:
+                filler = random.Random(scan_id).randbytes(max(0, self.scan_size - 132))
+                data = b"\0" * 128 + b"DICM" + filler
+                digest = hashlib.sha256(data).digest()
+                scan = self._scans[scan_id] = (data, f'"{digest.hex()[:32]}"', email.utils.formatdate(usegmt=True),
+                                               f"sha-256=:{base64.b64encode(digest).decode()}:")
+        return scan
+
+    def _send_callback(self, callback_url, request_id, scan_id):
+        body = json.dumps({'request_id': request_id, 'status': 'completed', 'scan_id': scan_id}).encode()
+        for attempt in range(CALLBACK_RETRIES):
+            timestamp = int(time.time())
+            headers = {'Content-Type': 'application/json'}
+            if self.secret:
+                signature = hmac.new(self.secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+                headers['X-Radiology-Signature'] = f"t={timestamp},v1={signature}"
+            try:
+                response = requests.post(callback_url, data=body, headers=headers, timeout=10)
+                self.count(f"callback_{response.status_code}")
+                if response.ok:
+                    return
+            except requests.RequestException:
+                self.count("callback_error")
+            time.sleep(2 ** attempt)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeRadiology/1.0'
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json(self, status, data):
+        self._send(status, json.dumps(data).encode())
+
+    def _write_scan(self, body):
+        """Writes a scan body at --bandwidth; with --truncate-rate it may break off half way."""
+        end = len(body) // 2 if len(body) > 1 and self.server.should_truncate() else len(body)
+        for offset in range(0, end, WRITE_SIZE):
+            piece = body[offset:min(offset + WRITE_SIZE, end)]
+            self.wfile.write(piece)
+            if self.server.bandwidth:
+                time.sleep(len(piece) / self.server.bandwidth)
+        if end < len(body):
+            self.server.count('truncated')
+            self.close_connection = True
+
+    def _byte_range(self, size, etag, last_modified):
+        """
+        The (first, last) bytes of a single Range request, None to send the whole scan,
+        or False if the range cannot be satisfied.
+        """
+        range_header = self.headers.get('Range')
+        if not (self.server.ranges and self.command == 'GET' and range_header):
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range not in (etag, last_modified):
+            return None
+        try:
+            unit, spec = range_header.split('=', 1)
+            first, last = spec.split('-', 1)
+            if unit.strip() != 'bytes' or ',' in spec:
+                return None
+            if not first:
+                first, last = max(0, size - int(last)), size - 1
+            else:
+                first, last = int(first), min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        return (first, last) if first <= last else False
+
+    def _send_scan(self, scan_id):
+        data, etag, last_modified, repr_digest = self.server.scan(scan_id)
+        headers = [('ETag', etag), ('Last-Modified', last_modified), ('X-Scan-Id', scan_id),
+                   ('Repr-Digest', repr_digest)]
+        if self.server.ranges:
+            headers.append(('Accept-Ranges', 'bytes'))
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            not_modified = if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+        else:
+            since = self.headers.get('If-Modified-Since')
+            try:
+                not_modified = bool(since) and (email.utils.parsedate_to_datetime(since)
+                                                >= email.utils.parsedate_to_datetime(last_modified))
+            except (TypeError, ValueError):
+                not_modified = False
+        if not_modified:
+            self.server.count('not_modified')
+            self.send_response(304)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        byte_range = self._byte_range(len(data), etag, last_modified)
+        if byte_range is False:
+            return self._send(416, b"", 'application/dicom', headers + [('Content-Range', f"bytes */{len(data)}")])
+        status, body = 200, data
+        if byte_range:
+            self.server.count('ranges')
+            status, body = 206, data[byte_range[0]:byte_range[1] + 1]
+            headers.append(('Content-Range', f"bytes {byte_range[0]}-{byte_range[1]}/{len(data)}"))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/dicom')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self._write_scan(body)
+
+    def _begin(self, endpoint):
+        self.server.count(endpoint)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self.server.count('failed')
+            self._json(503, {'error': 'Injected failure'})
+            return False
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.path != '/api/v1/get_or_request_scan':
+            return self._json(404, {'error': 'Not found'})
+        if not self._begin('submit'):
+            return
+        try:
+            order = json.loads(body)
+            if not (order.get('uhid') and order.get('type_of_scan') and order.get('body_part')):
+                raise ValueError
+        except (ValueError, AttributeError):
+            return self._json(400, {'error': 'uhid, type_of_scan and body_part are required'})
+        study = (order['uhid'], order['type_of_scan'].upper(), order['body_part'].upper())
+        request_id, scan_id = self.server.place_order(study, None if self.server.immediate else order.get('callback_url'))
+        if self.server.immediate:
+            return self._send_scan(scan_id)
+        self._json(202, {'request_id': request_id})
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            with self.server._lock:
+                return self._json(200, dict(self.server.stats))
+        if self.path.startswith('/api/request_status/'):
+            if not self._begin('status'):
+                return
+            status = self.server.order_status(self.path.rsplit('/', 1)[1])
+            if status is None:
+                return self._json(404, {'error': 'Unknown request'})
+            return self._json(200, {'status': status[0], 'scan_id': status[1]})
+        if self.path.startswith('/api/scans/download/'):
+            if not self._begin('download'):
+                return
+            return self._send_scan(self.path.rsplit('/', 1)[1])
+        self._json(404, {'error': 'Not found'})
+
+
+def start(host='127.0.0.1', port=0, **options):
+    """Runs a server in a background thread (port 0: any free port) and returns it."""
+    server = FakeRadiologyServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="fake-radiology", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake radiology server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000, help="(default: %(default)s)")
+    parser.add_argument("--ready-after", type=float, default=3.0,
+                        help="seconds until an order's scan is ready (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--scan-kb", type=int, default=512, help="size of a scan (default: %(default)s)")
+    parser.add_argument("--immediate", action="store_true", help="answer orders with the scan at once")
+    parser.add_argument("--secret", help="callback signing secret (RADIOLOGY_CALLBACK_CONFIG['secret'])")
+    parser.add_argument("--no-ranges", action="store_true", help="ignore Range requests")
+    parser.add_argument("--bandwidth", type=float, help="MB/s per response (default: unlimited)")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of scan bodies broken off half way")
+    args = parser.parse_args(argv)
+    server = FakeRadiologyServer((args.host, args.port), ready_after=args.ready_after, latency=args.latency,
+                                 fail_rate=args.fail_rate, scan_size=args.scan_kb * 1024,
+                                 immediate=args.immediate, secret=args.secret, ranges=not args.no_ranges,
+                                 bandwidth=args.bandwidth and args.bandwidth * 1024 * 1024,
+                                 truncate_rate=args.truncate_rate)
+    print(f"Fake radiology server on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
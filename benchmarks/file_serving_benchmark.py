@@ -0,0 +1,142 @@
+# benchmarks/file_serving_benchmark.py
+# Compares the previous /uploads route (a bare send_from_directory) with
+# file_serving.serve_upload for a gallery-sized image and a large DICOM-sized file.
+#
+# Modes, each run through the Flask test client against a temporary upload folder:
+#   legacy        send_from_directory, the whole file (no access check)
+#   full          new route, the whole file (access check + strong ETag)
+#   revalidate    new route with If-None-Match: a 304, no body
+#   range         new route, a Range slice of 1 MB (at most half the file): 206
+#   x-accel       new route with offload = 'x-accel-redirect': headers only
+#
+#     python -m benchmarks.file_serving_benchmark --requests 200 --large-mb 64
+#
+# The files are stored with file_storage and referenced from a temporary 'BENCH-'
+# patient, which is removed again afterwards.
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import init_db  # noqa: E402
+import file_serving  # noqa: E402
+import file_storage  # noqa: E402
+
+MODES = ('legacy', 'full', 'revalidate', 'range', 'x-accel')
+RANGE_SIZE = 1024 * 1024
+
+
+def _seed_files(conn, upload_folder, large_mb):
+    """Stores a small and a large file and references them from a temporary patient."""
+    small = file_storage.store_chunks([os.urandom(200 * 1024)], 'photo.jpg', upload_folder)
+    large = file_storage.store_chunks((os.urandom(1024 * 1024) for _ in range(large_mb)),
+                                      'study.dcm', upload_folder)
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO Patient (patient_code, name, dob, gender, date_of_registration)
+            VALUES ('BENCH-FILES', 'File serving benchmark', '1980-01-01', 'Other', CURRENT_DATE)
+            RETURNING id
+        """)
+        patient_id = cursor.fetchone()[0]
+        for stored in (small, large):
+            cursor.execute("""
+                INSERT INTO PatientImage (patient_id, image_filename, notes, upload_date,
+                                          content_sha256, size_bytes, original_filename)
+                VALUES (%s, %s, 'benchmark', NOW(), %s, %s, %s)
+            """, (patient_id, stored['path'], stored['sha256'], stored['size'], stored['original_filename']))
+    conn.commit()
+    return {'small': small, 'large': large}
+
+def _remove_files(conn):
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM Patient WHERE patient_code = 'BENCH-FILES'")
+    conn.commit()
+
+
+def run_mode(app, mode, stored, requests_count):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['role_id'] = 1
+    path = stored['path']
+    url = f"/_bench/legacy/{path}" if mode == 'legacy' else f"/uploads/{path}"
+    headers = {}
+    if mode == 'revalidate':
+        headers['If-None-Match'] = f'"{stored["sha256"]}"'
+    elif mode == 'range':
+        headers['Range'] = f"bytes=0-{min(RANGE_SIZE, stored['size'] // 2) - 1}"
+    file_serving.FILE_SERVING_CONFIG['offload'] = 'x-accel-redirect' if mode == 'x-accel' else None
+
+    client.get(url, headers=headers).close()  # warm-up
+    timings = []
+    total_bytes = 0
+    status = None
+    for _ in range(requests_count):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        body = response.get_data()
+        timings.append(time.perf_counter() - started)
+        total_bytes += len(body)
+        status = response.status_code
+        response.close()
+    file_serving.FILE_SERVING_CONFIG['offload'] = None
+
+    timings.sort()
+    return {
+        'mode': mode,
+        'status': status,
+        'p50_ms': round(statistics.median(timings) * 1000, 2),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1] * 1000, 2),
+        'requests_per_s': round(len(timings) / sum(timings), 1),
+        'body_bytes_per_request': total_bytes // len(timings),
+        'cache_control': response.headers.get('Cache-Control'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark serving of uploaded files.")
+    parser.add_argument("--requests", type=int, default=200, help="requests per mode (default: %(default)s)")
+    parser.add_argument("--large-mb", type=int, default=64, help="size of the large file (default: %(default)s)")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated modes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    import app as app_module
+    from flask import send_from_directory
+
+    app = app_module.app
+    upload_folder = tempfile.mkdtemp(prefix='upload-bench-')
+    previous_folder = app.config['UPLOAD_FOLDER']
+    app.config['UPLOAD_FOLDER'] = upload_folder
+
+    @app.route('/_bench/legacy/<path:filename>')
+    def legacy_uploaded_file(filename):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    try:
+        files = _seed_files(conn, upload_folder, args.large_mb)
+        report = {}
+        for label, stored in files.items():
+            report[f"{label} ({stored['size'] // 1024} KB)"] = [
+                run_mode(app, mode, stored, args.requests) for mode in args.modes.split(',')
+            ]
+        print(json.dumps(report, indent=2))
+    finally:
+        _remove_files(conn)
+        conn.close()
+        app.config['UPLOAD_FOLDER'] = previous_folder
+        shutil.rmtree(upload_folder, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# benchmarks/patient_import_benchmark.py
+# Measures the bulk patient importer (patient_import.py) against registering
+# patients one by one the way register_patient does (INSERT, then UPDATE of the
+# patient code).
+#
+# Writes a --rows CSV file (default 100,000) in which about 1% of the rows are
+# invalid and 1% repeat an external_patient_id, imports it, and runs the
+# per-patient path for --legacy-rows rows. Reports rows per second for both.
+#
+#     python -m benchmarks.patient_import_benchmark --rows 100000
+#
+# The imported patients are removed again afterwards unless --keep is given.
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import init_db  # noqa: E402
+import patient_import  # noqa: E402
+
+HEADER = ['external_patient_id', 'name', 'dob', 'gender', 'mobile_number', 'email', 'city', 'state',
+          'initial_height', 'initial_weight', 'diagnosis']
+DIAGNOSES = ['Psoriasis', 'Atopic dermatitis', 'Vitiligo', 'Acne vulgaris', 'Tinea corporis', 'Urticaria']
+
+
+def write_csv(path, rows, prefix):
+    rng = random.Random(42)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for i in range(1, rows + 1):
+            external_id = f"{prefix}{i}" if i % 100 != 1 else f"{prefix}{i - 1}"  # 1% repeats
+            dob = date(1940, 1, 1) + timedelta(days=rng.randrange(30000))
+            writer.writerow([
+                external_id,
+                f"Import Bench {i}",
+                dob.isoformat() if i % 100 != 50 else "31/31/1990",  # 1% invalid
+                rng.choice(['M', 'F', 'Male', 'Female', 'Other']),
+                f"9{rng.randrange(10 ** 9):09d}",
+                f"bench{i}@example.org",
+                'Satellite', 'Karnataka',
+                rng.randrange(140, 190), rng.randrange(40, 110),
+                rng.choice(DIAGNOSES),
+            ])
+
+def legacy_register(conn, rows, prefix):
+    """One INSERT plus one UPDATE per patient, as register_patient does."""
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        for i in range(rows):
+            cursor.execute("""
+                INSERT INTO Patient (name, dob, gender, mobile_number, date_of_registration,
+                                     initial_height, initial_weight, initial_bmi, initial_bsa, external_patient_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+            """, (f"Legacy Bench {i}", date(1980, 1, 1), 'Other', '9000000000', date.today(),
+                  170, 70, 24.22, 1.82, f"{prefix}{i}"))
+            patient_id = cursor.fetchone()[0]
+            cursor.execute("UPDATE Patient SET patient_code = %s WHERE id = %s", (f"DERM-{patient_id:05d}", patient_id))
+            conn.commit()
+    return time.perf_counter() - started
+
+def remove(conn):
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM Patient WHERE external_patient_id LIKE 'BENCH-I%' OR external_patient_id LIKE 'BENCH-L%'")
+    conn.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bulk patient importer.")
+    parser.add_argument("--rows", type=int, default=100000, help="rows in the imported file (default: %(default)s)")
+    parser.add_argument("--legacy-rows", type=int, default=2000,
+                        help="patients registered one by one for comparison (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="leave the imported patients in the database")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    handle, path = tempfile.mkstemp(suffix='.csv')
+    os.close(handle)
+    try:
+        write_csv(path, args.rows, 'BENCH-I')
+        with open(path, encoding='utf-8', newline='') as f:
+            report = patient_import.import_patients(conn, f, 'csv')
+        legacy_seconds = legacy_register(conn, args.legacy_rows, 'BENCH-L') if args.legacy_rows else None
+        reasons = {}
+        for reject in report['rejects']:
+            reason = reject['reason'].split(' line ')[0].split(" '")[0]
+            reasons[reason] = reasons.get(reason, 0) + 1
+        print(json.dumps({
+            'rows': report['rows'],
+            'imported': report['imported'],
+            'rejected': report['rejected'],
+            'reject_reasons': reasons,
+            'import_s': report['seconds'],
+            'import_rows_per_s': round(report['rows'] / max(report['seconds'], 0.001)),
+            'legacy_rows': args.legacy_rows,
+            'legacy_s': round(legacy_seconds, 2) if legacy_seconds else None,
+            'legacy_rows_per_s': round(args.legacy_rows / legacy_seconds) if legacy_seconds else None,
+        }, indent=2))
+    finally:
+        os.remove(path)
+        if not args.keep:
+            remove(conn)
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
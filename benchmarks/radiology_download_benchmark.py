@@ -0,0 +1,115 @@
+# benchmarks/radiology_download_benchmark.py
+# Compares ways of downloading a large scan from the (fake) radiology server into
+# the file store:
+#   stream       the previous download: one GET streamed into file_storage, no checks
+#   sequential   radiology_download.download() with parallel off: ranges one after another
+#   parallel     radiology_download.download(): part_bytes ranges, max_parallel at a time
+#   no-ranges    radiology_download.download() from a server that ignores Range
+#
+# The fake server (benchmarks/fake_radiology_server.py) runs in-process, each
+# response capped at --bandwidth MB/s like a long-distance link. A second round
+# breaks --truncate-rate of the scan bodies off half way: downloads that are
+# resumed count as ok, the rest as failed. Every stored file is checked against the
+# server's digest ('intact'). The circuit breaker is kept closed for the benchmark.
+#
+#     python -m benchmarks.radiology_download_benchmark --scan-mb 64 --bandwidth 20
+#
+# Nothing is written to the database; the files go to a temporary upload folder.
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_storage  # noqa: E402
+import radiology_client  # noqa: E402
+import radiology_download  # noqa: E402
+from benchmarks import fake_radiology_server  # noqa: E402
+
+MODES = ('stream', 'sequential', 'parallel', 'no-ranges')
+SCAN_ID = 'SCAN-BENCH'
+
+
+def _stream(url, upload_folder):
+    with radiology_client.get_client().call('download', 'GET', url, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        return file_storage.store_response(r, 'scan.dcm', upload_folder)
+
+def _download(url, upload_folder):
+    return radiology_download.download(url, 'scan.dcm', upload_folder)[0]
+
+def run_mode(mode, servers, upload_folder, repeat):
+    server = servers['no-ranges' if mode == 'no-ranges' else 'ranges']
+    radiology_download.RADIOLOGY_DOWNLOAD_CONFIG['parallel'] = mode != 'sequential'
+    fetch = _stream if mode == 'stream' else _download
+    expected = radiology_download.announced_sha256({'Repr-Digest': server.scan(SCAN_ID)[3]})
+    timings, intact, failed = [], 0, 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            stored = fetch(f"{server.url}/api/scans/download/{SCAN_ID}", upload_folder)
+        except (requests.RequestException, OSError):
+            failed += 1
+            continue
+        timings.append(time.perf_counter() - started)
+        intact += stored['sha256'] == expected
+        os.remove(os.path.join(upload_folder, stored['path']))
+    size_mb = server.scan_size / 1024 / 1024
+    return {
+        'mode': mode,
+        'ok': len(timings),
+        'intact': intact,
+        'failed': failed,
+        'p50_s': round(statistics.median(timings), 3) if timings else None,
+        'max_s': round(max(timings), 3) if timings else None,
+        'mb_per_s': round(size_mb / statistics.median(timings), 1) if timings else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark downloads of large radiology scans.")
+    parser.add_argument("--scan-mb", type=int, default=64, help="size of a scan (default: %(default)s)")
+    parser.add_argument("--bandwidth", type=float, default=20.0,
+                        help="MB/s per response from the server (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="downloads per mode (default: %(default)s)")
+    parser.add_argument("--truncate-rate", type=float, default=0.3,
+                        help="share of bodies broken off in the second round (default: %(default)s)")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated modes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    radiology_client.RADIOLOGY_BREAKER_CONFIG['min_calls'] = 10 ** 9
+    options = dict(scan_size=args.scan_mb * 1024 * 1024, bandwidth=args.bandwidth * 1024 * 1024)
+    servers = {
+        'ranges': fake_radiology_server.start(**options),
+        'no-ranges': fake_radiology_server.start(ranges=False, **options),
+    }
+    upload_folder = tempfile.mkdtemp(prefix='radiology-download-bench-')
+    config = dict(radiology_download.RADIOLOGY_DOWNLOAD_CONFIG)
+    try:
+        report = {'config': {key: config[key] for key in ('chunk_size', 'part_bytes')}
+                  | {'max_parallel': radiology_client.RADIOLOGY_CLIENT_CONFIG['max_parallel']}}
+        for truncate_rate in (0.0, args.truncate_rate):
+            for server in servers.values():
+                server.truncate_rate = truncate_rate
+            report[f"truncate_rate {truncate_rate}"] = [
+                run_mode(mode, servers, upload_folder, args.repeat) for mode in args.modes.split(',')
+            ]
+        report['server'] = {name: dict(server.stats) for name, server in servers.items()}
+        print(json.dumps(report, indent=2))
+    finally:
+        radiology_download.RADIOLOGY_DOWNLOAD_CONFIG.update(config)
+        for server in servers.values():
+            server.shutdown()
+        shutil.rmtree(upload_folder, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# benchmarks/route_benchmark.py
+# Load test of the busiest pages through the Flask test client, for sizing
+# hardware and catching regressions between commits.
+#
+# Each route in ROUTES is driven for --requests requests by --concurrency threads,
+# each logged in as the synthetic admin with its own client. URLs are drawn with
+# --seed from the synthetic dataset (benchmarks/synthetic_data.py), e.g. random
+# patient pages, name searches and autocomplete prefixes. Per route the report has
+# p50 / p95 / p99 / max latency (full response, streamed bodies included),
+# throughput, SQL statements and SQL time per request (request_metrics.py), and
+# response sizes. Requests run in this process, so the numbers include the GIL
+# contention a threaded server would see; the database is the real one.
+#
+#     python -m benchmarks.synthetic_data --patients 100000
+#     python -m benchmarks.route_benchmark --requests 200 --concurrency 8 --output run.json
+#     python -m benchmarks.route_benchmark --baseline run.json     # adds the change against an earlier run
+#
+# With --generate N the dataset is generated first and removed again afterwards
+# unless --keep is given. The report is JSON with sorted keys, so two runs diff cleanly.
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import init_db  # noqa: E402
+import patient_autocomplete  # noqa: E402
+import request_metrics  # noqa: E402
+from benchmarks import synthetic_data  # noqa: E402
+
+SAMPLE_PATIENTS = 2000
+DIAGNOSIS_FILTERS = ['Psoriasis', 'Acne', 'Vitiligo', 'Tinea']
+
+
+# route name: function(rng, sample) -> URL
+ROUTES = {
+    'dashboard': lambda rng, sample: '/dashboard',
+    'list_patients': lambda rng, sample: rng.choice([
+        '/patients',
+        f"/patients?name={rng.choice(sample)['name'].split()[0]}",
+        f"/patients?diagnosis={rng.choice(DIAGNOSIS_FILTERS)}",
+        f"/patients?after={rng.choice(sample)['id']}",
+    ]),
+    'patient_detail': lambda rng, sample: f"/patient/{rng.choice(sample)['id']}",
+    'search_patients': lambda rng, sample: (
+        f"/api/search_existing_patients?q={rng.choice(sample)['name'][:rng.randint(2, 5)].strip()}"),
+    'download_patient_data': lambda rng, sample: f"/patients/download?patient_id={rng.choice(sample)['code']}",
+    'bed_management': lambda rng, sample: '/bed_management',
+    'missed_follow_ups': lambda rng, sample: '/missed_follow_ups',
+}
+
+
+def load_sample(conn, rng):
+    """Random synthetic patients to build URLs from."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT MIN(id), MAX(id) FROM Patient WHERE external_patient_id LIKE '{synthetic_data.MARKER}%'
+        """)
+        low, high = cursor.fetchone()
+        if low is None:
+            raise SystemExit("No synthetic dataset: run python -m benchmarks.synthetic_data first, or use --generate.")
+        ids = sorted({rng.randint(low, high) for _ in range(SAMPLE_PATIENTS)})
+        cursor.execute("SELECT id, patient_code, name FROM Patient WHERE id = ANY(%s) ORDER BY id", (ids,))
+        sample = [{'id': row[0], 'code': row[1], 'name': row[2]} for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM Users WHERE username = %s", (f"{synthetic_data.USER_PREFIX}admin",))
+        admin_id = cursor.fetchone()[0]
+    conn.rollback()
+    return sample, admin_id
+
+def dataset_summary(conn):
+    """Row counts (planner estimates after ANALYZE) of the tables the routes read."""
+    tables = ['patient', 'followupvisit', 'prescription', 'prescriptionitem', 'vitals', 'patientimage',
+              'labreport', 'bedassignment', 'dailyprogressnote', 'followupstate', 'bed', 'users']
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(%s) AND relkind = 'r'",
+                       (tables,))
+        rows = dict(cursor.fetchall())
+        cursor.execute("SHOW server_version")
+        server_version = cursor.fetchone()[0]
+    conn.rollback()
+    return rows, server_version
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _client(app, admin_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = admin_id
+        session['role_id'] = 1
+        session['username'] = f"{synthetic_data.USER_PREFIX}admin"
+    return client
+
+def _percentile(sorted_values, q):
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+def run_route(app, admin_id, urls, concurrency, warmup):
+    """Sends `urls` with `concurrency` threads, the first `warmup` unmeasured; returns the route's summary."""
+    local = threading.local()
+
+    def send(url):
+        if not hasattr(local, 'client'):
+            local.client = _client(app, admin_id)
+        started = time.perf_counter()
+        with request_metrics.capture_queries() as captured:
+            response = local.client.get(url)
+            body = response.get_data()  # streamed responses are produced here
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code, len(body), captured.queries, captured.sql_seconds
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, urls[:warmup]))
+        started = time.perf_counter()
+        results = list(pool.map(send, urls[warmup:]))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] for r in results)
+    errors = sum(1 for r in results if r[1] >= 300)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'status_codes': {str(code): sum(1 for r in results if r[1] == code) for code in sorted({r[1] for r in results})},
+        'throughput_rps': round(len(results) / wall, 1),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'queries_per_request': round(statistics.fmean(r[3] for r in results), 2),
+        'queries_max': max(r[3] for r in results),
+        'sql_ms_per_request': round(statistics.fmean(r[4] for r in results) * 1000, 2),
+        'response_bytes_mean': round(statistics.fmean(r[2] for r in results)),
+    }
+
+def compare(report, baseline):
+    """Adds {'change': {metric: percent}} to every route that the baseline also measured."""
+    for name, route in report['routes'].items():
+        old = baseline.get('routes', {}).get(name)
+        if not old:
+            continue
+        route['change'] = {
+            metric: round((route[metric] - old[metric]) / old[metric] * 100, 1) if old.get(metric) else None
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request')
+        }
+
+def wait_for_autocomplete(app, admin_id, timeout=300.0):
+    """The autocomplete index loads in the background; measure it once it answers."""
+    _client(app, admin_id).get('/api/search_existing_patients?q=ab')  # starts the listener
+    deadline = time.monotonic() + timeout
+    while patient_autocomplete.search('ab') is None and time.monotonic() < deadline:
+        time.sleep(0.2)
+    return patient_autocomplete.search('ab') is not None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the hot routes on the synthetic dataset.")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma-separated routes (default: all)")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route first (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the URL choice and of --generate (default: %(default)s)")
+    parser.add_argument("--generate", type=int, default=0, metavar="PATIENTS",
+                        help="generate a synthetic dataset of this many patients first")
+    parser.add_argument("--keep", action="store_true", help="keep the dataset made by --generate")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args(argv)
+    routes = [name.strip() for name in args.routes.split(",") if name.strip()]
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)} (known: {', '.join(ROUTES)})")
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    generated = None
+    try:
+        if args.generate:
+            if synthetic_data.count_patients(conn):
+                synthetic_data.remove(conn)
+            started = time.perf_counter()
+            synthetic_data.generate(conn, args.generate, args.seed)
+            generated = round(time.perf_counter() - started, 1)
+
+        rng = random.Random(args.seed)
+        sample, admin_id = load_sample(conn, rng)
+        tables, server_version = dataset_summary(conn)
+
+        # The report carries the numbers; keep the slow-request log and INFO lines out of the way.
+        from app import app  # imported late so --help works without a database
+        request_metrics.METRICS_CONFIG['slow_request_ms'] = float('inf')
+        logging.getLogger().setLevel(logging.WARNING)
+
+        report = {
+            'config': {'routes': routes, 'requests': args.requests, 'concurrency': args.concurrency,
+                       'warmup': args.warmup, 'seed': args.seed},
+            'environment': {'commit': _git_commit(), 'python': platform.python_version(),
+                            'postgres': server_version, 'cpus': os.cpu_count()},
+            'dataset': {'rows': tables, 'generated_s': generated,
+                        'autocomplete_index_ready': wait_for_autocomplete(app, admin_id)},
+            'routes': {},
+        }
+        for name in routes:
+            urls = [ROUTES[name](rng, sample) for _ in range(args.warmup + args.requests)]
+            report['routes'][name] = run_route(app, admin_id, urls, args.concurrency, args.warmup)
+            print(f"{name}: p95 {report['routes'][name]['p95_ms']} ms", file=sys.stderr)
+
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                compare(report, json.load(f))
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+    finally:
+        if args.generate and not args.keep:
+            synthetic_data.remove(conn)
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,531 @@
+# benchmarks/synthetic_data.py
+# Seeded generator of a synthetic clinical dataset for load tests and sizing
+# (see benchmarks/route_benchmark.py). Fills every table of init_db.sql:
+# doctors, staff and an admin, their login history, beds, patients and, per
+# patient, follow-up visits, prescriptions with items, vitals, images, lab
+# reports, consultations, extra vitals and ward admissions with daily notes and
+# discharge summaries. FollowUpState and the dashboard snapshot are rebuilt
+# afterwards; the trigger-maintained tables (search documents, API versions)
+# fill themselves.
+#
+# The shape follows a dermatology outpatient clinic (DISTRIBUTIONS): registrations
+# grow over the years, visit counts are skewed (most patients come back once or
+# twice, a few dozens of times), treatments follow the diagnosis, and about 3% of
+# the patients are admitted at some point. The same --seed and --patients give the
+# same rows, with dates relative to the day of generation.
+#
+#     python -m benchmarks.synthetic_data --patients 100000 --seed 42
+#     python -m benchmarks.synthetic_data --remove
+#
+# Rows are written with COPY in chunks of --chunk patients, one transaction per
+# chunk, with ids assigned here; run it while nothing else writes to the database.
+# Generated rows are marked (external_patient_id 'SYN-...', usernames 'syn_...',
+# beds 'SYN-...') so --remove deletes exactly them.
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dashboard_stats  # noqa: E402
+import follow_up_state  # noqa: E402
+import init_db  # noqa: E402
+from lab_api import TEST_DEPARTMENTS  # noqa: E402
+
+MARKER = 'SYN-'
+USER_PREFIX = 'syn_'
+PASSWORD = 'benchmark'  # of every generated user
+
+DISTRIBUTIONS = {
+    'years': 5,                    # registrations span this many years, growing over time
+    'patients_per_doctor': 2000,
+    'patients_per_bed': 400,
+    'visits_mean': 2.5,            # follow-up visits per patient (exponential, capped)
+    'visits_max': 40,
+    'prescription_at_registration': 0.85,
+    'prescription_per_visit': 0.6,
+    'items_per_prescription': (1, 4),
+    'images_mean': 1.2,            # per patient (geometric)
+    'labs_mean': 0.8,
+    'lab_pending': 0.3,            # share of the lab reports of the last 30 days still pending
+    'admitted_share': 0.03,        # patients with a ward admission
+    'admitted_now': 0.7,           # share of the beds occupied today
+    'consultation_share': 0.05,
+    'additional_vitals_share': 0.1,
+    'login_days': 90,              # days of login history per user
+}
+
+FIRST_NAMES = ['Aarav', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Kavya', 'Rohan', 'Meera',
+               'Imran', 'Fatima', 'Suresh', 'Lakshmi', 'Joseph', 'Mary', 'Karthik', 'Divya', 'Naveen', 'Pooja',
+               'Mohammed', 'Ayesha', 'Ganesh', 'Shalini', 'Harish', 'Nandini', 'Abdul', 'Zainab', 'Manoj', 'Rekha']
+LAST_NAMES = ['Sharma', 'Reddy', 'Khan', 'Iyer', 'Nair', 'Patel', 'Gowda', 'Shetty', 'Rao', 'Menon',
+              'Fernandes', 'Das', 'Singh', 'Kulkarni', 'Hegde', 'Pillai', 'Ahmed', 'Joshi', 'Naidu', 'Bhat']
+CITIES = [('Bengaluru', 'Karnataka', 30), ('Mysuru', 'Karnataka', 12), ('Mangaluru', 'Karnataka', 8),
+          ('Hubballi', 'Karnataka', 6), ('Tumakuru', 'Karnataka', 5), ('Chennai', 'Tamil Nadu', 8),
+          ('Hyderabad', 'Telangana', 8), ('Kochi', 'Kerala', 5), ('Mumbai', 'Maharashtra', 4),
+          ('Mandya', 'Karnataka', 4), ('Hassan', 'Karnataka', 3), ('Davanagere', 'Karnataka', 3)]
+
+# diagnosis: (weight, complaints, examination, typical affected BSA %, medications (name, dosage, frequency, duration))
+DIAGNOSES = {
+    'Acne vulgaris': (22, 'Pimples on face and back', 'Comedones, papules and pustules over face', 3,
+                      [('Adapalene Gel', '0.1%', 'Once at night', '12 weeks'),
+                       ('Clindamycin', '1% gel', 'Twice daily', '8 weeks'),
+                       ('Doxycycline', '100mg', 'Once daily', '6 weeks'),
+                       ('Isotretinoin', '20mg', 'Once daily with food', '6 months')]),
+    'Tinea corporis': (16, 'Itchy ring-shaped patches', 'Annular scaly plaques with active border', 6,
+                       [('Terbinafine', '250mg', 'Once daily', '2 weeks'),
+                        ('Luliconazole Cream', '1%', 'Once daily', '4 weeks'),
+                        ('Itraconazole', '200mg', 'Once daily', '4 weeks'),
+                        ('Levocetirizine', '5mg', 'At night', '2 weeks')]),
+    'Psoriasis': (12, 'Scaly red patches on elbows and knees', 'Well-defined erythematous plaques with silvery scales',
+                  14,
+                  [('Clobetasol Propionate Cream', '0.05%', 'Twice daily', '4 weeks'),
+                   ('Calcipotriol Ointment', '0.005%', 'Twice daily', '8 weeks'),
+                   ('Methotrexate', '15mg', 'Once weekly', '12 weeks'),
+                   ('Folic Acid', '5mg', 'Once weekly', '12 weeks')]),
+    'Atopic dermatitis': (12, 'Itching and dry skin', 'Ill-defined eczematous patches over flexures', 9,
+                          [('Mometasone Cream', '0.1%', 'Once daily', '2 weeks'),
+                           ('Tacrolimus Ointment', '0.1%', 'Twice daily', '8 weeks'),
+                           ('Emollient Lotion', 'Liberal', 'Thrice daily', '12 weeks'),
+                           ('Hydroxyzine', '10mg', 'At night', '2 weeks')]),
+    'Urticaria': (9, 'Recurrent itchy wheals', 'Transient erythematous wheals, dermographism positive', 10,
+                  [('Levocetirizine', '5mg', 'Twice daily', '4 weeks'),
+                   ('Fexofenadine', '180mg', 'Once daily', '4 weeks'),
+                   ('Montelukast', '10mg', 'At night', '4 weeks')]),
+    'Vitiligo': (7, 'White patches on hands and face', 'Depigmented macules, Wood lamp accentuation', 5,
+                 [('Tacrolimus Ointment', '0.1%', 'Twice daily', '12 weeks'),
+                  ('Mometasone Cream', '0.1%', 'Once daily', '8 weeks'),
+                  ('Oral Minipulse Dexamethasone', '2.5mg', 'Twice weekly', '12 weeks')]),
+    'Melasma': (7, 'Brown patches on cheeks', 'Symmetrical hyperpigmented macules over malar area', 2,
+                [('Hydroquinone Cream', '2%', 'At night', '8 weeks'),
+                 ('Sunscreen SPF 50', 'Liberal', 'Every 3 hours', '12 weeks'),
+                 ('Tranexamic Acid', '250mg', 'Twice daily', '8 weeks')]),
+    'Scabies': (6, 'Severe itching worse at night', 'Burrows and papules over finger webs', 8,
+                [('Permethrin Cream', '5%', 'Once, repeat after 1 week', '2 weeks'),
+                 ('Ivermectin', '12mg', 'Single dose, repeat after 1 week', '2 weeks'),
+                 ('Levocetirizine', '5mg', 'At night', '2 weeks')]),
+    'Seborrheic dermatitis': (5, 'Dandruff and facial redness', 'Greasy scales over scalp and nasolabial folds', 4,
+                              [('Ketoconazole Shampoo', '2%', 'Twice weekly', '4 weeks'),
+                               ('Ketoconazole Cream', '2%', 'Twice daily', '4 weeks')]),
+    'Pemphigus vulgaris': (2, 'Painful blisters and erosions', 'Flaccid bullae, Nikolsky sign positive', 25,
+                           [('Prednisolone', '40mg', 'Once daily', '4 weeks'),
+                            ('Azathioprine', '50mg', 'Twice daily', '12 weeks'),
+                            ('Mupirocin Ointment', '2%', 'Twice daily', '2 weeks')]),
+    'Herpes zoster': (2, 'Painful grouped vesicles', 'Grouped vesicles on erythematous base along a dermatome', 4,
+                      [('Valacyclovir', '1g', 'Thrice daily', '7 days'),
+                       ('Pregabalin', '75mg', 'At night', '4 weeks')]),
+}
+DIAGNOSIS_NAMES = list(DIAGNOSES)
+DIAGNOSIS_WEIGHTS = list(itertools.accumulate(DIAGNOSES[name][0] for name in DIAGNOSIS_NAMES))
+DISEASE_STATUSES = ['Improving', 'Improving', 'Stable', 'Resolved', 'Worsening']
+LAB_TESTS = sorted(TEST_DEPARTMENTS)
+CITY_WEIGHTS = list(itertools.accumulate(weight for _, _, weight in CITIES))
+CONSULT_DEPARTMENTS = ['General Medicine', 'Rheumatology', 'Psychiatry', 'Ophthalmology', 'Endocrinology']
+EXTRA_VITALS = [('SpO2', lambda rng: f"{rng.randint(94, 100)}%"), ('RBS', lambda rng: f"{rng.randint(80, 220)} mg/dL"),
+                ('Respiratory rate', lambda rng: f"{rng.randint(12, 22)}/min")]
+WARDS = ['A', 'B', 'C']
+
+# COPY column lists, in the order rows are built below. Tables are loaded in this
+# order so every foreign key points at rows that are already there.
+COLUMNS = {
+    'Patient': ('id', 'patient_code', 'external_patient_id', 'name', 'dob', 'gender', 'mobile_number', 'email',
+                'address', 'city', 'state', 'pincode', 'date_of_registration', 'is_admitted', 'complaints',
+                'examination_findings', 'diagnosis', 'initial_treatment_plan', 'initial_blood_pressure',
+                'initial_temperature', 'initial_pulse_rate', 'initial_weight', 'initial_height', 'initial_bmi',
+                'initial_bsa', 'affected_bsa_percentage', 'registered_by_doctor_id'),
+    'FollowUpVisit': ('id', 'patient_id', 'visit_date', 'disease_status', 'updated_complaints', 'diagnosis',
+                      'affected_bsa_percentage', 'doctor_id'),
+    'Prescription': ('id', 'patient_id', 'doctor_id', 'visit_id', 'prescription_date', 'condition_notes',
+                     'next_follow_up_date'),
+    'PrescriptionItem': ('prescription_id', 'medication_name', 'dosage', 'frequency', 'duration'),
+    'Vitals': ('patient_id', 'visit_id', 'visit_date', 'blood_pressure', 'temperature', 'pulse_rate', 'weight',
+               'height', 'bmi', 'bsa', 'recorded_by_staff_id'),
+    'PatientImage': ('id', 'patient_id', 'image_filename', 'upload_date', 'notes', 'image_type', 'content_sha256',
+                     'size_bytes', 'original_filename'),
+    'LabReport': ('patient_id', 'report_type', 'department', 'report_date', 'report_summary', 'file_path',
+                  'image_id', 'status', 'requested_by_doctor_id'),
+    'AdditionalVitals': ('patient_id', 'vital_name', 'vital_value', 'record_date'),
+    'ConsultationRequest': ('patient_id', 'requesting_doctor_id', 'referral_department', 'reason_for_referral',
+                            'priority', 'request_date', 'status'),
+    'BedAssignment': ('id', 'patient_id', 'bed_id', 'admission_date', 'discharge_date', 'notes'),
+    'DailyProgressNote': ('assignment_id', 'note_date', 'notes', 'doctor_id'),
+    'DischargeSummary': ('assignment_id', 'summary_date', 'final_diagnosis', 'treatment_summary',
+                         'follow_up_instructions', 'doctor_id'),
+}
+ID_TABLES = ('Patient', 'FollowUpVisit', 'Prescription', 'PatientImage', 'BedAssignment')
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_line(values):
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append('\\N')
+        elif value is True or value is False:
+            fields.append('t' if value else 'f')
+        elif isinstance(value, str):
+            fields.append(value.translate(_COPY_ESCAPES))
+        else:
+            fields.append(str(value))
+    return '\t'.join(fields) + '\n'
+
+
+class _Tables:
+    """Per-table COPY buffers plus the next id of the tables whose ids are assigned here."""
+
+    def __init__(self, next_ids):
+        self.next_ids = next_ids
+        self.buffers = {table: io.StringIO() for table in COLUMNS}
+        self.counts = dict.fromkeys(COLUMNS, 0)
+
+    def add(self, table, values):
+        self.buffers[table].write(_copy_line(values))
+        self.counts[table] += 1
+
+    def new_id(self, table):
+        value = self.next_ids[table]
+        self.next_ids[table] += 1
+        return value
+
+    def flush(self, cursor):
+        for table, columns in COLUMNS.items():
+            buffer = self.buffers[table]
+            if buffer.tell():
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+                self.buffers[table] = io.StringIO()
+
+
+def _reserve_ids(cursor):
+    """The next free id of every table whose ids are assigned here."""
+    next_ids = {}
+    for table in ID_TABLES:
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1, pg_get_serial_sequence(%s, 'id') FROM {table}",
+                       (table.lower(),))
+        next_ids[table], sequence = cursor.fetchone()
+        cursor.execute("SELECT last_value, is_called FROM " + sequence)
+        last_value, is_called = cursor.fetchone()
+        next_ids[table] = max(next_ids[table], last_value + 1 if is_called else last_value)
+    return next_ids
+
+def _advance_sequences(cursor, next_ids):
+    for table, next_id in next_ids.items():
+        cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, 1), %s)",
+                       (table.lower(), next_id - 1, next_id > 1))
+
+
+# --- Staff, beds and login history ---
+def _create_users(cursor, rng, patients, profile, today):
+    cursor.execute("SELECT id, lower(name) FROM Roles")
+    roles = {name: role_id for role_id, name in cursor.fetchall()}
+    password_hash = generate_password_hash(PASSWORD)
+    doctors = max(5, patients // profile['patients_per_doctor'])
+    staff = max(2, doctors // 2)
+    users = ([(f"{USER_PREFIX}admin", roles['admin'])]
+             + [(f"{USER_PREFIX}doctor_{i}", roles['doctor']) for i in range(1, doctors + 1)]
+             + [(f"{USER_PREFIX}staff_{i}", roles['staff']) for i in range(1, staff + 1)])
+    ids = {}
+    for username, role_id in users:
+        cursor.execute("INSERT INTO Users (username, password_hash, role_id) VALUES (%s, %s, %s) RETURNING id",
+                       (username, password_hash, role_id))
+        ids[username] = cursor.fetchone()[0]
+
+    # One working-day login per user per day, most ending with a logout.
+    buffer = io.StringIO()
+    logins = 0
+    for user_id in ids.values():
+        for days_ago in range(profile['login_days'], 0, -1):
+            day = today - timedelta(days=days_ago)
+            if day.weekday() == 6 or rng.random() < 0.1:
+                continue
+            login = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randint(480, 600))
+            logout = login + timedelta(minutes=rng.randint(240, 540)) if rng.random() < 0.9 else None
+            buffer.write(_copy_line((user_id, login, logout)))
+            logins += 1
+    buffer.seek(0)
+    cursor.copy_expert("COPY UserActivityLog (user_id, login_time, logout_time) FROM STDIN", buffer)
+
+    doctor_ids = [ids[name] for name, role_id in users if role_id == roles['doctor']]
+    staff_ids = [ids[name] for name, role_id in users if role_id == roles['staff']]
+    return ids[f"{USER_PREFIX}admin"], doctor_ids, staff_ids, logins
+
+def _create_beds(cursor, patients, profile):
+    count = max(10, patients // profile['patients_per_bed'])
+    cursor.execute("""
+        INSERT INTO Bed (bed_number, status)
+        SELECT %s || (%s::text[])[1 + (b - 1) %% %s] || '-' || lpad(b::text, 4, '0'), 'Available'
+        FROM generate_series(1, %s) b
+        RETURNING id
+    """, (MARKER, WARDS, len(WARDS), count))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _create_medications(cursor):
+    """Adds the prescribed medications missing from the catalogue (kept by remove())."""
+    names = sorted({medication[0] for *_, medications in DIAGNOSES.values() for medication in medications})
+    cursor.execute("""
+        INSERT INTO Medication (name, formulation)
+        SELECT n, CASE WHEN n ~* '(cream|gel|ointment|lotion|shampoo|sunscreen)' THEN 'Topical' ELSE 'Tablet' END
+        FROM unnest(%s::text[]) n
+        WHERE NOT EXISTS (SELECT 1 FROM Medication m WHERE m.name = n)
+    """, (names,))
+    return cursor.rowcount
+
+
+# --- Patients ---
+def _vitals(rng, age):
+    height = round(rng.gauss(163, 9), 1) if age >= 16 else round(80 + age * 5.5 + rng.gauss(0, 6), 1)
+    bmi = rng.gauss(24.5, 4) if age >= 16 else rng.gauss(17, 2)
+    weight = round(max(8.0, bmi * (height / 100) ** 2), 1)
+    return {
+        'bp': f"{rng.randint(104, 150)}/{rng.randint(64, 96)}",
+        'temperature': round(rng.gauss(98.4, 0.4), 1),
+        'pulse': rng.randint(62, 104),
+        'weight': weight,
+        'height': height,
+        'bmi': round(weight / (height / 100) ** 2, 2),
+        'bsa': round(math.sqrt(height * weight / 3600), 2),
+    }
+
+def _geometric(rng, mean, cap):
+    """A count with the given mean, most often 0 or 1."""
+    if mean <= 0:
+        return 0
+    return min(int(rng.expovariate(1 / mean)), cap)
+
+def _prescribe(tables, rng, patient_id, doctor_id, visit_id, day, diagnosis, medications, profile):
+    prescription_id = tables.new_id('Prescription')
+    issued = datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randint(540, 1020))
+    tables.add('Prescription', (prescription_id, patient_id, doctor_id, visit_id, issued,
+                                f"{diagnosis}: continue treatment", day + timedelta(days=rng.choice((14, 21, 28, 42)))))
+    low, high = profile['items_per_prescription']
+    for name, dosage, frequency, duration in rng.sample(medications, min(len(medications), rng.randint(low, high))):
+        tables.add('PrescriptionItem', (prescription_id, name, dosage, frequency, duration))
+
+def _add_patient(tables, rng, number, today, context):
+    profile = context['profile']
+    patient_id = tables.new_id('Patient')
+    span = profile['years'] * 365
+    # sqrt makes recent registrations more frequent: a clinic that keeps growing.
+    registered = today - timedelta(days=int(span * (1 - math.sqrt(rng.random()))))
+    age = int(rng.triangular(1, 85, 28))
+    dob = registered - timedelta(days=age * 365 + rng.randrange(365))
+    gender = rng.choices(('Male', 'Female', 'Other'), (48, 50, 2))[0]
+    diagnosis = rng.choices(DIAGNOSIS_NAMES, cum_weights=DIAGNOSIS_WEIGHTS)[0]
+    _, complaints, examination, bsa_percent, medications = DIAGNOSES[diagnosis]
+    city, state, _ = rng.choices(CITIES, cum_weights=CITY_WEIGHTS)[0]
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    doctor = rng.choice(context['doctors'])
+    vitals = _vitals(rng, age)
+    affected = round(max(0.5, rng.gauss(bsa_percent, bsa_percent / 3)), 1)
+
+    admission = None
+    if rng.random() < profile['admitted_share']:
+        admission = _plan_admission(rng, registered, today, context)
+    tables.add('Patient', (
+        patient_id, f"DERM-{patient_id:05d}", f"{MARKER}{number}", name, dob, gender,
+        f"9{rng.randrange(10 ** 9):09d}",
+        f"{name.lower().replace(' ', '.')}{number}@example.org" if rng.random() < 0.3 else None,
+        f"{rng.randint(1, 999)}, {rng.randint(1, 30)}th Cross", city, state, f"5{rng.randrange(10 ** 5):05d}",
+        registered, bool(admission and admission['current']), complaints, examination, diagnosis,
+        f"Start {medications[0][0]}", vitals['bp'], vitals['temperature'], vitals['pulse'], vitals['weight'],
+        vitals['height'], vitals['bmi'], vitals['bsa'], affected, doctor))
+    tables.add('Vitals', (patient_id, None, registered, vitals['bp'], vitals['temperature'], vitals['pulse'],
+                          vitals['weight'], vitals['height'], vitals['bmi'], vitals['bsa'],
+                          rng.choice(context['staff'])))
+    if rng.random() < profile['prescription_at_registration']:
+        _prescribe(tables, rng, patient_id, doctor, None, registered, diagnosis, medications, profile)
+
+    # Follow-up visits, a few weeks apart, never in the future.
+    day = registered
+    for _ in range(_geometric(rng, profile['visits_mean'], profile['visits_max'])):
+        day += timedelta(days=rng.randint(14, 60))
+        if day > today:
+            break
+        visit_id = tables.new_id('FollowUpVisit')
+        affected = round(max(0.0, affected * rng.uniform(0.6, 1.1)), 1)
+        tables.add('FollowUpVisit', (visit_id, patient_id, day, rng.choice(DISEASE_STATUSES), complaints, diagnosis,
+                                     affected, rng.choice(context['doctors'])))
+        visit = _vitals(rng, age)
+        tables.add('Vitals', (patient_id, visit_id, day, visit['bp'], visit['temperature'], visit['pulse'],
+                              vitals['weight'], vitals['height'], vitals['bmi'], vitals['bsa'],
+                              rng.choice(context['staff'])))
+        if rng.random() < profile['prescription_per_visit']:
+            _prescribe(tables, rng, patient_id, doctor, visit_id, day, diagnosis, medications, profile)
+
+    image_ids = []
+    for _ in range(_geometric(rng, profile['images_mean'], 20)):
+        image_id = tables.new_id('PatientImage')
+        digest = hashlib.sha256(f"{patient_id}:{image_id}".encode()).hexdigest()
+        taken = registered + timedelta(days=rng.randint(0, max(0, (today - registered).days)))
+        tables.add('PatientImage', (image_id, patient_id, f"objects/{digest[:2]}/{digest[2:4]}/{digest}.jpg", taken,
+                                    f"{diagnosis} - clinical photo", 'Clinical', digest,
+                                    rng.randint(150_000, 4_000_000), f"IMG_{rng.randint(1000, 9999)}.jpg"))
+        image_ids.append(image_id)
+
+    for _ in range(_geometric(rng, profile['labs_mean'], 15)):
+        test = rng.choice(LAB_TESTS)
+        reported = registered + timedelta(days=rng.randint(0, max(0, (today - registered).days)))
+        pending = (today - reported).days <= 30 and rng.random() < profile['lab_pending']
+        attached = image_ids and not pending and rng.random() < 0.2
+        tables.add('LabReport', (patient_id, test, TEST_DEPARTMENTS[test], reported,
+                                 None if pending else 'Within normal limits' if rng.random() < 0.8 else 'Abnormal, see report',
+                                 None if pending or rng.random() < 0.5 else f"objects/lab/{patient_id}_{test.lower()}.pdf",
+                                 rng.choice(image_ids) if attached else None,
+                                 'Pending' if pending else 'Completed', doctor))
+
+    if rng.random() < profile['consultation_share']:
+        tables.add('ConsultationRequest', (patient_id, doctor, rng.choice(CONSULT_DEPARTMENTS),
+                                           f"Evaluation for {diagnosis.lower()}", rng.choice(('Normal', 'Normal', 'Urgent')),
+                                           datetime.combine(registered, datetime.min.time()) + timedelta(hours=11),
+                                           rng.choice(('Pending', 'Completed', 'Completed'))))
+    if rng.random() < profile['additional_vitals_share']:
+        vital_name, value = rng.choice(EXTRA_VITALS)
+        tables.add('AdditionalVitals', (patient_id, vital_name, value(rng), registered))
+
+    if admission:
+        _add_admission(tables, rng, patient_id, diagnosis, admission, context)
+
+def _plan_admission(rng, registered, today, context):
+    """Dates and bed of a ward admission; current ones take a free bed while any are left."""
+    if context['free_beds'] and rng.random() < 0.5:
+        bed = context['free_beds'].pop()
+        admitted = max(registered, today - timedelta(days=rng.randint(0, 10)))
+        return {'bed': bed, 'admitted': admitted, 'days': (today - admitted).days + 1, 'current': True}
+    admitted = max(registered, min(registered + timedelta(days=rng.randint(0, 30)), today - timedelta(days=2)))
+    days = max(1, min(rng.randint(2, 14), (today - admitted).days))
+    return {'bed': rng.choice(context['beds']), 'admitted': admitted, 'days': days, 'current': False}
+
+def _add_admission(tables, rng, patient_id, diagnosis, admission, context):
+    assignment_id = tables.new_id('BedAssignment')
+    admitted = datetime.combine(admission['admitted'], datetime.min.time()) + timedelta(hours=rng.randint(9, 20))
+    discharged = None if admission['current'] else admitted + timedelta(days=admission['days'])
+    doctor = rng.choice(context['doctors'])
+    tables.add('BedAssignment', (assignment_id, patient_id, admission['bed'], admitted, discharged,
+                                 f"Admitted for {diagnosis.lower()}"))
+    for day in range(admission['days']):
+        tables.add('DailyProgressNote', (assignment_id, admitted + timedelta(days=day, hours=2),
+                                         rng.choice(('Lesions settling, continue same treatment',
+                                                     'New lesions noted, dose adjusted',
+                                                     'Afebrile, tolerating oral medication',
+                                                     'Erosions epithelialising, dressing changed')), doctor))
+    if discharged:
+        tables.add('DischargeSummary', (assignment_id, discharged, diagnosis, 'Treated as inpatient, improved',
+                                        'Review in OPD after 2 weeks', doctor))
+    else:
+        context['occupied'].append(admission['bed'])
+
+
+# --- Entry points ---
+def generate(conn, patients, seed=42, chunk=10000, profile=None, progress=None):
+    """
+    Adds `patients` synthetic patients with their records (and the users and beds
+    they need). Returns the rows added per table.
+    """
+    profile = {**DISTRIBUTIONS, **(profile or {})}
+    rng = random.Random(seed)
+    today = date.today()
+    with conn.cursor() as cursor:
+        _, doctors, staff, logins = _create_users(cursor, rng, patients, profile, today)
+        beds = _create_beds(cursor, patients, profile)
+        medications = _create_medications(cursor)
+        tables = _Tables(_reserve_ids(cursor))
+        conn.commit()
+
+        free = rng.sample(beds, int(len(beds) * profile['admitted_now']))
+        context = {'profile': profile, 'doctors': doctors, 'staff': staff, 'beds': beds,
+                   'free_beds': free, 'occupied': []}
+        for number in range(1, patients + 1):
+            _add_patient(tables, rng, number, today, context)
+            if number % chunk == 0 or number == patients:
+                tables.flush(cursor)
+                _advance_sequences(cursor, tables.next_ids)
+                conn.commit()
+                if progress:
+                    progress(number)
+        if context['occupied']:
+            cursor.execute("UPDATE Bed SET status = 'Occupied' WHERE id = ANY(%s)", (context['occupied'],))
+        conn.commit()
+
+    follow_up_state.rebuild(conn)
+    dashboard_stats.refresh_snapshot(conn)
+    analyze(conn)
+    return {'Users': 1 + len(doctors) + len(staff), 'Bed': len(beds), 'Medication': medications,
+            'UserActivityLog': logins, **tables.counts}
+
+def analyze(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    conn.commit()
+
+def remove(conn):
+    """Deletes everything generate() added."""
+    conn.rollback()
+    synthetic = f"SELECT id FROM Patient WHERE external_patient_id LIKE '{MARKER}%'"
+    assignments = f"SELECT id FROM BedAssignment WHERE patient_id IN ({synthetic})"
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM DailyProgressNote WHERE assignment_id IN ({assignments})")
+        cursor.execute(f"DELETE FROM DischargeSummary WHERE assignment_id IN ({assignments})")
+        cursor.execute(f"DELETE FROM BedAssignment WHERE patient_id IN ({synthetic})")
+        cursor.execute(f"DELETE FROM Bed WHERE bed_number LIKE '{MARKER}%'")
+        cursor.execute(f"DELETE FROM ConsultationRequest WHERE patient_id IN ({synthetic})")
+        cursor.execute(f"""
+            DELETE FROM PrescriptionItem WHERE prescription_id IN
+                (SELECT id FROM Prescription WHERE patient_id IN ({synthetic}))
+        """)
+        cursor.execute(f"DELETE FROM Prescription WHERE patient_id IN ({synthetic})")
+        cursor.execute(f"DELETE FROM Patient WHERE external_patient_id LIKE '{MARKER}%'")
+        cursor.execute(f"DELETE FROM Users WHERE username LIKE '{USER_PREFIX}%'")
+    conn.commit()
+    follow_up_state.rebuild(conn)
+    dashboard_stats.refresh_snapshot(conn)
+
+def count_patients(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM Patient WHERE external_patient_id LIKE '{MARKER}%'")
+        count = cursor.fetchone()[0]
+    conn.rollback()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate (or remove) a synthetic clinical dataset.")
+    parser.add_argument("--patients", type=int, default=10000, help="patients to add (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed (default: %(default)s)")
+    parser.add_argument("--chunk", type=int, default=10000, help="patients per COPY transaction (default: %(default)s)")
+    parser.add_argument("--remove", action="store_true", help="delete the synthetic dataset instead")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(init_db.conn_string_new_db)
+    try:
+        started = time.perf_counter()
+        if args.remove:
+            remove(conn)
+            print(json.dumps({'removed': True, 'seconds': round(time.perf_counter() - started, 1)}))
+            return 0
+        if count_patients(conn):
+            print("A synthetic dataset already exists; run with --remove first.", file=sys.stderr)
+            return 1
+        counts = generate(conn, args.patients, args.seed, args.chunk,
+                          progress=lambda n: print(f"{n} patients", file=sys.stderr))
+        print(json.dumps({'patients': args.patients, 'seed': args.seed, 'rows': counts,
+                          'seconds': round(time.perf_counter() - started, 1)}, indent=2))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
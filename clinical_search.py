@@ -0,0 +1,162 @@
+# clinical_search.py
+# Ranked full-text search over clinical notes for /api/clinical_search.
+# Searches ClinicalSearchDocument (migration 0012): one document per patient record,
+# follow-up visit, daily progress note and prescription, kept current by triggers.
+# Queries use web-search syntax ("quoted phrases", OR, -exclude) with English stemming.
+#
+# Ranking needs every matching document, which for a very common term can be a
+# large share of the table. At most CANDIDATE_CAP matches are ranked: the most
+# recent ones (by document date, then source), taken in that fixed order from
+# idx_clinicalsearch_recent (migration 0017), so every page of a query ranks the
+# same matches. The response says when the cap was hit so the user can narrow the
+# query. Snippets are only built for the rows of the requested page.
+#
+# After bulk loads with triggers disabled, or to re-index everything:
+#     python clinical_search.py rebuild
+import argparse
+import html
+import logging
+import time
+
+import db_pool
+
+PER_PAGE = 20
+MAX_PAGE = 50
+CANDIDATE_CAP = 2000
+
+SOURCES = ('Patient', 'FollowUpVisit', 'DailyProgressNote', 'Prescription')
+SOURCE_LABELS = {
+    'Patient': 'Initial Assessment',
+    'FollowUpVisit': 'Follow-up Visit',
+    'DailyProgressNote': 'Daily Progress Note',
+    'Prescription': 'Prescription',
+}
+
+# ts_headline marks matches with these; the text is HTML-escaped before they
+# become <mark> tags, so note contents can never inject markup.
+_MARK_START, _MARK_END = '\x02', '\x03'
+HEADLINE_OPTIONS = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=30, MinWords=12, MaxFragments=2, FragmentDelimiter=\" … \""
+
+
+def _snippet_html(headline):
+    return (html.escape(headline or '')
+            .replace(_MARK_START, '<mark>')
+            .replace(_MARK_END, '</mark>'))
+
+def _parse_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def read_filters(args):
+    """Search text, sources, patient and page from request.args."""
+    sources = [s for s in args.getlist('source') if s in SOURCES]
+    return {
+        'q': (args.get('q') or '').strip(),
+        'sources': sources,
+        'patient_id': _parse_int(args.get('patient_id'), None),
+        'page': min(max(_parse_int(args.get('page'), 1), 1), MAX_PAGE),
+    }
+
+def search(cursor, args, per_page=PER_PAGE):
+    """
+    Runs one page of a clinical search. Returns a dict with 'results' (best first,
+    each with an HTML 'snippet'), 'total' (matches ranked, at most CANDIDATE_CAP),
+    'capped' (only the most recent CANDIDATE_CAP matches were ranked), 'page' and
+    'has_next'.
+    """
+    filters = read_filters(args)
+    result = {'query': filters['q'], 'page': filters['page'], 'per_page': per_page,
+              'results': [], 'total': 0, 'capped': False, 'has_next': False}
+    if not filters['q']:
+        return result
+
+    clauses = ["d.search_vector @@ websearch_to_tsquery('english', %(q)s)"]
+    params = {'q': filters['q'], 'cap': CANDIDATE_CAP + 1,
+              'limit': per_page, 'offset': (filters['page'] - 1) * per_page,
+              'headline': HEADLINE_OPTIONS}
+    if filters['sources']:
+        clauses.append("d.source_table = ANY(%(sources)s)")
+        params['sources'] = filters['sources']
+    if filters['patient_id']:
+        clauses.append("d.patient_id = %(patient_id)s")
+        params['patient_id'] = filters['patient_id']
+
+    cursor.execute(f"""
+        WITH matches AS MATERIALIZED (
+            SELECT d.source_table, d.source_id, d.patient_id, d.document_date,
+                   ts_rank(d.search_vector, websearch_to_tsquery('english', %(q)s)) AS rank
+            FROM ClinicalSearchDocument d
+            WHERE {" AND ".join(clauses)}
+            ORDER BY d.document_date DESC NULLS LAST, d.source_table, d.source_id
+            LIMIT %(cap)s
+        ),
+        page AS (
+            SELECT * FROM matches
+            ORDER BY rank DESC, document_date DESC NULLS LAST, source_table, source_id
+            LIMIT %(limit)s OFFSET %(offset)s
+        )
+        SELECT page.source_table, page.source_id, page.patient_id, page.document_date, page.rank,
+               p.patient_code, p.name AS patient_name,
+               ts_headline('english', d.body, websearch_to_tsquery('english', %(q)s), %(headline)s) AS headline,
+               (SELECT COUNT(*) FROM matches) AS total
+        FROM page
+        JOIN ClinicalSearchDocument d USING (source_table, source_id)
+        JOIN Patient p ON p.id = page.patient_id
+        ORDER BY page.rank DESC, page.document_date DESC NULLS LAST, page.source_table, page.source_id
+    """, params)
+    rows = cursor.fetchall()
+    if not rows and filters['page'] > 1:
+        # Past the last page: still report how many matched.
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM ClinicalSearchDocument d WHERE {" AND ".join(clauses)} LIMIT %(cap)s
+            ) matches
+        """, params)
+        total = cursor.fetchone()[0]
+    else:
+        total = rows[0]['total'] if rows else 0
+
+    result['capped'] = total > CANDIDATE_CAP
+    result['total'] = min(total, CANDIDATE_CAP)
+    result['has_next'] = filters['page'] * per_page < result['total'] and filters['page'] < MAX_PAGE
+    result['results'] = [{
+        'source': row['source_table'],
+        'source_label': SOURCE_LABELS[row['source_table']],
+        'source_id': row['source_id'],
+        'patient_id': row['patient_id'],
+        'patient_code': row['patient_code'],
+        'patient_name': row['patient_name'],
+        'date': row['document_date'].isoformat() if row['document_date'] else None,
+        'rank': round(float(row['rank']), 4),
+        'snippet': _snippet_html(row['headline']),
+    } for row in rows]
+    return result
+
+
+def rebuild(db_conn):
+    """Re-indexes every clinical note. Returns the number of documents."""
+    with db_conn.cursor() as cursor:
+        cursor.execute("TRUNCATE ClinicalSearchDocument")
+        cursor.execute("""
+            INSERT INTO ClinicalSearchDocument (source_table, source_id, patient_id, document_date, body, search_vector)
+            SELECT source_table, source_id, patient_id, document_date, body, search_vector
+            FROM clinical_search_docs
+        """)
+        count = cursor.rowcount
+        cursor.execute("ANALYZE ClinicalSearchDocument")
+    db_conn.commit()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the clinical full-text search index.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="re-index every clinical note")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    started = time.monotonic()
+    with db_pool.connection() as db_conn:
+        documents = rebuild(db_conn)
+    logging.info(f"Indexed {documents} clinical documents in {time.monotonic() - started:.1f} s.")
@@ -0,0 +1,123 @@
+# dashboard_stats.py
+# Precomputed dashboard statistics.
+# The counters and disease/gender breakdowns live in the dashboard_stats_snapshot
+# materialized view (migrations 0006, 0010). The dashboard reads it in a single query
+# and, when the snapshot is older than REFRESH_INTERVAL, triggers a background
+# REFRESH ... CONCURRENTLY so no page load ever waits for the aggregation.
+# Missed follow-ups are read live from FollowUpState (follow_up_state.py), which
+# costs an index scan and is never stale.
+#
+# The snapshot can also be refreshed from cron / a scheduler:
+#     python dashboard_stats.py            # refresh once
+#     python dashboard_stats.py --loop     # refresh every REFRESH_INTERVAL seconds
+import argparse
+import logging
+import threading
+import time
+from collections import Counter
+
+import psycopg2
+import psycopg2.extras
+
+import db_pool
+import follow_up_state
+
+REFRESH_INTERVAL = 60.0  # seconds before a snapshot is considered stale
+MISSED_PREVIEW = 10      # missed follow-ups handed to the dashboard
+REFRESH_LOCK_KEY = 0x44534e50  # advisory lock id so only one worker refreshes at a time
+
+_refresh_guard = threading.Lock()
+
+
+def read_snapshot(cursor):
+    """Returns the stats snapshot row together with its age in seconds."""
+    cursor.execute("""
+        SELECT *, EXTRACT(EPOCH FROM (NOW() - refreshed_at)) AS age_seconds
+        FROM dashboard_stats_snapshot
+        WHERE id = 1
+    """)
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def refresh_snapshot(db_conn):
+    """
+    Recomputes the snapshot. Returns False without waiting if another worker is
+    already refreshing it.
+    """
+    with db_conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (REFRESH_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            db_conn.rollback()
+            return False
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY dashboard_stats_snapshot")
+    db_conn.commit()
+    return True
+
+def _refresh_worker():
+    try:
+        with db_pool.connection() as db_conn:
+            refresh_snapshot(db_conn)
+    except psycopg2.Error as e:
+        logging.error(f"Dashboard stats refresh failed: {e}")
+    finally:
+        _refresh_guard.release()
+
+def refresh_in_background():
+    """Starts a refresh thread unless one is already running in this process."""
+    if not _refresh_guard.acquire(blocking=False):
+        return False
+    threading.Thread(target=_refresh_worker, name="dashboard-stats-refresh", daemon=True).start()
+    return True
+
+def format_age(seconds):
+    seconds = int(seconds or 0)
+    if seconds < 60:
+        return f"{seconds} s ago"
+    if seconds < 3600:
+        return f"{seconds // 60} min ago"
+    return f"{seconds // 3600} h {seconds % 3600 // 60} min ago"
+
+def get_dashboard_stats(db_conn):
+    """
+    Returns (stats, disease_counts, gender_counts, missed_follow_up_patients) for the
+    dashboard. stats includes 'snapshot_age_seconds' and 'snapshot_age' so the page
+    can show how fresh the numbers are.
+    """
+    cursor = db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        snapshot = read_snapshot(cursor)
+        missed_count = follow_up_state.count_missed(cursor)
+        missed_page = follow_up_state.missed_follow_ups_page(cursor, {}, per_page=MISSED_PREVIEW)
+    finally:
+        cursor.close()
+    if snapshot['age_seconds'] > REFRESH_INTERVAL:
+        refresh_in_background()
+
+    stats = {key: snapshot[key] for key in (
+        'total_patients', 'occupied_beds', 'total_beds', 'pending_reports',
+        'total_follow_ups_scheduled',
+    )}
+    stats['missed_follow_ups'] = missed_count
+    stats['snapshot_refreshed_at'] = snapshot['refreshed_at']
+    stats['snapshot_age_seconds'] = float(snapshot['age_seconds'])
+    stats['snapshot_age'] = format_age(snapshot['age_seconds'])
+    return (stats,
+            Counter(snapshot['disease_counts']),
+            Counter(snapshot['gender_counts']),
+            missed_page['patients'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Refresh the dashboard statistics snapshot.")
+    parser.add_argument("--loop", action="store_true", help=f"keep refreshing every {REFRESH_INTERVAL:.0f} seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        started = time.monotonic()
+        with db_pool.connection() as db_conn:
+            refreshed = refresh_snapshot(db_conn)
+        logging.info("Dashboard stats refreshed in %.0f ms" % ((time.monotonic() - started) * 1000)
+                     if refreshed else "Another worker is refreshing the dashboard stats; skipped.")
+        if not args.loop:
+            break
+        time.sleep(REFRESH_INTERVAL)
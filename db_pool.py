@@ -0,0 +1,447 @@
+# db_pool.py
+# Shared PostgreSQL connection pool used by app.py, lab_api.py and radiology_api.py.
+#
+# Optionally, read-only requests are served by streaming replicas (REPLICA_CONFIG):
+# app.get_db() borrows with getconn_for_read() for GET requests, which picks a
+# replica in turn and falls back to the primary when none is reachable. Everything
+# else - writes, background workers, LISTEN - uses the primary.
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+import request_metrics
+
+# --- Database Configuration (single copy for the whole application) ---
+DB_CONFIG = {
+    'dbname': 'dermatology_db', 'user': 'postgres', 'password': 'Noor@818',
+    'host': 'localhost', 'port': '5432', 'sslmode': 'disable'
+}
+
+# --- Pool Configuration ---
+# pgbouncer_mode: set to True when DB_CONFIG points at PgBouncer running with
+# pool_mode=transaction. In that mode no session state is set on connections
+# (no startup 'options', no SET commands) because consecutive transactions may
+# run on different server backends.
+POOL_CONFIG = {
+    'min_size': 2,
+    'max_size': 20,
+    'checkout_timeout': 10.0,     # seconds a request waits for a free connection
+    'health_check_after': 30.0,   # idle seconds after which a borrowed connection is pinged
+    'max_idle_time': 600.0,       # idle connections above min_size are closed after this
+    'statement_timeout_ms': None, # applied via startup options (ignored in pgbouncer_mode)
+    'pgbouncer_mode': False,
+}
+
+# --- Read Replicas (optional) ---
+# replicas: connection settings of each replica, e.g. [{**DB_CONFIG, 'host': 'replica-1'}].
+# Pool sizes and pgbouncer_mode are taken from POOL_CONFIG.
+REPLICA_CONFIG = {
+    'replicas': [],
+    'sticky_seconds': 10.0,    # a session reads from the primary this long after it wrote
+    'retry_after': 30.0,       # seconds an unreachable replica is skipped before it is tried again
+    'checkout_timeout': 2.0,   # wait for a free replica connection before reading from the primary
+}
+
+LATENCY_SAMPLES = 1024
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with health checks and statistics."""
+
+    def __init__(self, dsn_config, min_size=2, max_size=20, checkout_timeout=10.0,
+                 health_check_after=30.0, max_idle_time=600.0,
+                 statement_timeout_ms=None, pgbouncer_mode=False, name='primary',
+                 connection_factory=None, read_only=False):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.name = name
+        self.dsn_config = dict(dsn_config)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.max_idle_time = max_idle_time
+        self.statement_timeout_ms = statement_timeout_ms
+        self.pgbouncer_mode = pgbouncer_mode
+        self.connection_factory = connection_factory
+        self.read_only = read_only
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()          # (connection, returned_at) pairs, most recent on the right
+        self._in_use = set()
+        self._opening = 0             # connections being opened outside the lock
+        self._waiting = 0
+        self._closed = False
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._counters = {
+            'checkouts': 0, 'timeouts': 0, 'connections_opened': 0,
+            'connections_closed': 0, 'health_check_failures': 0,
+        }
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+        for _ in range(self.min_size):
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                logging.warning(f"[{self.name} pool] could not pre-open connection: {e}")
+                break
+            self._idle.append((conn, time.monotonic()))
+
+    # --- Connection lifecycle ---
+    def _connect(self):
+        params = dict(self.dsn_config)
+        if self.statement_timeout_ms and not self.pgbouncer_mode:
+            params['options'] = f"-c statement_timeout={int(self.statement_timeout_ms)}"
+        if self.connection_factory is not None:
+            params['connection_factory'] = self.connection_factory
+        conn = psycopg2.connect(**params)
+        if self.read_only:
+            # Sent with each BEGIN, so it also holds behind PgBouncer: a write that
+            # reaches a replica by mistake fails instead of going unnoticed.
+            conn.readonly = True
+        with self._cond:
+            self._counters['connections_opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._counters['connections_closed'] += 1
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status not in (psycopg2.extensions.TRANSACTION_STATUS_IDLE,):
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            # The ping opened a transaction; end it so the connection is idle again
+            # (and, behind PgBouncer, so the server backend is released).
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout=None):
+        """Borrows a healthy connection, waiting up to `timeout` seconds for one."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            conn = None
+            idle_for = 0.0
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+                self._waiting += 1
+                try:
+                    while not self._idle and (len(self._in_use) + self._opening) >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._counters['timeouts'] += 1
+                            raise PoolTimeout(
+                                f"no database connection available within {timeout:.1f}s "
+                                f"({len(self._in_use)} in use, max {self.max_size})"
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = time.monotonic() - returned_at
+                    self._in_use.add(conn)
+                else:
+                    self._opening += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use.add(conn)
+            elif not self._is_healthy(conn, idle_for):
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._counters['health_check_failures'] += 1
+                    self._cond.notify()
+                self._discard(conn)
+                continue
+
+            self._record_checkout(time.monotonic() - started)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool, rolling back any unfinished transaction."""
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                close = True
+        with self._cond:
+            self._in_use.discard(conn)
+            keep = not close and not conn.closed and not self._closed
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+            expired = self._prune_idle_locked()
+        if not keep:
+            self._discard(conn)
+        for stale in expired:
+            self._discard(stale)
+
+    def discard_idle(self):
+        """Closes all idle connections, e.g. once the server is known to have gone away."""
+        with self._cond:
+            stale = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in stale:
+            self._discard(conn)
+
+    def _prune_idle_locked(self):
+        expired = []
+        now = time.monotonic()
+        # Oldest idle connections sit on the left of the deque.
+        while len(self._idle) + len(self._in_use) > self.min_size and self._idle:
+            conn, returned_at = self._idle[0]
+            if now - returned_at < self.max_idle_time:
+                break
+            self._idle.popleft()
+            expired.append(conn)
+        return expired
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that borrows a connection and always returns it."""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    # --- Statistics ---
+    def _record_checkout(self, elapsed):
+        with self._cond:
+            self._counters['checkouts'] += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+            self._latencies.append(elapsed)
+
+    def stats(self):
+        """Returns a snapshot of pool usage and checkout latency (milliseconds)."""
+        with self._cond:
+            samples = sorted(self._latencies)
+            checkouts = self._counters['checkouts']
+            snapshot = {
+                'name': self.name,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'pgbouncer_mode': self.pgbouncer_mode,
+                **self._counters,
+                'checkout_ms_avg': round(self._checkout_time_total / checkouts * 1000, 3) if checkouts else 0.0,
+                'checkout_ms_max': round(self._checkout_time_max * 1000, 3),
+            }
+        for label, q in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            snapshot[f'checkout_ms_{label}'] = (
+                round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3) if samples else 0.0
+            )
+        return snapshot
+
+
+# --- Module-level shared pool ---
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Connections time their SQL for the per-request metrics (request_metrics.py).
+                _pool = ConnectionPool(DB_CONFIG, connection_factory=request_metrics.connection_factory(),
+                                       **POOL_CONFIG)
+    return _pool
+
+
+def getconn(timeout=None):
+    return get_pool().getconn(timeout)
+
+
+def putconn(conn, close=False):
+    pool = _replica_owner.pop(conn, None)
+    if pool is not None:
+        _replicas.putconn(conn, pool, close=close)
+    else:
+        get_pool().putconn(conn, close=close)
+
+
+@contextmanager
+def connection(timeout=None, read_only=False):
+    """
+    Borrows a pooled connection for code running outside a Flask request.
+    read_only=True lets a replica serve it (see getconn_for_read()).
+    """
+    conn = getconn_for_read(timeout=timeout) if read_only else getconn(timeout)
+    try:
+        yield conn
+    finally:
+        putconn(conn)
+
+
+def stats():
+    return get_pool().stats()
+
+
+# --- Read replica routing ---
+class ReplicaSet:
+    """The replica pools, taken in turn, with the ones that failed skipped for a while."""
+
+    def __init__(self, configs, retry_after=30.0, checkout_timeout=2.0, **pool_kwargs):
+        self.retry_after = retry_after
+        self.checkout_timeout = checkout_timeout
+        self.pools = [ConnectionPool(config, name=f"replica{i}", read_only=True, **pool_kwargs)
+                      for i, config in enumerate(configs, 1)]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = {pool.name: 0.0 for pool in self.pools}
+        self._counters = {'replica': 0, 'sticky': 0, 'fallback': 0}
+        self._failures = {pool.name: 0 for pool in self.pools}
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.pools)
+            return [pool for pool in self.pools[start:] + self.pools[:start]
+                    if self._down_until[pool.name] <= now]
+
+    def getconn(self, timeout=None):
+        """A replica connection as (connection, pool), or (None, None) when no replica can serve."""
+        for pool in self._candidates():
+            try:
+                conn = pool.getconn(self.checkout_timeout if timeout is None else timeout)
+            except PoolTimeout:
+                continue  # busy rather than down: try the next one, or the primary
+            except psycopg2.Error as e:
+                self._mark_down(pool, e)
+                continue
+            return conn, pool
+        return None, None
+
+    def putconn(self, conn, pool, close=False):
+        # A connection that broke while lent out means the replica went away: its
+        # idle connections are dead too, and it is left alone for a while.
+        lost = conn.closed and not close
+        pool.putconn(conn, close=close)
+        if lost:
+            self._mark_down(pool, "connection lost")
+            pool.discard_idle()
+
+    def _mark_down(self, pool, reason):
+        logging.warning(f"[{pool.name} pool] unreachable, reading from the primary for "
+                        f"{self.retry_after:.0f}s: {reason}")
+        with self._lock:
+            self._down_until[pool.name] = time.monotonic() + self.retry_after
+            self._failures[pool.name] += 1
+
+    def count(self, target):
+        with self._lock:
+            self._counters[target] += 1
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            routing = dict(self._counters)
+            health = {name: {'up': until <= now, 'retry_in_s': round(max(0.0, until - now), 1),
+                             'failures': self._failures[name]}
+                      for name, until in self._down_until.items()}
+        return {'reads': routing, 'replicas': [{**pool.stats(), **health[pool.name]} for pool in self.pools]}
+
+
+_replicas = None
+_replica_owner = {}  # borrowed replica connection -> its pool
+
+
+def get_replicas():
+    """Returns the replica pools (None when REPLICA_CONFIG lists none), creating them on first use."""
+    global _replicas
+    if _replicas is None and REPLICA_CONFIG['replicas']:
+        with _pool_lock:
+            if _replicas is None:
+                pool_config = {key: value for key, value in POOL_CONFIG.items() if key != 'checkout_timeout'}
+                _replicas = ReplicaSet(REPLICA_CONFIG['replicas'], REPLICA_CONFIG['retry_after'],
+                                       REPLICA_CONFIG['checkout_timeout'],
+                                       connection_factory=request_metrics.connection_factory(), **pool_config)
+    return _replicas
+
+
+def has_replicas():
+    return bool(REPLICA_CONFIG['replicas'])
+
+
+def getconn_for_read(sticky=False, timeout=None):
+    """
+    Borrows a connection for a read-only unit of work: from a replica, or from the
+    primary when `sticky` (the session wrote moments ago and must see it), when no
+    replicas are configured, or when none can serve. Return it with putconn().
+    """
+    replicas = get_replicas()
+    if replicas is None:
+        return getconn(timeout)
+    if sticky:
+        replicas.count('sticky')
+        return getconn(timeout)
+    conn, pool = replicas.getconn(timeout)
+    if conn is None:
+        replicas.count('fallback')
+        return getconn(timeout)
+    replicas.count('replica')
+    _replica_owner[conn] = pool
+    return conn
+
+
+def replica_stats():
+    """Per-replica pool statistics and health, and how reads were routed; None without replicas."""
+    replicas = get_replicas()
+    return replicas.stats() if replicas else None
@@ -0,0 +1,123 @@
+# file_serving.py
+# Serving of uploaded files for /uploads/<path>.
+# Only files that belong to a PatientImage or LabReport row (or are gallery derivatives
+# of one) are served. Content-addressed files (file_storage.py) never change, so they
+# get their SHA-256 as a strong ETag and a year-long `immutable` Cache-Control; other
+# files are revalidated. Range requests are answered with 206 partial content, which
+# lets viewers seek in large DICOM/PDF files.
+#
+# With FILE_SERVING_CONFIG['offload'] set, the worker only checks access and sets the
+# headers; the front server sends the bytes:
+#   'x-accel-redirect'  nginx: an `internal` location at accel_prefix aliased to uploads/
+#   'x-sendfile'        Apache mod_xsendfile / lighttpd: the absolute file path
+import mimetypes
+import os
+import zlib
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+import file_storage
+import image_derivatives
+
+FILE_SERVING_CONFIG = {
+    'offload': None,                     # None, 'x-accel-redirect' or 'x-sendfile'
+    'accel_prefix': '/protected-uploads/',
+    'immutable_max_age': 365 * 24 * 3600,  # content-addressed originals
+    'derivative_max_age': 24 * 3600,       # thumbnails can be regenerated (--force)
+}
+
+
+def source_name(filename):
+    """The upload a path refers to: the file itself, or the original of a derivative."""
+    prefix = f"{image_derivatives.DERIVATIVE_DIR}/"
+    if filename.startswith(prefix):
+        # derivatives/<original>.<size>.<ext>
+        parts = filename[len(prefix):].rsplit('.', 2)
+        if len(parts) == 3 and parts[1] in image_derivatives.DERIVATIVE_SIZES:
+            return parts[0]
+        return None
+    return filename
+
+def find_upload_owner(cursor, name):
+    """
+    Returns (found, original_filename) for the row that references upload `name`.
+    Content-addressed names are matched by digest, older flat names by value.
+    """
+    if file_storage.is_content_path(name):
+        digest = os.path.basename(name).split('.', 1)[0]
+        cursor.execute("""
+            (SELECT original_filename FROM PatientImage WHERE content_sha256 = %s LIMIT 1)
+            UNION ALL
+            (SELECT original_filename FROM LabReport WHERE content_sha256 = %s LIMIT 1)
+            LIMIT 1
+        """, (digest, digest))
+    else:
+        cursor.execute("""
+            (SELECT original_filename FROM PatientImage WHERE image_filename = %s LIMIT 1)
+            UNION ALL
+            (SELECT original_filename FROM LabReport WHERE file_path = %s LIMIT 1)
+            LIMIT 1
+        """, (name, name))
+    row = cursor.fetchone()
+    return (True, row[0]) if row else (False, None)
+
+
+def _strong_etag(filename, stat):
+    if file_storage.is_content_path(filename):
+        return os.path.basename(filename).split('.', 1)[0]
+    # Not content-addressed: identify this version of the file by size and mtime.
+    check = zlib.adler32(filename.encode()) & 0xFFFFFFFF
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}-{check:x}"
+
+def _set_cache_headers(response, filename, is_derivative):
+    # Patient files: browsers may cache them, shared caches may not.
+    cache = response.cache_control
+    cache.public = False
+    cache.private = True
+    response.headers.pop('Expires', None)
+    if file_storage.is_content_path(filename) and not is_derivative:
+        cache.no_cache = None
+        cache.max_age = FILE_SERVING_CONFIG['immutable_max_age']
+        cache.immutable = True
+    elif is_derivative:
+        cache.no_cache = None
+        cache.max_age = FILE_SERVING_CONFIG['derivative_max_age']
+    else:
+        cache.max_age = None
+        cache.no_cache = True
+
+def serve_upload(upload_folder, filename, download_name=None):
+    """
+    Builds the response for an already authorised upload path. Raises NotFound
+    for paths outside the upload folder or missing files.
+    """
+    path = safe_join(os.path.abspath(upload_folder), filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    stat = os.stat(path)
+    is_derivative = filename.startswith(f"{image_derivatives.DERIVATIVE_DIR}/")
+    etag = _strong_etag(filename, stat)
+    mimetype = mimetypes.guess_type(download_name or filename)[0] or 'application/octet-stream'
+    offload = FILE_SERVING_CONFIG['offload']
+
+    if offload == 'x-accel-redirect':
+        response = current_app.response_class(mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = int(stat.st_mtime)
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+        else:
+            response.headers['X-Accel-Redirect'] = FILE_SERVING_CONFIG['accel_prefix'] + quote(filename)
+    else:
+        response = send_file(
+            path, request.environ, mimetype=mimetype,
+            download_name=download_name, conditional=True, etag=etag,
+            use_x_sendfile=(offload == 'x-sendfile'),
+            response_class=current_app.response_class,
+        )
+    _set_cache_headers(response, filename, is_derivative)
+    return response
@@ -0,0 +1,184 @@
+# file_storage.py
+# Content-addressed storage for uploads and downloaded scans.
+# Files are hashed (SHA-256) while they are written to a temporary file and then
+# renamed to objects/<aa>/<bb>/<sha256>.<ext> inside the upload folder. Two uploads
+# of the same bytes share one file, uploads with the same original name no longer
+# overwrite each other, and no directory grows beyond a few hundred entries.
+# The path relative to the upload folder is what PatientImage.image_filename and
+# LabReport.file_path store (migration 0008), next to the digest and the size.
+#
+# Files saved before migration 0008 are moved into the store, and their rows
+# updated, with:
+#     python file_storage.py migrate [--dry-run]
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+
+from werkzeug.utils import secure_filename
+
+import db_pool
+import image_derivatives
+
+UPLOAD_FOLDER = 'uploads'
+OBJECTS_DIR = 'objects'
+TEMP_DIR = 'tmp'
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_path(sha256, extension):
+    """Storage path (relative to the upload folder) of the content with this digest."""
+    name = f"{sha256}.{extension}" if extension else sha256
+    return f"{OBJECTS_DIR}/{sha256[:2]}/{sha256[2:4]}/{name}"
+
+def is_content_path(path):
+    return bool(path) and path.startswith(f"{OBJECTS_DIR}/")
+
+def _extension(original_filename):
+    safe_name = secure_filename(original_filename or '')
+    return safe_name.rsplit('.', 1)[1].lower() if '.' in safe_name else ''
+
+
+def new_temp_file(upload_folder=UPLOAD_FOLDER):
+    """
+    Creates an empty temporary file next to the store (same file system, so it can be
+    renamed into place). Returns (fd, path), like tempfile.mkstemp.
+    """
+    temp_dir = os.path.join(upload_folder, TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+    return tempfile.mkstemp(dir=temp_dir, suffix='.part')
+
+def store_temp_file(temp_path, sha256, size, original_filename, upload_folder=UPLOAD_FOLDER):
+    """
+    Moves a completely written temporary file with this digest into the store (or
+    drops it if the content is already there). Returns the dict store_chunks() does.
+    """
+    path = content_path(sha256, _extension(original_filename))
+    target = os.path.join(upload_folder, path)
+    deduplicated = os.path.exists(target)
+    if deduplicated:
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp_path, target)
+    return {
+        'path': path,
+        'sha256': sha256,
+        'size': size,
+        'original_filename': secure_filename(original_filename or '') or None,
+        'deduplicated': deduplicated,
+    }
+
+def store_chunks(chunks, original_filename, upload_folder=UPLOAD_FOLDER):
+    """
+    Writes an iterable of bytes chunks into the store. Returns a dict with the
+    storage 'path', 'sha256', 'size', 'original_filename' and whether the content
+    was already stored ('deduplicated'). Nothing is left behind if writing fails.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = new_temp_file(upload_folder)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                if chunk:
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        return store_temp_file(temp_path, digest.hexdigest(), size, original_filename, upload_folder)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_upload(file, upload_folder=UPLOAD_FOLDER):
+    """Stores a werkzeug FileStorage from request.files."""
+    return store_chunks(iter(lambda: file.stream.read(CHUNK_SIZE), b''), file.filename, upload_folder)
+
+def store_response(resp, original_filename, upload_folder=UPLOAD_FOLDER):
+    """Stores the body of a streaming requests.Response."""
+    return store_chunks(resp.iter_content(CHUNK_SIZE), original_filename, upload_folder)
+
+def store_file(path, original_filename=None, upload_folder=UPLOAD_FOLDER):
+    """Stores (copies) an existing file."""
+    with open(path, 'rb') as source:
+        return store_chunks(iter(lambda: source.read(CHUNK_SIZE), b''),
+                            original_filename or os.path.basename(path), upload_folder)
+
+
+# --- Migration of pre-0008 uploads ---
+def _legacy_references(cursor):
+    """{filename: [(table, id_column_value), ...]} for rows still pointing at flat files."""
+    cursor.execute("""
+        SELECT 'PatientImage', id, image_filename FROM PatientImage
+        WHERE content_sha256 IS NULL AND image_filename IS NOT NULL
+        UNION ALL
+        SELECT 'LabReport', id, file_path FROM LabReport
+        WHERE content_sha256 IS NULL AND file_path IS NOT NULL
+    """)
+    references = {}
+    for table, row_id, filename in cursor.fetchall():
+        references.setdefault(filename, []).append((table, row_id))
+    return references
+
+def _move_derivatives(upload_folder, old_name, new_name):
+    for size in image_derivatives.DERIVATIVE_SIZES:
+        for extension, _, _ in image_derivatives.DERIVATIVE_FORMATS:
+            old = os.path.join(upload_folder, image_derivatives.derivative_name(old_name, size, extension))
+            new = os.path.join(upload_folder, image_derivatives.derivative_name(new_name, size, extension))
+            if os.path.exists(old) and not os.path.exists(new):
+                os.makedirs(os.path.dirname(new), exist_ok=True)
+                os.replace(old, new)
+
+def migrate_legacy_files(db_conn, upload_folder=UPLOAD_FOLDER, dry_run=False):
+    """
+    Moves every flat upload referenced by PatientImage / LabReport into the store
+    and points the rows at it (one commit per file). Returns a dict of counts.
+    """
+    counts = {'files': 0, 'rows': 0, 'deduplicated': 0, 'missing': 0}
+    with db_conn.cursor() as cursor:
+        references = _legacy_references(cursor)
+    db_conn.rollback()
+    for filename, rows in sorted(references.items()):
+        if is_content_path(filename):
+            continue
+        source = os.path.join(upload_folder, filename)
+        if not os.path.isfile(source):
+            counts['missing'] += 1
+            logging.warning(f"{filename}: file not found, {len(rows)} row(s) left unchanged")
+            continue
+        counts['files'] += 1
+        counts['rows'] += len(rows)
+        if dry_run:
+            continue
+        stored = store_file(source, filename, upload_folder)
+        counts['deduplicated'] += stored['deduplicated']
+        with db_conn.cursor() as cursor:
+            for table, row_id in rows:
+                column = 'image_filename' if table == 'PatientImage' else 'file_path'
+                cursor.execute(f"""
+                    UPDATE {table}
+                    SET {column} = %s, content_sha256 = %s, size_bytes = %s,
+                        original_filename = COALESCE(original_filename, %s)
+                    WHERE id = %s
+                """, (stored['path'], stored['sha256'], stored['size'], filename, row_id))
+        db_conn.commit()
+        _move_derivatives(upload_folder, filename, stored['path'])
+        os.remove(source)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Content-addressed upload storage.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subcommands.add_parser("migrate", help="move pre-0008 uploads into the store")
+    migrate_parser.add_argument("--upload-folder", default=UPLOAD_FOLDER)
+    migrate_parser.add_argument("--dry-run", action="store_true", help="only report what would be moved")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with db_pool.connection() as db_conn:
+        counts = migrate_legacy_files(db_conn, args.upload_folder, args.dry_run)
+    logging.info(("Would move" if args.dry_run else "Moved") +
+                 f" {counts['files']} files ({counts['rows']} rows, {counts['deduplicated']} duplicates, "
+                 f"{counts['missing']} missing).")
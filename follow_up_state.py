@@ -0,0 +1,145 @@
+# follow_up_state.py
+# Per-patient follow-up state (FollowUpState, migration 0010).
+# One row per patient holding the latest follow-up date any prescription asked for
+# and the date of the latest recorded visit. The routes that write prescriptions and
+# visits update it in the same transaction, so the missed-follow-up page and the
+# dashboard read a partial index instead of aggregating Prescription and
+# FollowUpVisit on every load.
+#
+# Prescriptions and visits are only ever inserted, so the state only moves forward
+# (GREATEST). After bulk loads or manual edits of those tables recompute it with:
+#     python follow_up_state.py rebuild
+import argparse
+import logging
+import time
+from datetime import datetime
+
+import db_pool
+
+PER_PAGE = 25
+
+# Must match the predicate of idx_followupstate_missed for the index to be used.
+MISSED_CONDITION = """
+    (fs.last_visit_date IS NULL OR fs.last_visit_date <= fs.next_due_date)
+    AND fs.next_due_date < CURRENT_DATE
+"""
+
+
+# --- Writes (call inside the transaction that inserts the prescription / visit) ---
+def record_prescription(cursor, patient_id, next_follow_up_date):
+    if not next_follow_up_date:
+        return
+    cursor.execute("""
+        INSERT INTO FollowUpState (patient_id, next_due_date)
+        VALUES (%s, %s)
+        ON CONFLICT (patient_id) DO UPDATE
+        SET next_due_date = GREATEST(FollowUpState.next_due_date, EXCLUDED.next_due_date),
+            updated_at = NOW()
+    """, (patient_id, next_follow_up_date))
+
+def record_visit(cursor, patient_id, visit_date):
+    cursor.execute("""
+        INSERT INTO FollowUpState (patient_id, last_visit_date)
+        VALUES (%s, %s)
+        ON CONFLICT (patient_id) DO UPDATE
+        SET last_visit_date = GREATEST(FollowUpState.last_visit_date, EXCLUDED.last_visit_date),
+            updated_at = NOW()
+    """, (patient_id, visit_date))
+
+def rebuild(db_conn):
+    """Recomputes the whole table from Prescription and FollowUpVisit. Returns the row count."""
+    with db_conn.cursor() as cursor:
+        # TRUNCATE locks the table, so writes that arrive meanwhile wait and apply afterwards.
+        cursor.execute("TRUNCATE FollowUpState")
+        cursor.execute("""
+            INSERT INTO FollowUpState (patient_id, next_due_date, last_visit_date)
+            SELECT patient_id, due.next_due_date, visits.last_visit_date
+            FROM (
+                SELECT patient_id, MAX(next_follow_up_date) AS next_due_date
+                FROM Prescription
+                WHERE next_follow_up_date IS NOT NULL
+                GROUP BY patient_id
+            ) due
+            FULL JOIN (
+                SELECT patient_id, MAX(visit_date) AS last_visit_date
+                FROM FollowUpVisit
+                GROUP BY patient_id
+            ) visits USING (patient_id)
+        """)
+        count = cursor.rowcount
+        cursor.execute("ANALYZE FollowUpState")
+    db_conn.commit()
+    return count
+
+
+# --- Reads ---
+def _parse_cursor(value):
+    """Keyset cursors look like '2024-05-01.123' (due date, patient id)."""
+    try:
+        due, patient_id = value.split('.', 1)
+        return datetime.strptime(due, '%Y-%m-%d').date(), int(patient_id)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _format_cursor(row):
+    return f"{row['last_follow_up_due'].isoformat()}.{row['id']}"
+
+def count_missed(cursor):
+    cursor.execute(f"SELECT COUNT(*) FROM FollowUpState fs WHERE {MISSED_CONDITION}")
+    return cursor.fetchone()[0]
+
+def missed_follow_ups_page(cursor, args, per_page=PER_PAGE):
+    """
+    Returns one page of patients whose follow-up is overdue, most overdue first.
+    `args` is request.args; `after` / `before` are keyset cursors for the next and
+    previous page. The dict has 'patients', 'next_cursor' and 'prev_cursor'.
+    """
+    after = _parse_cursor(args.get('after'))
+    before = None if after else _parse_cursor(args.get('before'))
+    clauses = [MISSED_CONDITION]
+    params = []
+    order = "ASC"
+    if after:
+        clauses.append("(fs.next_due_date, fs.patient_id) > (%s, %s)")
+        params.extend(after)
+    elif before:
+        clauses.append("(fs.next_due_date, fs.patient_id) < (%s, %s)")
+        params.extend(before)
+        order = "DESC"
+
+    # Fetch one extra row to learn whether another page exists in this direction.
+    cursor.execute(f"""
+        SELECT p.id, p.patient_code, p.name, p.mobile_number,
+               fs.next_due_date AS last_follow_up_due,
+               (CURRENT_DATE - fs.next_due_date) AS days_overdue
+        FROM FollowUpState fs
+        JOIN Patient p ON p.id = fs.patient_id
+        WHERE {" AND ".join(clauses)}
+        ORDER BY fs.next_due_date {order}, fs.patient_id {order}
+        LIMIT %s
+    """, tuple(params) + (per_page + 1,))
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+    return {
+        'patients': rows,
+        'next_cursor': _format_cursor(rows[-1]) if rows and has_next else None,
+        'prev_cursor': _format_cursor(rows[0]) if rows and has_prev else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the per-patient follow-up state.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="recompute FollowUpState from prescriptions and visits")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    started = time.monotonic()
+    with db_pool.connection() as db_conn:
+        rows = rebuild(db_conn)
+    logging.info(f"Rebuilt follow-up state for {rows} patients in {(time.monotonic() - started) * 1000:.0f} ms.")
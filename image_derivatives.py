@@ -0,0 +1,219 @@
+# image_derivatives.py
+# Gallery-sized copies of uploaded images.
+# For every uploaded photo a thumbnail and a medium-size rendition are written next to
+# the uploads (uploads/derivatives/<file>.<size>.<webp|jpg>), rotated according to the
+# EXIF orientation and stripped of metadata. Generation runs in a process pool so
+# decoding a 12-megapixel photo never happens on the request path; the galleries use
+# the derivatives through srcset and fall back to the original until they exist.
+#
+# Pillow is optional: without it no derivatives are made and the galleries keep
+# showing the originals. Radiology scans (.dcm), which browsers cannot display at
+# all, get derivatives too when pydicom and numpy are installed.
+# Existing uploads can be backfilled with:
+#     python image_derivatives.py             # only files without derivatives
+#     python image_derivatives.py --force     # regenerate everything
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed; derivatives are disabled
+    Image = None
+
+try:
+    import numpy
+    import pydicom
+    try:
+        from pydicom.pixels import apply_voi_lut
+    except ImportError:  # pydicom < 3
+        from pydicom.pixel_data_handlers.util import apply_voi_lut
+except ImportError:  # no DICOM rendering
+    pydicom = None
+
+UPLOAD_FOLDER = 'uploads'
+DERIVATIVE_DIR = 'derivatives'  # inside UPLOAD_FOLDER
+
+# Target widths, smallest first. The thumbnail is always made (never upscaled);
+# larger renditions only when the original is wider.
+DERIVATIVE_SIZES = {'thumb': 480, 'medium': 1280}
+# (extension, Pillow format, save options), preferred format first.
+DERIVATIVE_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+DICOM_EXTENSIONS = {'dcm'}
+POOL_WORKERS = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def is_available():
+    return Image is not None
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def is_derivable(filename):
+    extension = _extension(filename)
+    return extension in IMAGE_EXTENSIONS or (extension in DICOM_EXTENSIONS and pydicom is not None)
+
+def derivative_name(filename, size, extension):
+    """Path of a derivative relative to UPLOAD_FOLDER (usable with uploaded_file)."""
+    return f"{DERIVATIVE_DIR}/{filename}.{size}.{extension}"
+
+
+# --- Generation (runs in the pool's worker processes) ---
+def _flatten(image):
+    """RGB copy of the image; transparent areas become white."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def _open_dicom(path):
+    """Renders a DICOM file (middle frame, VOI LUT / windowing applied) as an 8-bit image."""
+    dataset = pydicom.dcmread(path)
+    pixels = dataset.pixel_array
+    if getattr(dataset, 'NumberOfFrames', 1) > 1:
+        pixels = pixels[len(pixels) // 2]
+    if getattr(dataset, 'PhotometricInterpretation', '') in ('MONOCHROME1', 'MONOCHROME2'):
+        pixels = apply_voi_lut(pixels, dataset).astype(numpy.float64)
+        low, high = pixels.min(), pixels.max()
+        pixels = (pixels - low) / ((high - low) or 1) * 255.0
+        if dataset.PhotometricInterpretation == 'MONOCHROME1':
+            pixels = 255.0 - pixels
+    return Image.fromarray(pixels.astype(numpy.uint8))
+
+def generate_derivatives(upload_folder, filename, force=False):
+    """
+    Writes the missing derivatives of one upload. Returns a dict with the names
+    created and, if the file could not be processed, the error message.
+    """
+    result = {'filename': filename, 'created': [], 'error': None}
+    source = os.path.join(upload_folder, filename)
+    try:
+        source_mtime = os.path.getmtime(source)
+        if _extension(filename) in DICOM_EXTENSIONS:
+            image = _flatten(_open_dicom(source))
+        else:
+            with Image.open(source) as original:
+                largest = max(DERIVATIVE_SIZES.values())
+                original.draft('RGB', (largest, largest))  # JPEG: decode at reduced scale
+                image = _flatten(ImageOps.exif_transpose(original))
+        for index, (size, width) in enumerate(DERIVATIVE_SIZES.items()):
+            if index and image.width <= width:
+                continue
+            width = min(width, image.width)
+            resized = None
+            for extension, image_format, options in DERIVATIVE_FORMATS:
+                name = derivative_name(filename, size, extension)
+                target = os.path.join(upload_folder, name)
+                if not force and os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+                    continue
+                if resized is None:
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image.resize((width, height), Image.LANCZOS)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                temp_path = f"{target}.tmp{os.getpid()}"
+                resized.save(temp_path, image_format, **options)
+                os.replace(temp_path, target)
+                result['created'].append(name)
+    except (OSError, ValueError, AttributeError, Image.DecompressionBombError) as e:
+        result['error'] = str(e)
+    return result
+
+
+# --- Scheduling (web process) ---
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 'spawn' so the workers do not inherit the web process's threads and DB sockets.
+            _executor = ProcessPoolExecutor(max_workers=POOL_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+def _log_result(future):
+    try:
+        result = future.result()
+    except Exception as e:
+        logging.error(f"Image derivative generation crashed: {e}")
+        return
+    if result['error']:
+        logging.warning(f"No derivatives for {result['filename']}: {result['error']}")
+
+def submit(filename, upload_folder=UPLOAD_FOLDER):
+    """Queues derivative generation for an uploaded file; a no-op for non-images or without Pillow."""
+    if not is_available() or not is_derivable(filename):
+        return None
+    try:
+        future = _get_executor().submit(generate_derivatives, upload_folder, filename)
+    except RuntimeError as e:  # pool shut down or broken; the gallery falls back to the original
+        logging.error(f"Could not queue image derivatives for {filename}: {e}")
+        return None
+    future.add_done_callback(_log_result)
+    return future
+
+
+# --- Lookup (templates / JSON) ---
+def available_derivatives(filename, upload_folder=UPLOAD_FOLDER):
+    """
+    Returns {extension: [(name, width), ...]} for the derivatives that exist on
+    disk, smallest first, or {} if there are none yet.
+    """
+    if not filename or not is_derivable(filename):
+        return {}
+    found = {}
+    for extension, _, _ in DERIVATIVE_FORMATS:
+        for size, width in sorted(DERIVATIVE_SIZES.items(), key=lambda item: item[1]):
+            name = derivative_name(filename, size, extension)
+            if os.path.exists(os.path.join(upload_folder, name)):
+                found.setdefault(extension, []).append((name, width))
+    return found
+
+
+# --- Backfill ---
+def iter_uploads(upload_folder=UPLOAD_FOLDER):
+    """Relative paths of the image uploads (derivatives excluded)."""
+    for root, dirs, files in os.walk(upload_folder):
+        if root == upload_folder and DERIVATIVE_DIR in dirs:
+            dirs.remove(DERIVATIVE_DIR)
+        for name in files:
+            if is_derivable(name):
+                yield os.path.relpath(os.path.join(root, name), upload_folder).replace(os.sep, '/')
+
+def backfill(upload_folder=UPLOAD_FOLDER, force=False, workers=POOL_WORKERS):
+    """Generates derivatives for every existing upload. Returns (processed, created, failed)."""
+    filenames = list(iter_uploads(upload_folder))
+    processed = created = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(generate_derivatives, [upload_folder] * len(filenames),
+                               filenames, [force] * len(filenames), chunksize=8):
+            processed += 1
+            created += len(result['created'])
+            if result['error']:
+                failed += 1
+                logging.warning(f"{result['filename']}: {result['error']}")
+    return processed, created, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backfill gallery derivatives for existing uploads.")
+    parser.add_argument("--upload-folder", default=UPLOAD_FOLDER)
+    parser.add_argument("--force", action="store_true", help="regenerate derivatives that already exist")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or POOL_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if not is_available():
+        sys.exit("Pillow is not installed; run `pip install Pillow` first.")
+    processed, created, failed = backfill(args.upload_folder, args.force, args.workers)
+    logging.info(f"Checked {processed} images: {created} derivatives written, {failed} could not be read.")
@@ -1,58 +1,400 @@
 # init_db.py
+import argparse
+import hashlib
+import json
+import os
+import sys
+
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import os
 
 # --- IMPORTANT ---
 # Set your PostgreSQL connection details here.
 DB_NAME = "dermatology_db"
-DB_USER = "postgres" 
+DB_USER = "postgres"
 DB_PASSWORD = "Noor@818" # Change this to your password
 DB_HOST = "localhost"
 DB_PORT = "5432"
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(BASE_DIR, "migrations")
+
 # Connection string for the default 'postgres' database
 conn_string_default = f"dbname='postgres' user='{DB_USER}' host='{DB_HOST}' password='{DB_PASSWORD}' port='{DB_PORT}' sslmode='disable'"
+conn_string_new_db = f"dbname='{DB_NAME}' user='{DB_USER}' host='{DB_HOST}' password='{DB_PASSWORD}' port='{DB_PORT}' sslmode='disable'"
 
-try:
-    # --- Step 1: Connect to the default database to create our new one ---
+
+# --- Step 1: Create the database and base tables ---
+def create_database():
+    """Connects to the default database and creates DB_NAME if it is missing."""
     conn = psycopg2.connect(conn_string_default)
     conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT) # Needed to run CREATE DATABASE
-    cursor = conn.cursor()
-    
-    # Check if the database already exists
-    cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{DB_NAME}'")
-    exists = cursor.fetchone()
-    if not exists:
-        cursor.execute(f"CREATE DATABASE {DB_NAME}")
-        print(f"Database '{DB_NAME}' created successfully.")
-    else:
-        print(f"Database '{DB_NAME}' already exists.")
-        
-    cursor.close()
-    conn.close()
-
-    # --- Step 2: Connect to the new database to create tables ---
-    conn_string_new_db = f"dbname='{DB_NAME}' user='{DB_USER}' host='{DB_HOST}' password='{DB_PASSWORD}' port='{DB_PORT}' sslmode='disable'"
-    conn = psycopg2.connect(conn_string_new_db)
-    cursor = conn.cursor()
-
-    # Read the SQL script
-    with open("init_db.sql", "r") as f:
+    try:
+        with conn.cursor() as cursor:
+            # Check if the database already exists
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (DB_NAME,))
+            if not cursor.fetchone():
+                cursor.execute(f"CREATE DATABASE {DB_NAME}")
+                print(f"Database '{DB_NAME}' created successfully.")
+            else:
+                print(f"Database '{DB_NAME}' already exists.")
+    finally:
+        conn.close()
+
+def create_tables(conn):
+    """Runs init_db.sql. Note: this drops and recreates every table."""
+    with open(os.path.join(BASE_DIR, "init_db.sql"), "r") as f:
         sql_script = f.read()
+    with conn.cursor() as cursor:
+        cursor.execute(sql_script)
+    conn.commit()
+    print(f"Tables created successfully inside '{DB_NAME}'.")
+
+
+# --- Step 2: Versioned migrations ---
+# Each file in migrations/ is named NNNN_description.sql and is applied exactly once,
+# in version order, inside its own transaction. Applied versions are recorded in
+# schema_migrations together with a checksum so edited migrations are detected.
+def list_migrations():
+    migrations = []
+    for fname in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not fname.endswith(".sql"):
+            continue
+        version, _, name = fname[:-4].partition("_")
+        if not version.isdigit():
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, fname), "r") as f:
+            sql = f.read()
+        checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        migrations.append({'version': int(version), 'name': name, 'file': fname, 'sql': sql, 'checksum': checksum})
+    return migrations
 
-    # Execute the script to create tables
-    cursor.execute(sql_script)
+def ensure_migrations_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name VARCHAR(200) NOT NULL,
+                checksum CHAR(64) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
     conn.commit()
-    print("Tables created successfully inside 'dermatology_db'.")
 
-except psycopg2.Error as e:
-    print(f"An error occurred: {e}")
+def applied_migrations(conn):
+    ensure_migrations_table(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version, checksum FROM schema_migrations")
+        return dict(cursor.fetchall())
 
-finally:
-    # Clean up
-    if 'cursor' in locals() and cursor and not cursor.closed:
-        cursor.close()
-    if 'conn' in locals() and conn and not conn.closed:
-        conn.close()
-    print("Process finished. Connection closed.")
+def apply_migrations(conn, target=None):
+    """Applies every pending migration up to `target` (all if None). Returns the versions applied."""
+    done = applied_migrations(conn)
+    applied_now = []
+    for m in list_migrations():
+        if target is not None and m['version'] > target:
+            break
+        if m['version'] in done:
+            if done[m['version']] != m['checksum']:
+                print(f"WARNING: migration {m['file']} was edited after it was applied.")
+            continue
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(m['sql'])
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                    (m['version'], m['name'], m['checksum'])
+                )
+            conn.commit()
+        except psycopg2.Error:
+            conn.rollback()
+            print(f"Migration {m['file']} failed; nothing from it was applied.")
+            raise
+        print(f"Applied migration {m['file']}")
+        applied_now.append(m['version'])
+    if not applied_now:
+        print("Schema is up to date.")
+    return applied_now
+
+def print_migration_status(conn):
+    done = applied_migrations(conn)
+    for m in list_migrations():
+        state = "applied" if m['version'] in done else "pending"
+        print(f"  {m['version']:04d}  {m['name']:<40} {state}")
+
+
+# --- Step 3: EXPLAIN verification of the hot queries ---
+# Seeds a synthetic dataset inside a transaction (rolled back afterwards), runs EXPLAIN
+# on the queries behind the busiest pages, and fails if any of them still scans the
+# listed table sequentially.
+def seed_verification_data(cursor, patients):
+    cursor.execute("SELECT id FROM Roles ORDER BY id LIMIT 1")
+    role = cursor.fetchone()
+    if not role:
+        cursor.execute("INSERT INTO Roles (name) VALUES ('admin') RETURNING id")
+        role = cursor.fetchone()
+    cursor.execute(
+        "INSERT INTO Users (username, password_hash, role_id) VALUES ('explain_verify_user', '-', %s) RETURNING id",
+        (role[0],)
+    )
+    doctor_id = cursor.fetchone()[0]
+    params = {'n': patients, 'doctor': doctor_id}
+
+    cursor.execute("""
+        INSERT INTO Patient (patient_code, name, dob, gender, mobile_number, city, date_of_registration,
+                             complaints, diagnosis, registered_by_doctor_id)
+        SELECT 'VRFY-' || g, 'Verify ' || md5(g::text), DATE '1950-01-01' + (g %% 25000),
+               CASE WHEN g %% 2 = 0 THEN 'Male' ELSE 'Female' END,
+               (7000000000 + (g::bigint * 7919) %% 2999999999)::text, 'City ' || (g %% 50),
+               CURRENT_DATE - ((%(n)s - g) * 1500 / %(n)s),
+               'Itching and scaling', (ARRAY['Psoriasis', 'Eczema', 'Acne', 'Vitiligo'])[1 + g %% 4],
+               %(doctor)s
+        FROM generate_series(1, %(n)s) g
+    """, params)
+    cursor.execute("""
+        INSERT INTO FollowUpVisit (patient_id, visit_date, disease_status, doctor_id)
+        SELECT p.id, p.date_of_registration + v * 30, 'Improving', %(doctor)s
+        FROM Patient p CROSS JOIN generate_series(1, 3) v WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    cursor.execute("""
+        INSERT INTO Prescription (patient_id, doctor_id, prescription_date, condition_notes, next_follow_up_date)
+        SELECT p.id, %(doctor)s, p.date_of_registration + v * 30, 'Continue therapy',
+               p.date_of_registration + v * 30 + 28
+        FROM Patient p CROSS JOIN generate_series(1, 2) v WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    cursor.execute("""
+        INSERT INTO FollowUpState (patient_id, next_due_date, last_visit_date)
+        SELECT p.id,
+               (SELECT MAX(next_follow_up_date) FROM Prescription WHERE patient_id = p.id),
+               (SELECT MAX(visit_date) FROM FollowUpVisit WHERE patient_id = p.id)
+        FROM Patient p WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    cursor.execute("""
+        INSERT INTO PrescriptionItem (prescription_id, medication_name, dosage, frequency, duration)
+        SELECT pr.id, (ARRAY['Methotrexate', 'Clobetasol', 'Isotretinoin'])[1 + (pr.id + i) %% 3], '10mg', 'Daily', '4 weeks'
+        FROM Prescription pr JOIN Patient p ON p.id = pr.patient_id
+        CROSS JOIN generate_series(1, 2) i WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    cursor.execute("""
+        INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes)
+        SELECT p.id, 'verify_' || p.id || '.jpg', p.date_of_registration, 'Clinical Photo'
+        FROM Patient p WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    cursor.execute("""
+        INSERT INTO LabReport (patient_id, report_type, department, report_date, status, requested_by_doctor_id)
+        SELECT p.id, 'CBC', 'Pathology', p.date_of_registration + v,
+               CASE WHEN (p.id + v) %% 97 = 0 THEN 'Pending' ELSE 'Completed' END, %(doctor)s
+        FROM Patient p CROSS JOIN generate_series(1, 2) v WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    cursor.execute("""
+        INSERT INTO Bed (bed_number, status)
+        SELECT 'VRFY-B' || b, 'Occupied' FROM generate_series(1, 40) b
+    """)
+    cursor.execute("""
+        INSERT INTO BedAssignment (patient_id, bed_id, admission_date, discharge_date)
+        SELECT p.id, b.id, p.date_of_registration,
+               CASE WHEN p.rn <= 40 THEN NULL ELSE p.date_of_registration + 7 END
+        FROM (SELECT id, date_of_registration, row_number() OVER (ORDER BY id DESC) AS rn
+              FROM Patient WHERE patient_code LIKE 'VRFY-%%' AND id %% 10 = 0) p
+        JOIN (SELECT id, row_number() OVER (ORDER BY id) AS bn FROM Bed WHERE bed_number LIKE 'VRFY-B%%') b
+          ON b.bn = 1 + (p.rn - 1) %% 40
+    """, params)
+    cursor.execute("""
+        INSERT INTO DailyProgressNote (assignment_id, note_date, notes, doctor_id)
+        SELECT ba.id, ba.admission_date + d * INTERVAL '1 day', 'Lesions settling', %(doctor)s
+        FROM BedAssignment ba JOIN Patient p ON p.id = ba.patient_id
+        CROSS JOIN generate_series(0, 2) d WHERE p.patient_code LIKE 'VRFY-%%'
+    """, params)
+    for table in ("Patient", "FollowUpVisit", "Prescription", "FollowUpState", "PrescriptionItem", "PatientImage",
+                  "LabReport", "Bed", "BedAssignment", "DailyProgressNote"):
+        cursor.execute(f"ANALYZE {table}")
+
+def remove_verification_data(cursor):
+    """Deletes everything seed_verification_data() created (for seeds that were committed)."""
+    vrfy_patients = "SELECT id FROM Patient WHERE patient_code LIKE 'VRFY-%'"
+    cursor.execute(f"""
+        DELETE FROM DailyProgressNote WHERE assignment_id IN
+            (SELECT id FROM BedAssignment WHERE patient_id IN ({vrfy_patients}))
+    """)
+    cursor.execute(f"DELETE FROM BedAssignment WHERE patient_id IN ({vrfy_patients})")
+    cursor.execute("DELETE FROM Bed WHERE bed_number LIKE 'VRFY-B%'")
+    cursor.execute(f"""
+        DELETE FROM PrescriptionItem WHERE prescription_id IN
+            (SELECT id FROM Prescription WHERE patient_id IN ({vrfy_patients}))
+    """)
+    for table in ("Prescription", "FollowUpVisit", "LabReport", "PatientImage"):
+        cursor.execute(f"DELETE FROM {table} WHERE patient_id IN ({vrfy_patients})")
+    cursor.execute("DELETE FROM Patient WHERE patient_code LIKE 'VRFY-%'")
+    cursor.execute("DELETE FROM Users WHERE username = 'explain_verify_user'")
+
+class VerificationDataMissing(Exception):
+    """The database has no row to take a hot query's sample parameters from."""
+
+def _sample_row(cursor, what, sql, params=None):
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    if row is None:
+        raise VerificationDataMissing(f"not enough data to verify {what}")
+    return row
+
+def hot_queries(cursor, seeded=True):
+    """
+    (label, sql, params, table that must not be seq-scanned) for the busiest pages.
+    Sample ids come from seed_verification_data()'s rows, or with seeded=False from
+    whatever the database holds. Raises VerificationDataMissing when a sample is missing.
+    """
+    if seeded:
+        patient_sql = "SELECT id, name, patient_code, mobile_number FROM Patient WHERE patient_code LIKE 'VRFY-%' ORDER BY id DESC LIMIT 1"
+        prescription_sql = "SELECT id FROM Prescription WHERE patient_id = %(patient_id)s LIMIT 1"
+        doctor_sql = "SELECT id FROM Users WHERE username = 'explain_verify_user'"
+    else:
+        patient_sql = "SELECT id, name, patient_code, mobile_number FROM Patient ORDER BY id DESC LIMIT 1"
+        prescription_sql = "SELECT id FROM Prescription ORDER BY id DESC LIMIT 1"
+        doctor_sql = "SELECT id FROM Users ORDER BY id LIMIT 1"
+    patient_id, name, code, mobile = _sample_row(cursor, "the patient pages (no patients)", patient_sql)
+    prescription_id, = _sample_row(cursor, "prescription items (no prescriptions)", prescription_sql,
+                                   {'patient_id': patient_id})
+    assignment_id, = _sample_row(cursor, "daily notes (no open bed assignment)",
+                                 "SELECT id FROM BedAssignment WHERE discharge_date IS NULL ORDER BY id DESC LIMIT 1")
+    doctor_id, = _sample_row(cursor, "user activity (no users)", doctor_sql)
+    name_term = f"%{(name.split() or [''])[-1][:8]}%"
+    mobile = mobile or ''
+    return [
+        ("patient_detail: follow-up visits",
+         "SELECT * FROM FollowUpVisit WHERE patient_id = %s ORDER BY visit_date DESC", (patient_id,), "followupvisit"),
+        ("patient_detail: prescriptions",
+         "SELECT * FROM Prescription WHERE patient_id = %s ORDER BY prescription_date DESC", (patient_id,), "prescription"),
+        ("patient_detail: prescription items",
+         "SELECT * FROM PrescriptionItem WHERE prescription_id = %s", (prescription_id,), "prescriptionitem"),
+        ("patient_detail: images",
+         "SELECT * FROM PatientImage WHERE patient_id = %s ORDER BY upload_date DESC", (patient_id,), "patientimage"),
+        ("patient_detail: lab reports",
+         "SELECT * FROM LabReport WHERE patient_id = %s ORDER BY report_date DESC", (patient_id,), "labreport"),
+        ("patient_detail: current admission",
+         "SELECT * FROM BedAssignment WHERE patient_id = %s AND discharge_date IS NULL", (patient_id,), "bedassignment"),
+        ("patient_detail: daily notes",
+         "SELECT * FROM DailyProgressNote WHERE assignment_id = %s ORDER BY note_date DESC", (assignment_id,), "dailyprogressnote"),
+        ("patient search: name ILIKE",
+         "SELECT id FROM Patient WHERE name ILIKE %s ORDER BY id DESC LIMIT 15", (name_term,), "patient"),
+        ("patient search: patient_code ILIKE",
+         "SELECT id FROM Patient WHERE patient_code ILIKE %s ORDER BY id DESC LIMIT 15", (f"%{code[-6:]}%",), "patient"),
+        ("patient search: mobile_number ILIKE",
+         "SELECT id FROM Patient WHERE mobile_number ILIKE %s ORDER BY id DESC LIMIT 15", (f"%{mobile[-7:]}%",), "patient"),
+        ("patient list: deep keyset page",
+         "SELECT id FROM Patient WHERE id < %s ORDER BY id DESC LIMIT 16", (patient_id // 2,), "patient"),
+        ("patient list: city filter",
+         "SELECT id FROM Patient WHERE LOWER(city) = LOWER(%s) ORDER BY id DESC LIMIT 16", ("City 7",), "patient"),
+        ("missed_follow_ups: overdue page",
+         """SELECT fs.patient_id FROM FollowUpState fs
+            WHERE (fs.last_visit_date IS NULL OR fs.last_visit_date <= fs.next_due_date)
+              AND fs.next_due_date < CURRENT_DATE
+            ORDER BY fs.next_due_date, fs.patient_id LIMIT 26""", (), "followupstate"),
+        ("dashboard: missed follow-up count",
+         """SELECT COUNT(*) FROM FollowUpState fs
+            WHERE (fs.last_visit_date IS NULL OR fs.last_visit_date <= fs.next_due_date)
+              AND fs.next_due_date < CURRENT_DATE""", (), "followupstate"),
+        ("user activity: visits page",
+         """SELECT fv.id FROM FollowUpVisit fv JOIN Patient p ON fv.patient_id = p.id
+            WHERE fv.doctor_id = %s ORDER BY fv.visit_date DESC, fv.id DESC LIMIT 51""", (doctor_id,), "followupvisit"),
+        ("user activity: prescriptions page",
+         """SELECT pr.id FROM Prescription pr
+            WHERE pr.doctor_id = %s ORDER BY pr.prescription_date DESC, pr.id DESC LIMIT 51""", (doctor_id,), "prescription"),
+        ("dashboard: pending lab reports",
+         "SELECT COUNT(*) FROM LabReport WHERE status = 'Pending'", (), "labreport"),
+        ("bed_management: open assignments",
+         """SELECT b.id, ba.id FROM Bed b
+            LEFT JOIN BedAssignment ba ON b.id = ba.bed_id AND ba.discharge_date IS NULL""", (), "bedassignment"),
+        ("patient API: versions of a batch",
+         """SELECT p.patient_code, p.id, COALESCE(v.version, 0) FROM Patient p
+            LEFT JOIN PatientApiVersion v ON v.patient_id = p.id
+            WHERE p.patient_code = ANY(%s)""", ([code],), "patient"),
+        ("weekly_registrations: last 7 days",
+         "SELECT COUNT(*) FROM Patient WHERE date_of_registration >= CURRENT_DATE - 6", (), "patient"),
+    ]
+
+def find_seq_scans(plan, table):
+    """Walks an EXPLAIN (FORMAT JSON) plan tree and returns Seq Scan nodes on `table`."""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name', '').lower() == table:
+        found.append(plan)
+    for child in plan.get('Plans', []):
+        found.extend(find_seq_scans(child, table))
+    return found
+
+def verify_plans(conn, seed_patients=20000, verbose=False):
+    """Returns True when none of the hot queries falls back to a seq scan."""
+    failures = []
+    try:
+        with conn.cursor() as cursor:
+            if seed_patients:
+                print(f"Seeding {seed_patients} synthetic patients (rolled back afterwards)...")
+                seed_verification_data(cursor, seed_patients)
+            for label, sql, params, table in hot_queries(cursor, seeded=bool(seed_patients)):
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                raw = cursor.fetchone()[0]
+                plan = (raw if isinstance(raw, list) else json.loads(raw))[0]['Plan']
+                seq_scans = find_seq_scans(plan, table)
+                status = "SEQ SCAN" if seq_scans else "ok"
+                print(f"  [{status:^8}] {label}")
+                if verbose or seq_scans:
+                    cursor.execute("EXPLAIN " + sql, params)
+                    for (line,) in cursor.fetchall():
+                        print(f"             {line}")
+                if seq_scans:
+                    failures.append(label)
+    finally:
+        conn.rollback()
+    if failures:
+        print(f"{len(failures)} hot queries still use a sequential scan.")
+        return False
+    print("All hot queries use indexes.")
+    return True
+
+
+# --- Command line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create, migrate and verify the dermatology database.")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("init", help="(default) create the database, recreate all tables and apply migrations. Erases existing data.")
+    migrate = sub.add_parser("migrate", help="apply pending migrations to an existing database")
+    migrate.add_argument("--target", type=int, default=None, help="stop after this migration version")
+    sub.add_parser("status", help="list migrations and whether they have been applied")
+    verify = sub.add_parser("verify", help="EXPLAIN the hot queries and fail on sequential scans")
+    verify.add_argument("--seed", type=int, default=20000,
+                        help="synthetic patients to seed (0 uses existing data: at least one patient, "
+                             "prescription, open bed assignment and user)")
+    verify.add_argument("--verbose", action="store_true", help="print every plan, not only failing ones")
+    args = parser.parse_args(argv)
+    command = args.command or "init"
+
+    conn = None
+    try:
+        if command == "init":
+            create_database()
+        conn = psycopg2.connect(conn_string_new_db)
+        if command == "init":
+            create_tables(conn)
+            apply_migrations(conn)
+        elif command == "migrate":
+            apply_migrations(conn, target=args.target)
+        elif command == "status":
+            print_migration_status(conn)
+        elif command == "verify":
+            if not verify_plans(conn, seed_patients=args.seed, verbose=args.verbose):
+                return 1
+    except VerificationDataMissing as e:
+        print(f"Cannot verify: {e}. Seed synthetic data instead (--seed N).")
+        return 1
+    except psycopg2.Error as e:
+        print(f"An error occurred: {e}")
+        return 1
+    finally:
+        # Clean up
+        if conn is not None and not conn.closed:
+            conn.close()
+        print("Process finished. Connection closed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,6 +18,12 @@ DROP TABLE IF EXISTS Patient CASCADE;
 DROP TABLE IF EXISTS Users CASCADE;
 DROP TABLE IF EXISTS Roles CASCADE;
 DROP TABLE IF EXISTS UserActivityLog CASCADE;
+DROP TABLE IF EXISTS RadiologyJob CASCADE;
+DROP TABLE IF EXISTS FollowUpState CASCADE;
+DROP TABLE IF EXISTS ClinicalSearchDocument CASCADE;
+DROP TABLE IF EXISTS PatientApiVersion CASCADE;
+DROP TABLE IF EXISTS RadiologyScanCache CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
 
 -- Roles for users
 CREATE TABLE Roles (
@@ -1,21 +1,73 @@
-from flask import Blueprint, request, session, flash, redirect, url_for
+from flask import Blueprint, request, session, flash, redirect, url_for, jsonify
 from datetime import date
+import logging
 import psycopg2
 import psycopg2.extras
 
+import db_pool
+
 # --- Blueprint Setup for Lab ---
 lab_bp = Blueprint('lab_api', __name__)
 
-# --- Database Configuration ---
-DB_CONFIG = {
-    'dbname': 'dermatology_db', 'user': 'postgres', 'password': 'Noor@818',
-    'host': 'localhost', 'port': '5432', 'sslmode': 'disable'
+# This dictionary contains the detailed lab test structure.
+TEST_CATEGORIES = {
+    'biochemistry': {
+        'Kidney Function': ['GLU', 'UREA', 'CREATININE'],
+        'Liver Function': ['SGOT', 'SGPT', 'ALBUMIN', 'TOTAL_BILIRUBIN'],
+        'Thyroid Function': ['TSH', 'T3', 'T4'],
+        'Cardiac Markers': ['TROPONIN_I'],
+        'Lipid Profile': ['TOTAL_CHOLESTEROL', 'HDL', 'LDL'],
+        'Electrolytes': ['SODIUM', 'POTASSIUM']
+    },
+    'microbiology': {
+        'Wet Mount & Staining': ['GRAM_STAIN', 'HANGING_DROP', 'INDIA_INK', 'STOOL_OVA', 'KOH_MOUNT', 'ZN_STAIN'],
+        'Culture & Sensitivity': ['BLOOD_CULTURE', 'URINE_CULTURE', 'SPUTUM_CULTURE', 'WOUND_CULTURE', 'THROAT_CULTURE', 'CSF_CULTURE'],
+        'Fungal Culture': ['FUNGAL_CULTURE', 'FUNGAL_ID', 'ANTIFUNGAL_SENS'],
+        'Serology': ['WIDAL', 'TYPHIDOT', 'DENGUE_NS1', 'MALARIA_AG', 'HIV_ELISA', 'HBSAG']
+    },
+    'pathology': {
+        'Histopathology': ['BIOPSY_HISTOPATHOLOGY', 'SURGICAL_PATHOLOGY'],
+        'Hematology': ['CBC', 'PERIPHERAL_SMEAR', 'BONE_MARROW', 'COAGULATION'],
+        'Immunohistochemistry': ['IHC_MARKERS', 'SPECIAL_STAINS', 'MOLECULAR_PATH']
+    }
 }
 
-# --- Database Connection Helper ---
+# Panels that can be ordered by name in a bulk request: every group of
+# TEST_CATEGORIES, e.g. 'Liver Function'. A known test goes to its category's
+# department unless the request names one.
+LAB_PANELS = {panel: tests for groups in TEST_CATEGORIES.values() for panel, tests in groups.items()}
+TEST_DEPARTMENTS = {test: category.title()
+                    for category, groups in TEST_CATEGORIES.items()
+                    for tests in groups.values() for test in tests}
+
+MAX_BULK_ORDERS = 2000
+REPORT_TYPE_MAX_LENGTH = 100  # LabReport.report_type is VARCHAR(100)
+
+# --- Database Connection Helpers ---
 def get_db_connection():
-    """Establishes a new database connection."""
-    return psycopg2.connect(**DB_CONFIG)
+    """Borrows a connection from the shared pool."""
+    return db_pool.getconn()
+
+def release_db_connection(db_conn):
+    """Returns a connection obtained from get_db_connection() to the pool."""
+    db_pool.putconn(db_conn)
+
+def insert_lab_orders(cursor, doctor_id, orders):
+    """
+    Creates a Pending LabReport for every (patient_id, report_type, department) in
+    `orders` with a single multi-row INSERT. Returns the new rows as
+    (id, patient_id, report_type) tuples. The caller commits.
+    """
+    if not orders:
+        return []
+    return psycopg2.extras.execute_values(cursor, """
+        INSERT INTO LabReport (patient_id, requested_by_doctor_id, report_type,
+                               department, report_date, status)
+        VALUES %s
+        RETURNING id, patient_id, report_type
+    """, [(patient_id, doctor_id, report_type, department, date.today(), 'Pending')
+          for patient_id, report_type, department in orders],
+        page_size=len(orders), fetch=True)
 
 # --- Main Route for Lab Test Requests ---
 @lab_bp.route('/request_test', methods=['POST'])
@@ -37,12 +89,7 @@ def request_lab_test():
     try:
         db_conn = get_db_connection()
         with db_conn.cursor() as cursor:
-            sql = """
-                INSERT INTO LabReport (patient_id, requested_by_doctor_id, report_type,
-                                       department, report_date, status)
-                VALUES (%s, %s, %s, %s, %s, 'Pending')
-            """
-            cursor.execute(sql, (patient_id, session['user_id'], report_type, department, date.today()))
+            insert_lab_orders(cursor, session['user_id'], [(patient_id, report_type, department)])
             db_conn.commit()
         flash(f"Lab test '{report_type}' requested successfully.", 'success')
     except Exception as e:
@@ -50,6 +97,127 @@ def request_lab_test():
         flash(f"Database error while requesting lab test: {e}", "danger")
     finally:
         if db_conn:
-            db_conn.close()
+            release_db_connection(db_conn)
+
+    return redirect(url_for('patient_detail', patient_id=patient_id))
+
+# --- Bulk Lab Orders (e.g. the same panel for every patient on a ward round) ---
+def _expand_orders(payload):
+    """
+    Turns a bulk request into a list of (patient reference, test, department or None):
+    every patient in 'patients' x every test in 'tests' and in the named 'panels',
+    followed by the explicit 'items'. Raises ValueError for a malformed request.
+    """
+    patients = payload.get('patients') or []
+    tests = list(payload.get('tests') or [])
+    items = payload.get('items') or []
+    department = payload.get('department')
+    if not all(isinstance(value, list) for value in (patients, tests, items, payload.get('panels') or [])):
+        raise ValueError("'patients', 'tests', 'panels' and 'items' must be lists.")
+    for panel in payload.get('panels') or []:
+        if not isinstance(panel, str) or panel not in LAB_PANELS:
+            raise ValueError(f"Unknown panel '{panel}'. Known panels: {', '.join(sorted(LAB_PANELS))}.")
+        tests.extend(LAB_PANELS[panel])
+    if patients and not tests:
+        raise ValueError("Give 'tests' or 'panels' to order for the listed patients.")
+
+    orders = [(patient, test, department) for patient in patients for test in tests]
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Every entry of 'items' must be an object with 'patient' and 'test'.")
+        orders.append((item.get('patient'), item.get('test'), item.get('department') or department))
+    if not orders:
+        raise ValueError("Nothing to order: give 'patients' with 'tests' or 'panels', or 'items'.")
+    if len(orders) > MAX_BULK_ORDERS:
+        raise ValueError(f"At most {MAX_BULK_ORDERS} orders per request ({len(orders)} given).")
+    return orders
+
+def _resolve_patients(cursor, references):
+    """Maps patient ids and patient codes (UHIDs) to (id, patient_code)."""
+    ids = [ref for ref in references if isinstance(ref, int) and not isinstance(ref, bool)]
+    codes = [ref.strip() for ref in references if isinstance(ref, str)]
+    ids += [int(code) for code in codes if code.isdigit()]  # an id sent as text
+    cursor.execute("""
+        SELECT id, patient_code FROM Patient
+        WHERE id = ANY(%s) OR patient_code = ANY(%s)
+    """, (ids, codes))
+    found = {}
+    for patient_id, patient_code in cursor.fetchall():
+        found[patient_id] = found[str(patient_id)] = (patient_id, patient_code)
+        if patient_code:
+            found[patient_code] = (patient_id, patient_code)
+    return found
+
+@lab_bp.route('/bulk_request', methods=['POST'])
+def bulk_request_lab_tests():
+    """
+    Orders many lab tests in one transaction. JSON body:
+        {"patients": [12, "DERM-00013"], "panels": ["Liver Function"], "tests": ["CBC"],
+         "items": [{"patient": 14, "test": "TSH"}], "department": "Pathology"}
+    Returns one result per order, in request order, with status 'created'
+    (and its lab_report_id), 'skipped' (repeated in the request, or the same test
+    is already pending for the patient today) or 'error'.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    try:
+        orders = _expand_orders(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    db_conn = get_db_connection()
+    try:
+        with db_conn.cursor() as cursor:
+            patients = _resolve_patients(cursor, [patient for patient, _, _ in orders if patient is not None])
+            cursor.execute("""
+                SELECT patient_id, report_type FROM LabReport
+                WHERE status = 'Pending' AND report_date = %s AND patient_id = ANY(%s)
+            """, (date.today(), list({patient_id for patient_id, _ in patients.values()})))
+            pending = set(cursor.fetchall())
+
+            results, to_insert, seen = [], [], set()
+            for patient_ref, test, department in orders:
+                result = {'patient': patient_ref, 'test': test}
+                results.append(result)
+                if isinstance(patient_ref, str):
+                    patient_ref = patient_ref.strip()
+                patient = patients.get(patient_ref) if isinstance(patient_ref, (int, str)) else None
+                test = test.strip() if isinstance(test, str) else ''
+                if patient is None:
+                    result.update(status='error', error='Unknown patient')
+                    continue
+                if not test or len(test) > REPORT_TYPE_MAX_LENGTH:
+                    result.update(status='error', error=f'Test name must be 1-{REPORT_TYPE_MAX_LENGTH} characters')
+                    continue
+                if department is not None and not isinstance(department, str):
+                    result.update(status='error', error='Department must be text')
+                    continue
+                key = (patient[0], test)
+                result.update(patient_id=patient[0], patient_code=patient[1], test=test)
+                if key in seen:
+                    result.update(status='skipped', reason='Repeated in this request')
+                elif key in pending:
+                    result.update(status='skipped', reason='Already pending today')
+                else:
+                    seen.add(key)
+                    result['department'] = department or TEST_DEPARTMENTS.get(test, 'Pathology')
+                    to_insert.append(result)
+
+            created = insert_lab_orders(cursor, session['user_id'],
+                                        [(r['patient_id'], r['test'], r['department']) for r in to_insert])
+        db_conn.commit()
+    except psycopg2.Error as e:
+        db_conn.rollback()
+        logging.error(f"Bulk lab request failed: {e}")
+        return jsonify({'error': 'Database error; no lab tests were requested.'}), 500
+    finally:
+        release_db_connection(db_conn)
 
-    return redirect(url_for('patient_detail', patient_id=patient_id))
\ No newline at end of file
+    report_ids = {(patient_id, report_type): report_id for report_id, patient_id, report_type in created}
+    for result in to_insert:
+        result.update(status='created', lab_report_id=report_ids[(result['patient_id'], result['test'])])
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('created', 'skipped', 'error')}
+    return jsonify({**counts, 'results': results})
@@ -0,0 +1,26 @@
+-- 0001_foreign_key_indexes.sql
+-- Indexes on the foreign keys used by patient_detail, bed management and the user activity views.
+-- Composite keys include the column each page sorts by so the rows come back already ordered.
+
+CREATE INDEX IF NOT EXISTS idx_followupvisit_patient_date ON FollowUpVisit (patient_id, visit_date DESC);
+CREATE INDEX IF NOT EXISTS idx_followupvisit_doctor ON FollowUpVisit (doctor_id);
+
+CREATE INDEX IF NOT EXISTS idx_prescription_patient_date ON Prescription (patient_id, prescription_date DESC);
+CREATE INDEX IF NOT EXISTS idx_prescription_doctor ON Prescription (doctor_id);
+CREATE INDEX IF NOT EXISTS idx_prescriptionitem_prescription ON PrescriptionItem (prescription_id);
+
+CREATE INDEX IF NOT EXISTS idx_patientimage_patient_date ON PatientImage (patient_id, upload_date DESC);
+
+CREATE INDEX IF NOT EXISTS idx_labreport_patient_date ON LabReport (patient_id, report_date DESC);
+CREATE INDEX IF NOT EXISTS idx_labreport_image ON LabReport (image_id);
+
+CREATE INDEX IF NOT EXISTS idx_bedassignment_patient ON BedAssignment (patient_id);
+CREATE INDEX IF NOT EXISTS idx_bedassignment_bed ON BedAssignment (bed_id);
+CREATE INDEX IF NOT EXISTS idx_dailyprogressnote_assignment_date ON DailyProgressNote (assignment_id, note_date DESC);
+
+CREATE INDEX IF NOT EXISTS idx_vitals_patient ON Vitals (patient_id);
+CREATE INDEX IF NOT EXISTS idx_additionalvitals_patient ON AdditionalVitals (patient_id);
+CREATE INDEX IF NOT EXISTS idx_consultationrequest_patient ON ConsultationRequest (patient_id);
+
+CREATE INDEX IF NOT EXISTS idx_patient_registered_by ON Patient (registered_by_doctor_id);
+CREATE INDEX IF NOT EXISTS idx_useractivitylog_user_login ON UserActivityLog (user_id, login_time DESC);
@@ -0,0 +1,10 @@
+-- 0002_trigram_search_indexes.sql
+-- GIN trigram indexes so the `ILIKE '%term%'` filters in dashboard, list_patients
+-- and search_patients can use an index instead of scanning every patient.
+-- Requires the pg_trgm contrib extension (shipped with standard PostgreSQL packages).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_patient_name_trgm ON Patient USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patient_code_trgm ON Patient USING gin (patient_code gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patient_mobile_trgm ON Patient USING gin (mobile_number gin_trgm_ops);
@@ -0,0 +1,13 @@
+-- 0003_partial_indexes.sql
+-- Small partial indexes covering only the "live" rows the dashboards ask about.
+
+-- Pending lab work (dashboard counter, lab worklist).
+CREATE INDEX IF NOT EXISTS idx_labreport_pending ON LabReport (report_date) WHERE status = 'Pending';
+
+-- Current admissions (bed management, patient_detail, unassigned-patient picker).
+CREATE INDEX IF NOT EXISTS idx_bedassignment_open_bed ON BedAssignment (bed_id) WHERE discharge_date IS NULL;
+CREATE INDEX IF NOT EXISTS idx_bedassignment_open_patient ON BedAssignment (patient_id) WHERE discharge_date IS NULL;
+
+-- Scheduled follow-ups (missed follow-up report).
+CREATE INDEX IF NOT EXISTS idx_prescription_next_follow_up ON Prescription (patient_id, next_follow_up_date)
+    WHERE next_follow_up_date IS NOT NULL;
@@ -0,0 +1,14 @@
+-- 0004_registration_date_brin.sql
+-- Patients are inserted in registration order, so a BRIN index answers the
+-- weekly-registration and date-range queries at a tiny fraction of a btree's size.
+
+CREATE INDEX IF NOT EXISTS idx_patient_registration_brin ON Patient USING brin (date_of_registration);
+
+ANALYZE Patient;
+ANALYZE FollowUpVisit;
+ANALYZE Prescription;
+ANALYZE PrescriptionItem;
+ANALYZE PatientImage;
+ANALYZE LabReport;
+ANALYZE BedAssignment;
+ANALYZE DailyProgressNote;
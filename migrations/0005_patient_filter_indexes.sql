@@ -0,0 +1,6 @@
+-- 0005_patient_filter_indexes.sql
+-- Indexes for the diagnosis and city filters of the patient list search.
+-- Registration date range filters use the BRIN index from 0004; keyset pages use the primary key.
+
+CREATE INDEX IF NOT EXISTS idx_patient_diagnosis_trgm ON Patient USING gin (diagnosis gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patient_city_lower ON Patient (LOWER(city));
@@ -0,0 +1,44 @@
+-- 0006_dashboard_stats_snapshot.sql
+-- Single-row rollup of the dashboard counters and breakdowns. The dashboard reads
+-- this in one query; dashboard_stats.py refreshes it (CONCURRENTLY, so reads never
+-- block) whenever it is older than the configured interval.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS dashboard_stats_snapshot AS
+WITH latest_follow_up AS (
+    SELECT patient_id, MAX(next_follow_up_date) AS last_follow_up_due
+    FROM Prescription
+    WHERE next_follow_up_date IS NOT NULL
+    GROUP BY patient_id
+),
+missed AS (
+    SELECT p.id, p.patient_code, p.name, p.mobile_number, lf.last_follow_up_due,
+           (CURRENT_DATE - lf.last_follow_up_due) AS days_overdue
+    FROM Patient p
+    JOIN latest_follow_up lf ON p.id = lf.patient_id
+    WHERE lf.last_follow_up_due < CURRENT_DATE
+      AND NOT EXISTS (
+          SELECT 1 FROM FollowUpVisit fv
+          WHERE fv.patient_id = p.id AND fv.visit_date > lf.last_follow_up_due
+      )
+)
+SELECT
+    1 AS id,
+    NOW() AS refreshed_at,
+    (SELECT COUNT(*) FROM Patient) AS total_patients,
+    (SELECT COUNT(*) FROM Bed WHERE status = 'Occupied') AS occupied_beds,
+    (SELECT COUNT(*) FROM Bed) AS total_beds,
+    (SELECT COUNT(*) FROM LabReport WHERE status = 'Pending') AS pending_reports,
+    (SELECT COUNT(*) FROM missed) AS missed_follow_ups,
+    (SELECT COUNT(*) FROM latest_follow_up) AS total_follow_ups_scheduled,
+    (SELECT COALESCE(jsonb_object_agg(diagnosis, n), '{}'::jsonb)
+       FROM (SELECT TRIM(diagnosis) AS diagnosis, COUNT(*) AS n
+             FROM Patient WHERE diagnosis IS NOT NULL AND TRIM(diagnosis) != ''
+             GROUP BY TRIM(diagnosis)) d) AS disease_counts,
+    (SELECT COALESCE(jsonb_object_agg(gender, n), '{}'::jsonb)
+       FROM (SELECT gender, COUNT(*) AS n FROM Patient GROUP BY gender) g) AS gender_counts,
+    (SELECT COALESCE(jsonb_agg(m ORDER BY m.days_overdue DESC), '[]'::jsonb)
+       FROM (SELECT * FROM missed ORDER BY days_overdue DESC LIMIT 50) m) AS missed_follow_up_list
+WITH DATA;
+
+-- Required for REFRESH MATERIALIZED VIEW CONCURRENTLY.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dashboard_stats_snapshot_id ON dashboard_stats_snapshot (id);
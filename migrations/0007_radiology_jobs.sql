@@ -0,0 +1,35 @@
+-- 0007_radiology_jobs.sql
+-- Persisted radiology orders. request_investigation only inserts a 'queued' row;
+-- radiology_jobs.py workers submit the order, poll the radiology server one step at
+-- a time (rescheduling via next_attempt_at instead of sleeping) and record the
+-- downloaded scan in PatientImage. Because the state lives here, jobs resume after
+-- an app restart; rows locked by a worker that died are reclaimed once stale.
+
+CREATE TABLE IF NOT EXISTS RadiologyJob (
+    id SERIAL PRIMARY KEY,
+    patient_id INT NOT NULL REFERENCES Patient(id) ON DELETE CASCADE,
+    requested_by INT REFERENCES Users(id) ON DELETE SET NULL,
+    uhid VARCHAR(50) NOT NULL,
+    scan_type VARCHAR(100) NOT NULL,
+    body_part VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'polling', 'completed', 'failed')),
+    remote_request_id VARCHAR(100),
+    image_filename VARCHAR(255),
+    error TEXT,
+    attempts INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    poll_deadline_at TIMESTAMP,
+    locked_by VARCHAR(100),
+    locked_at TIMESTAMP
+);
+
+-- Workers claim due jobs from this small partial index only.
+CREATE INDEX IF NOT EXISTS idx_radiologyjob_due
+    ON RadiologyJob (next_attempt_at)
+    WHERE status IN ('queued', 'polling');
+
+CREATE INDEX IF NOT EXISTS idx_radiologyjob_patient
+    ON RadiologyJob (patient_id, created_at DESC);
@@ -0,0 +1,18 @@
+-- 0008_content_addressed_uploads.sql
+-- Uploads are stored once per content under uploads/objects/<aa>/<bb>/<sha256>.<ext>
+-- (see file_storage.py). image_filename / file_path hold that relative path; these
+-- columns record the digest, the size and the name the file was uploaded with.
+-- Files uploaded before this migration are moved with `python file_storage.py migrate`.
+
+ALTER TABLE PatientImage
+    ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64),
+    ADD COLUMN IF NOT EXISTS size_bytes BIGINT,
+    ADD COLUMN IF NOT EXISTS original_filename VARCHAR(255);
+
+ALTER TABLE LabReport
+    ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64),
+    ADD COLUMN IF NOT EXISTS size_bytes BIGINT,
+    ADD COLUMN IF NOT EXISTS original_filename VARCHAR(255);
+
+CREATE INDEX IF NOT EXISTS idx_patientimage_sha256 ON PatientImage (content_sha256);
+CREATE INDEX IF NOT EXISTS idx_labreport_sha256 ON LabReport (content_sha256);
@@ -0,0 +1,7 @@
+-- 0009_upload_lookup_indexes.sql
+-- /uploads checks that a requested file belongs to a PatientImage or LabReport row.
+-- Content-addressed files are found through the content_sha256 indexes (0008);
+-- files stored before 0008 are looked up by their stored name.
+
+CREATE INDEX IF NOT EXISTS idx_patientimage_filename ON PatientImage (image_filename);
+CREATE INDEX IF NOT EXISTS idx_labreport_file_path ON LabReport (file_path) WHERE file_path IS NOT NULL;
@@ -0,0 +1,55 @@
+-- 0010_follow_up_state.sql
+-- Per-patient follow-up state, kept current by follow_up_state.py whenever a
+-- prescription or a visit is recorded. The missed-follow-up page and the dashboard
+-- read it instead of aggregating Prescription and FollowUpVisit on every load.
+-- Days overdue depend on the current date and are computed when reading.
+
+CREATE TABLE IF NOT EXISTS FollowUpState (
+    patient_id INT PRIMARY KEY REFERENCES Patient(id) ON DELETE CASCADE,
+    next_due_date DATE,      -- latest Prescription.next_follow_up_date
+    last_visit_date DATE,    -- latest FollowUpVisit.visit_date
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Missed follow-ups: no visit since the due date. Ordered by due date, i.e. most
+-- overdue first, with patient_id as the keyset tie-breaker.
+CREATE INDEX IF NOT EXISTS idx_followupstate_missed ON FollowUpState (next_due_date, patient_id)
+    WHERE last_visit_date IS NULL OR last_visit_date <= next_due_date;
+
+INSERT INTO FollowUpState (patient_id, next_due_date, last_visit_date)
+SELECT patient_id, due.next_due_date, visits.last_visit_date
+FROM (
+    SELECT patient_id, MAX(next_follow_up_date) AS next_due_date
+    FROM Prescription
+    WHERE next_follow_up_date IS NOT NULL
+    GROUP BY patient_id
+) due
+FULL JOIN (
+    SELECT patient_id, MAX(visit_date) AS last_visit_date
+    FROM FollowUpVisit
+    GROUP BY patient_id
+) visits USING (patient_id)
+ON CONFLICT (patient_id) DO NOTHING;
+
+-- The dashboard snapshot (0006) no longer needs to compute the missed follow-ups:
+-- the dashboard counts them live on idx_followupstate_missed.
+DROP MATERIALIZED VIEW IF EXISTS dashboard_stats_snapshot;
+
+CREATE MATERIALIZED VIEW dashboard_stats_snapshot AS
+SELECT
+    1 AS id,
+    NOW() AS refreshed_at,
+    (SELECT COUNT(*) FROM Patient) AS total_patients,
+    (SELECT COUNT(*) FROM Bed WHERE status = 'Occupied') AS occupied_beds,
+    (SELECT COUNT(*) FROM Bed) AS total_beds,
+    (SELECT COUNT(*) FROM LabReport WHERE status = 'Pending') AS pending_reports,
+    (SELECT COUNT(*) FROM FollowUpState WHERE next_due_date IS NOT NULL) AS total_follow_ups_scheduled,
+    (SELECT COALESCE(jsonb_object_agg(diagnosis, n), '{}'::jsonb)
+       FROM (SELECT TRIM(diagnosis) AS diagnosis, COUNT(*) AS n
+             FROM Patient WHERE diagnosis IS NOT NULL AND TRIM(diagnosis) != ''
+             GROUP BY TRIM(diagnosis)) d) AS disease_counts,
+    (SELECT COALESCE(jsonb_object_agg(gender, n), '{}'::jsonb)
+       FROM (SELECT gender, COUNT(*) AS n FROM Patient GROUP BY gender) g) AS gender_counts
+WITH DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dashboard_stats_snapshot_id ON dashboard_stats_snapshot (id);
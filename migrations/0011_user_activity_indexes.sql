@@ -0,0 +1,18 @@
+-- 0011_user_activity_indexes.sql
+-- Per-user, newest-first indexes for the activity timeline (user_activity.py). Each
+-- branch of its UNION ALL reads one of these in order and stops after one page.
+-- They start with the same column as the single-column doctor indexes of 0001,
+-- which they replace.
+
+CREATE INDEX IF NOT EXISTS idx_patient_registered_by_date
+    ON Patient (registered_by_doctor_id, date_of_registration DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_followupvisit_doctor_date
+    ON FollowUpVisit (doctor_id, visit_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_prescription_doctor_date
+    ON Prescription (doctor_id, prescription_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_useractivitylog_user_logout
+    ON UserActivityLog (user_id, logout_time DESC, id DESC) WHERE logout_time IS NOT NULL;
+
+DROP INDEX IF EXISTS idx_patient_registered_by;
+DROP INDEX IF EXISTS idx_followupvisit_doctor;
+DROP INDEX IF EXISTS idx_prescription_doctor;
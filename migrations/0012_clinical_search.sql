@@ -0,0 +1,130 @@
+-- 0012_clinical_search.sql
+-- Full-text search over clinical notes (clinical_search.py, /api/clinical_search).
+-- Every patient's initial complaints / findings / diagnosis, follow-up visit,
+-- daily progress note and prescription (with its medications) becomes one row of
+-- ClinicalSearchDocument with a weighted tsvector (diagnoses and medication names
+-- weigh more) and a single GIN index over all of them. Statement-level triggers
+-- keep the documents current, so a bulk insert refreshes its documents in one pass.
+
+CREATE TABLE IF NOT EXISTS ClinicalSearchDocument (
+    source_table VARCHAR(30) NOT NULL,   -- 'Patient', 'FollowUpVisit', 'DailyProgressNote', 'Prescription'
+    source_id INT NOT NULL,
+    patient_id INT NOT NULL REFERENCES Patient(id) ON DELETE CASCADE,
+    document_date DATE,
+    body TEXT NOT NULL,                  -- the searched text, for ts_headline snippets
+    search_vector TSVECTOR NOT NULL,
+    PRIMARY KEY (source_table, source_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_clinicalsearch_vector ON ClinicalSearchDocument USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_clinicalsearch_patient ON ClinicalSearchDocument (patient_id);
+
+-- --- The document of each source row ---
+CREATE OR REPLACE VIEW clinical_search_patient_docs AS
+SELECT 'Patient'::VARCHAR(30) AS source_table, p.id AS source_id, p.id AS patient_id,
+       p.date_of_registration AS document_date,
+       concat_ws(E'\n', p.diagnosis, p.complaints, p.examination_findings,
+                 p.past_medical_history, p.initial_treatment_plan) AS body,
+       setweight(to_tsvector('english', coalesce(p.diagnosis, '')), 'A') ||
+       setweight(to_tsvector('english', concat_ws(' ', p.complaints, p.examination_findings,
+                                                  p.past_medical_history, p.initial_treatment_plan)), 'B') AS search_vector
+FROM Patient p
+WHERE num_nonnulls(p.diagnosis, p.complaints, p.examination_findings,
+                   p.past_medical_history, p.initial_treatment_plan) > 0;
+
+CREATE OR REPLACE VIEW clinical_search_followupvisit_docs AS
+SELECT 'FollowUpVisit'::VARCHAR(30) AS source_table, fv.id AS source_id, fv.patient_id,
+       fv.visit_date AS document_date,
+       concat_ws(E'\n', fv.diagnosis, fv.disease_status, fv.updated_complaints, fv.updated_examination,
+                 fv.medication_change, fv.updated_treatment_plan) AS body,
+       setweight(to_tsvector('english', coalesce(fv.diagnosis, '')), 'A') ||
+       setweight(to_tsvector('english', concat_ws(' ', fv.disease_status, fv.updated_complaints, fv.updated_examination,
+                                                  fv.medication_change, fv.updated_treatment_plan)), 'B') AS search_vector
+FROM FollowUpVisit fv
+WHERE num_nonnulls(fv.diagnosis, fv.disease_status, fv.updated_complaints, fv.updated_examination,
+                   fv.medication_change, fv.updated_treatment_plan) > 0;
+
+CREATE OR REPLACE VIEW clinical_search_dailyprogressnote_docs AS
+SELECT 'DailyProgressNote'::VARCHAR(30) AS source_table, n.id AS source_id, ba.patient_id,
+       n.note_date::date AS document_date,
+       n.notes AS body,
+       setweight(to_tsvector('english', n.notes), 'B') AS search_vector
+FROM DailyProgressNote n
+JOIN BedAssignment ba ON ba.id = n.assignment_id;
+
+CREATE OR REPLACE VIEW clinical_search_prescription_docs AS
+SELECT 'Prescription'::VARCHAR(30) AS source_table, pr.id AS source_id, pr.patient_id,
+       pr.prescription_date::date AS document_date,
+       concat_ws(E'\n', pr.condition_notes, 'Medications: ' || meds.medications) AS body,
+       setweight(to_tsvector('english', coalesce(meds.medications, '')), 'A') ||
+       setweight(to_tsvector('english', coalesce(pr.condition_notes, '')), 'B') AS search_vector
+FROM Prescription pr
+LEFT JOIN LATERAL (
+    SELECT string_agg(concat_ws(' ', pi.medication_name, pi.dosage), ', ' ORDER BY pi.id) AS medications
+    FROM PrescriptionItem pi
+    WHERE pi.prescription_id = pr.id
+) meds ON TRUE
+WHERE num_nonnulls(pr.condition_notes, meds.medications) > 0;
+
+CREATE OR REPLACE VIEW clinical_search_docs AS
+SELECT * FROM clinical_search_patient_docs
+UNION ALL SELECT * FROM clinical_search_followupvisit_docs
+UNION ALL SELECT * FROM clinical_search_dailyprogressnote_docs
+UNION ALL SELECT * FROM clinical_search_prescription_docs;
+
+-- --- Triggers ---
+-- TG_ARGV[0]: the document source; TG_ARGV[1]: the column of the changed rows that
+-- holds the source id (PrescriptionItem changes refresh their prescription).
+CREATE OR REPLACE FUNCTION clinical_search_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    source TEXT := TG_ARGV[0];
+    id_column TEXT := TG_ARGV[1];
+    ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        EXECUTE format('SELECT array_agg(DISTINCT %I) FROM new_rows', id_column) INTO ids;
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT array_agg(DISTINCT %I) FROM old_rows', id_column) INTO ids;
+    ELSE
+        EXECUTE format('SELECT array_agg(DISTINCT id) FROM (SELECT %1$I AS id FROM old_rows UNION SELECT %1$I FROM new_rows) changed',
+                       id_column) INTO ids;
+    END IF;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM ClinicalSearchDocument WHERE source_table = source AND source_id = ANY(ids);
+    EXECUTE format('INSERT INTO ClinicalSearchDocument (source_table, source_id, patient_id, document_date, body, search_vector)
+                    SELECT source_table, source_id, patient_id, document_date, body, search_vector
+                    FROM %I WHERE source_id = ANY($1)', 'clinical_search_' || lower(source) || '_docs')
+        USING ids;
+    RETURN NULL;
+END $$;
+
+DO $$
+DECLARE
+    spec TEXT[];
+BEGIN
+    FOREACH spec SLICE 1 IN ARRAY ARRAY[
+        ['patient', 'Patient', 'id'],
+        ['followupvisit', 'FollowUpVisit', 'id'],
+        ['dailyprogressnote', 'DailyProgressNote', 'id'],
+        ['prescription', 'Prescription', 'id'],
+        ['prescriptionitem', 'Prescription', 'prescription_id']
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS clinical_search_insert ON %I', spec[1]);
+        EXECUTE format('DROP TRIGGER IF EXISTS clinical_search_update ON %I', spec[1]);
+        EXECUTE format('DROP TRIGGER IF EXISTS clinical_search_delete ON %I', spec[1]);
+        EXECUTE format('CREATE TRIGGER clinical_search_insert AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION clinical_search_sync(%L, %L)', spec[1], spec[2], spec[3]);
+        EXECUTE format('CREATE TRIGGER clinical_search_update AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION clinical_search_sync(%L, %L)', spec[1], spec[2], spec[3]);
+        EXECUTE format('CREATE TRIGGER clinical_search_delete AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION clinical_search_sync(%L, %L)', spec[1], spec[2], spec[3]);
+    END LOOP;
+END $$;
+
+-- --- Existing notes ---
+INSERT INTO ClinicalSearchDocument (source_table, source_id, patient_id, document_date, body, search_vector)
+SELECT source_table, source_id, patient_id, document_date, body, search_vector FROM clinical_search_docs
+ON CONFLICT (source_table, source_id) DO NOTHING;
+ANALYZE ClinicalSearchDocument;
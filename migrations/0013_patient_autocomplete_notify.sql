@@ -0,0 +1,43 @@
+-- 0013_patient_autocomplete_notify.sql
+-- Change notifications for the in-process patient autocomplete index
+-- (patient_autocomplete.py). Every statement that inserts or deletes patients, or
+-- changes a name, patient code or mobile number, sends the ids of the affected
+-- patients on the 'patient_autocomplete' channel after commit, so each server
+-- process refreshes just those entries. Large statements (bulk imports) send
+-- 'reload' instead, as NOTIFY payloads are limited to 8000 bytes.
+
+CREATE OR REPLACE FUNCTION patient_autocomplete_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(id) INTO ids FROM (SELECT id FROM new_rows LIMIT 501) changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id) INTO ids FROM (SELECT id FROM old_rows LIMIT 501) changed;
+    ELSE
+        SELECT array_agg(id) INTO ids FROM (
+            SELECT n.id FROM new_rows n JOIN old_rows o USING (id)
+            WHERE (n.name, n.patient_code, n.mobile_number)
+                  IS DISTINCT FROM (o.name, o.patient_code, o.mobile_number)
+            LIMIT 501
+        ) changed;
+    END IF;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    ELSIF cardinality(ids) > 500 THEN
+        PERFORM pg_notify('patient_autocomplete', 'reload');
+    ELSE
+        PERFORM pg_notify('patient_autocomplete', array_to_string(ids, ','));
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS patient_autocomplete_insert ON patient;
+DROP TRIGGER IF EXISTS patient_autocomplete_update ON patient;
+DROP TRIGGER IF EXISTS patient_autocomplete_delete ON patient;
+CREATE TRIGGER patient_autocomplete_insert AFTER INSERT ON patient REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION patient_autocomplete_notify();
+CREATE TRIGGER patient_autocomplete_update AFTER UPDATE ON patient REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION patient_autocomplete_notify();
+CREATE TRIGGER patient_autocomplete_delete AFTER DELETE ON patient REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION patient_autocomplete_notify();
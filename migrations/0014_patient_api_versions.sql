@@ -0,0 +1,75 @@
+-- 0014_patient_api_versions.sql
+-- Change stamps for the external patient API (/api/patient/<uhid>, /api/patients;
+-- see patient_api.py). A patient's payload is built from the Patient row, its
+-- follow-up visits, prescriptions (with their items) and lab reports; statement-level
+-- triggers on those tables give the affected patients a new version number from
+-- one sequence. The API derives its ETags from the versions and reuses a cached
+-- payload while its version is unchanged, so a poll costs one indexed lookup.
+
+CREATE SEQUENCE IF NOT EXISTS patient_api_version_seq;
+
+CREATE TABLE IF NOT EXISTS PatientApiVersion (
+    patient_id INT PRIMARY KEY REFERENCES Patient(id) ON DELETE CASCADE,
+    version BIGINT NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- TG_ARGV[0]: the column of the changed rows holding the patient id, or with
+-- TG_ARGV[1] = 'prescription', the prescription id (PrescriptionItem).
+CREATE OR REPLACE FUNCTION patient_api_touch() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    id_column TEXT := TG_ARGV[0];
+    changed TEXT;
+    ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changed := format('SELECT %I AS id FROM new_rows', id_column);
+    ELSIF TG_OP = 'DELETE' THEN
+        changed := format('SELECT %I AS id FROM old_rows', id_column);
+    ELSE
+        changed := format('SELECT %1$I AS id FROM old_rows UNION SELECT %1$I FROM new_rows', id_column);
+    END IF;
+    IF TG_NARGS > 1 AND TG_ARGV[1] = 'prescription' THEN
+        changed := format('SELECT pr.patient_id AS id FROM Prescription pr WHERE pr.id IN (%s)', changed);
+    END IF;
+    EXECUTE format('SELECT array_agg(DISTINCT id) FROM (%s) changed', changed) INTO ids;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+    -- Rows deleted along with their patient (ON DELETE CASCADE) have no patient left to stamp.
+    INSERT INTO PatientApiVersion (patient_id, version)
+    SELECT touched.id, nextval('patient_api_version_seq')
+    FROM unnest(ids) AS touched(id)
+    WHERE EXISTS (SELECT 1 FROM Patient p WHERE p.id = touched.id)
+    ON CONFLICT (patient_id) DO UPDATE SET version = EXCLUDED.version, changed_at = NOW();
+    RETURN NULL;
+END $$;
+
+DO $$
+DECLARE
+    spec TEXT[];
+BEGIN
+    FOREACH spec SLICE 1 IN ARRAY ARRAY[
+        ['patient', 'id', '', 'UPDATE'],
+        ['followupvisit', 'patient_id', '', 'INSERT,UPDATE,DELETE'],
+        ['prescription', 'patient_id', '', 'INSERT,UPDATE,DELETE'],
+        ['prescriptionitem', 'prescription_id', 'prescription', 'INSERT,UPDATE,DELETE'],
+        ['labreport', 'patient_id', '', 'INSERT,UPDATE,DELETE']
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS patient_api_insert ON %I', spec[1]);
+        EXECUTE format('DROP TRIGGER IF EXISTS patient_api_update ON %I', spec[1]);
+        EXECUTE format('DROP TRIGGER IF EXISTS patient_api_delete ON %I', spec[1]);
+        IF position('INSERT' IN spec[4]) > 0 THEN
+            EXECUTE format('CREATE TRIGGER patient_api_insert AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows
+                            FOR EACH STATEMENT EXECUTE FUNCTION patient_api_touch(%L, %L)', spec[1], spec[2], spec[3]);
+        END IF;
+        IF position('UPDATE' IN spec[4]) > 0 THEN
+            EXECUTE format('CREATE TRIGGER patient_api_update AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                            FOR EACH STATEMENT EXECUTE FUNCTION patient_api_touch(%L, %L)', spec[1], spec[2], spec[3]);
+        END IF;
+        IF position('DELETE' IN spec[4]) > 0 THEN
+            EXECUTE format('CREATE TRIGGER patient_api_delete AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows
+                            FOR EACH STATEMENT EXECUTE FUNCTION patient_api_touch(%L, %L)', spec[1], spec[2], spec[3]);
+        END IF;
+    END LOOP;
+END $$;
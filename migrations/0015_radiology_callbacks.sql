@@ -0,0 +1,14 @@
+-- 0015_radiology_callbacks.sql
+-- Completion callbacks from the radiology server (POST /api/radiology/callback, see
+-- radiology_api.py). A signed callback names the server's request_id; the job that
+-- submitted it is found by remote_request_id, gets the ready scan's id and is made
+-- due at once, so a worker downloads the scan without asking for the status first.
+-- polls counts the status checks of a job, which back off exponentially and are
+-- only a fallback when callbacks are in use.
+
+ALTER TABLE RadiologyJob ADD COLUMN IF NOT EXISTS remote_scan_id VARCHAR(100);
+ALTER TABLE RadiologyJob ADD COLUMN IF NOT EXISTS polls INT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_radiologyjob_remote_request
+    ON RadiologyJob (remote_request_id)
+    WHERE status = 'polling';
@@ -0,0 +1,27 @@
+-- 0016_radiology_scan_cache.sql
+-- Local cache of downloaded radiology scans (radiology_cache.py). One row per scan of
+-- the radiology server, keyed by its scan_id, pointing at the file in the content
+-- store with the ETag / Last-Modified the server sent for it. Ordering a scan that is
+-- already here sends a conditional request and reuses the file on 304 Not Modified
+-- instead of downloading the DICOM again. uhid, scan_type and body_part identify the
+-- study, for servers that answer an order with the scan itself.
+
+CREATE TABLE IF NOT EXISTS RadiologyScanCache (
+    scan_id VARCHAR(100) PRIMARY KEY,
+    uhid VARCHAR(50),
+    scan_type VARCHAR(100),
+    body_part VARCHAR(100),
+    image_filename VARCHAR(255) NOT NULL,
+    content_sha256 CHAR(64) NOT NULL,
+    size_bytes BIGINT,
+    original_filename VARCHAR(255),
+    etag VARCHAR(255),
+    last_modified VARCHAR(64),
+    fetched_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    validated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    hits INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_radiologyscancache_study
+    ON RadiologyScanCache (uhid, scan_type, body_part, validated_at DESC);
+
@@ -0,0 +1,8 @@
+-- 0017_clinical_search_recent.sql
+-- clinical_search.py ranks at most CANDIDATE_CAP matches of a query: the most recent
+-- ones. This index hands them over in that order (newest document first, ties by
+-- source), so for a common term the scan stops after the cap instead of sorting
+-- every match, and each page of a query ranks the same candidates.
+
+CREATE INDEX IF NOT EXISTS idx_clinicalsearch_recent
+    ON ClinicalSearchDocument (document_date DESC NULLS LAST, source_table, source_id);
@@ -0,0 +1,208 @@
+# patient_api.py
+# The external patient API polled by partner systems: /api/patient/<uhid> and the
+# batch form /api/patients?uhid=DERM-00001&uhid=DERM-00002.
+#
+# A payload is assembled as JSON by PostgreSQL, for any number of patients in one
+# query (patient record, follow-up visit count, lab reports and prescriptions).
+# Migration 0014 stamps a patient with a new version whenever its record, visits,
+# prescriptions or lab reports change. A request first reads just the versions:
+# the ETag is derived from them, so an unchanged poll with If-None-Match gets a
+# 304 after one indexed lookup, and payloads whose version is unchanged are
+# served from this process's cache instead of being rebuilt.
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import Response
+
+CACHE_SIZE = 5000      # payloads kept per process (least recently used are dropped)
+MAX_BATCH = 100        # patients per batch request
+PAYLOAD_FORMAT = 1     # part of every ETag; bump when the payload layout changes
+
+# Sample records for trying the API in a browser.
+DUMMY_API_DATA = {
+    "DERM001": {
+        "department": "Dermatology Department",
+        "medical_records": {
+            "diagnosis": "Chronic Plaque Psoriasis",
+            "record_date": "2025-08-29",
+            "record_id": "REC-73451",
+            "follow_up_visit_count": 0, # dummy value
+            "test_results": {
+                "bsa": 1.85,
+                "affected_bsa_percent": 12.5,
+                "skin_examination": "Erythematous plaques with well-defined borders and silvery scales on elbows, knees, and scalp."
+            },
+            "lab_reports": [
+                {
+                    "report_name": "Skin Biopsy",
+                    "result": "Consistent with psoriasis, showing parakeratosis and Munro's microabscesses."
+                }
+            ],
+            "prescription": [
+                {
+                    "name": "Clobetasol Propionate Cream", "dosage": "0.05%",
+                    "frequency": "Twice daily", "duration": "4 weeks"
+                }
+            ],
+            "treatment_summary": "Combination topical therapy with high-potency corticosteroids and vitamin D analogues. Phototherapy recommended if no improvement."
+        }
+    },
+    "DERM002": {
+        "department": "Dermatology Department",
+        "medical_records": {
+            "diagnosis": "Nodulocystic Acne",
+            "record_date": "2025-07-15",
+            "record_id": "REC-73109",
+            "follow_up_visit_count": 2, # dummy value
+            "test_results": {
+                "bsa": 1.60,
+                "affected_bsa_percent": 4.0,
+                "skin_examination": "Multiple inflammatory nodules and cysts on the face, neck, and upper back. Significant scarring present."
+            },
+            "lab_reports": [
+                { "report_name": "Hormone Panel", "result": "Within normal limits." }
+            ],
+            "prescription": [
+                { "name": "Isotretinoin", "dosage": "40mg", "frequency": "Once daily with food", "duration": "6 months" }
+            ],
+            "treatment_summary": "Systemic therapy with oral isotretinoin initiated due to severity and scarring. Patient counseled on side effects."
+        }
+    }
+}
+_DUMMY_PAYLOADS = {uhid: json.dumps(data) for uhid, data in DUMMY_API_DATA.items()}
+
+VERSIONS_SQL = """
+    SELECT p.patient_code, p.id, COALESCE(v.version, 0)
+    FROM Patient p
+    LEFT JOIN PatientApiVersion v ON v.patient_id = p.id
+    WHERE p.patient_code = ANY(%s)
+"""
+
+PAYLOADS_SQL = """
+    SELECT p.id, COALESCE(v.version, 0), json_build_object(
+        'department', 'Dermatology Department',
+        'medical_records', json_build_object(
+            'diagnosis', p.diagnosis,
+            'record_date', to_char(p.date_of_registration, 'YYYY-MM-DD'),
+            'record_id', 'REC-' || p.id,
+            'follow_up_visit_count', (SELECT COUNT(*) FROM FollowUpVisit fv WHERE fv.patient_id = p.id),
+            'test_results', json_build_object(
+                'bsa', p.initial_bsa,
+                'affected_bsa_percent', p.affected_bsa_percentage,
+                'skin_examination', p.complaints),
+            'lab_reports', COALESCE((
+                SELECT json_agg(json_build_object(
+                           'report_name', lr.report_type,
+                           'result', CASE WHEN lr.file_path IS NOT NULL
+                                          THEN 'Report available at ' || lr.file_path ELSE 'Pending' END)
+                       ORDER BY lr.id)
+                FROM LabReport lr WHERE lr.patient_id = p.id), '[]'::json),
+            'prescription', COALESCE((
+                SELECT json_agg(json_build_object(
+                           'name', pi.medication_name, 'dosage', pi.dosage,
+                           'frequency', pi.frequency, 'duration', pi.duration)
+                       ORDER BY pr.prescription_date DESC, pr.id DESC, pi.id)
+                FROM Prescription pr JOIN PrescriptionItem pi ON pi.prescription_id = pr.id
+                WHERE pr.patient_id = p.id), '[]'::json),
+            'treatment_summary', p.initial_treatment_plan
+        )
+    )::text
+    FROM Patient p
+    LEFT JOIN PatientApiVersion v ON v.patient_id = p.id
+    WHERE p.id = ANY(%s)
+"""
+
+_cache = OrderedDict()  # patient id -> (version, payload JSON text)
+_cache_lock = threading.Lock()
+
+
+def parse_uhids(values):
+    """UHIDs from repeated and/or comma-separated ?uhid= values, without repeats."""
+    uhids = []
+    for value in values:
+        for uhid in value.split(','):
+            uhid = uhid.strip()
+            if uhid and uhid not in uhids:
+                uhids.append(uhid)
+    return uhids
+
+def lookup_versions(cursor, uhids):
+    """Returns {uhid: (patient id, version)} for the patients that exist."""
+    versions = {uhid: (None, 'sample') for uhid in uhids if uhid in DUMMY_API_DATA}
+    codes = [uhid for uhid in uhids if uhid not in versions]
+    if codes:
+        cursor.execute(VERSIONS_SQL, (codes,))
+        versions.update((code, (patient_id, version)) for code, patient_id, version in cursor.fetchall())
+    return versions
+
+def make_etag(uhids, versions):
+    """A strong ETag for the answer to `uhids`, given their current versions."""
+    state = "|".join(f"{uhid}:{versions[uhid][0]}:{versions[uhid][1]}" if uhid in versions else f"{uhid}:-"
+                     for uhid in uhids)
+    return hashlib.sha1(f"{PAYLOAD_FORMAT}|{state}".encode()).hexdigest()[:32]
+
+def load_payloads(cursor, versions):
+    """
+    Returns {uhid: payload JSON text}, taking payloads whose version is unchanged
+    from the cache and building all the others in one query.
+    """
+    payloads, missing = {}, {}
+    with _cache_lock:
+        for uhid, (patient_id, version) in versions.items():
+            if patient_id is None:
+                payloads[uhid] = _DUMMY_PAYLOADS[uhid]
+                continue
+            cached = _cache.get(patient_id)
+            if cached and cached[0] == version:
+                _cache.move_to_end(patient_id)
+                payloads[uhid] = cached[1]
+            else:
+                missing[patient_id] = uhid
+    if missing:
+        cursor.execute(PAYLOADS_SQL, (list(missing),))
+        rows = cursor.fetchall()
+        with _cache_lock:
+            for patient_id, version, payload in rows:
+                # Stored under the version read with the payload; if that is newer
+                # than the one looked up, the next request simply rebuilds it.
+                _cache[patient_id] = (version, payload)
+                _cache.move_to_end(patient_id)
+                payloads[missing[patient_id]] = payload
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return payloads
+
+def _finish(response, etag):
+    response.set_etag(etag)
+    # Partners may keep answers but must revalidate them on every poll.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def patient_response(cursor, request, uhid):
+    """Response for /api/patient/<uhid>: the payload, a 304, or a 404."""
+    versions = lookup_versions(cursor, [uhid])
+    if uhid not in versions:
+        return Response(json.dumps({"error": f"Patient with UHID '{uhid}' not found"}),
+                        status=404, mimetype='application/json')
+    etag = make_etag([uhid], versions)
+    if request.if_none_match.contains(etag):
+        return _finish(Response(status=304), etag)
+    payload = load_payloads(cursor, versions)[uhid]
+    return _finish(Response(payload, mimetype='application/json'), etag)
+
+def batch_response(cursor, request, uhids):
+    """
+    Response for /api/patients: {"patients": {uhid: payload}, "not_found": [uhid]},
+    or a 304 when none of the requested patients changed.
+    """
+    versions = lookup_versions(cursor, uhids)
+    etag = make_etag(uhids, versions)
+    if request.if_none_match.contains(etag):
+        return _finish(Response(status=304), etag)
+    payloads = load_payloads(cursor, versions)
+    body = ('{"patients": {'
+            + ", ".join(f"{json.dumps(uhid)}: {payloads[uhid]}" for uhid in uhids if uhid in payloads)
+            + '}, "not_found": ' + json.dumps([uhid for uhid in uhids if uhid not in payloads]) + '}')
+    return _finish(Response(body, mimetype='application/json'), etag)
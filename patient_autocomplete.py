@@ -0,0 +1,251 @@
+# patient_autocomplete.py
+# In-process index behind /api/search_existing_patients, the patient autocomplete
+# of the registration and investigation request pages.
+# Every server process keeps the name, patient code and mobile number of all
+# patients in memory, indexed by trigram, and answers "contains" queries (the
+# same matches as ILIKE '%q%') without touching PostgreSQL.
+#
+# The index is loaded by a background thread on the first request. Migration
+# 0013 makes PostgreSQL NOTIFY the ids of inserted, deleted and renamed patients
+# after each commit, whichever process or script made the change; the thread
+# LISTENs and refreshes those entries, and reloads everything every
+# resync_interval as a safety net. While the index is not loaded, or the listen
+# connection is lost, search() returns None and callers fall back to SQL.
+#
+# LISTEN needs a session: with db_pool in pgbouncer_mode, point listen_dsn at the
+# PostgreSQL server itself.
+import heapq
+import logging
+import select
+import threading
+import time
+from array import array
+from collections import defaultdict
+from urllib.parse import quote
+
+import psycopg2
+
+import db_pool
+
+AUTOCOMPLETE_CONFIG = {
+    'enabled': True,
+    'limit': 10,
+    'min_length': 2,
+    'resync_interval': 900.0,  # seconds between full reloads
+    'retry_interval': 5.0,     # seconds before reconnecting a lost listen connection
+    'listen_dsn': None,        # DB_CONFIG-style dict for LISTEN; None uses db_pool.DB_CONFIG
+    'debounce_ms': 150,        # suggested client debounce (X-Autocomplete-Debounce-Ms)
+    'max_age': 15,             # seconds a browser may reuse an answer for the same query
+}
+
+CHANNEL = 'patient_autocomplete'
+GRAM = 3
+_END = '\x00'  # ends every field, so the last two characters of a value form a trigram too
+
+
+class PatientIndex:
+    """Trigram index over the lower-cased name, patient code and mobile number of each patient."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}                  # id -> (lower-cased name, id, name, patient_code, searched text)
+        self._postings = {}                 # trigram -> ids of patients containing it
+        self._by_prefix = defaultdict(set)  # two characters -> trigrams starting with them
+        self.stale_postings = 0             # postings left behind by updates and deletes
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def _add(self, patient_id, name, patient_code, mobile_number):
+        # Postings of a previous version stay behind; search() checks every
+        # candidate against its current text, so they only cost a lookup.
+        fields = [(value or '').lower() for value in (name, patient_code, mobile_number)]
+        if patient_id in self._records:
+            self.stale_postings += 1
+        self._records[patient_id] = (fields[0], patient_id, name or '', patient_code or '', _END.join(fields))
+        grams = set()
+        for field in fields:
+            padded = field + _END
+            grams.update(padded[i:i + GRAM] for i in range(len(padded) - GRAM + 1))
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('i')
+                self._by_prefix[gram[:2]].add(gram)
+            posting.append(patient_id)
+
+    def apply(self, rows, removed_ids=()):
+        """Adds or replaces (id, name, patient_code, mobile_number) rows and drops removed ids."""
+        with self._lock:
+            for row in rows:
+                self._add(*row)
+            for patient_id in removed_ids:
+                if self._records.pop(patient_id, None) is not None:
+                    self.stale_postings += 1
+
+    def search(self, query, limit=10):
+        """Patients whose name, code or mobile number contains `query`, ordered by name."""
+        needle = query.lower().replace(_END, '')
+        if len(needle) < 2:
+            return []
+        with self._lock:
+            if len(needle) >= GRAM:
+                # Every trigram of the query must occur; the rarest one bounds the candidates.
+                postings = []
+                for i in range(len(needle) - GRAM + 1):
+                    posting = self._postings.get(needle[i:i + GRAM])
+                    if posting is None:
+                        return []
+                    postings.append(posting)
+                candidates = set(min(postings, key=len))
+            else:
+                candidates = set()
+                for gram in self._by_prefix.get(needle, ()):
+                    candidates.update(self._postings[gram])
+            records = self._records
+            matches = [record for record in map(records.get, candidates)
+                       if record is not None and needle in record[4]]
+        return [{'id': record[1], 'patient_code': record[3], 'name': record[2]}
+                for record in heapq.nsmallest(limit, matches)]
+
+
+def _fetch_rows(db_conn, ids=None):
+    with db_conn.cursor() as cursor:
+        if ids is None:
+            cursor.execute("SELECT id, name, patient_code, mobile_number FROM Patient")
+        else:
+            cursor.execute("SELECT id, name, patient_code, mobile_number FROM Patient WHERE id = ANY(%s)",
+                           (list(ids),))
+        rows = cursor.fetchall()
+    db_conn.rollback()
+    return rows
+
+def load_index(db_conn):
+    """Builds a complete index from the Patient table."""
+    index = PatientIndex()
+    index.apply(_fetch_rows(db_conn))
+    index.loaded_at = time.time()
+    return index
+
+def refresh(index, db_conn, ids):
+    """Re-reads the given patients into `index`; ids that no longer exist are removed."""
+    rows = _fetch_rows(db_conn, ids)
+    found = {row[0] for row in rows}
+    index.apply(rows, [patient_id for patient_id in ids if patient_id not in found])
+
+
+# --- Background loader / listener ---
+class IndexListener:
+    """Thread that loads the index, then keeps it current from change notifications."""
+
+    def __init__(self, resync_interval, retry_interval):
+        self.resync_interval = resync_interval
+        self.retry_interval = retry_interval
+        self.index = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="patient-autocomplete", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _reload(self):
+        started = time.monotonic()
+        with db_pool.connection() as db_conn:
+            self.index = load_index(db_conn)
+        logging.info(f"Patient autocomplete index loaded: {len(self.index)} patients "
+                     f"in {time.monotonic() - started:.2f} s.")
+
+    def _run(self):
+        while not self._stop.is_set():
+            listen_conn = None
+            try:
+                listen_conn = psycopg2.connect(**(AUTOCOMPLETE_CONFIG['listen_dsn'] or db_pool.DB_CONFIG))
+                listen_conn.autocommit = True
+                with listen_conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                # Listening before loading: changes committed meanwhile are re-read afterwards.
+                self._reload()
+                self._listen(listen_conn)
+            except (psycopg2.Error, OSError) as e:
+                logging.error(f"Patient autocomplete listener failed, using SQL until it reconnects: {e}")
+                self.index = None
+                self._stop.wait(self.retry_interval)
+            finally:
+                if listen_conn is not None:
+                    listen_conn.close()
+
+    def _listen(self, listen_conn):
+        next_resync = time.monotonic() + self.resync_interval
+        while not self._stop.is_set():
+            timeout = min(1.0, max(next_resync - time.monotonic(), 0))
+            if select.select([listen_conn], [], [], timeout)[0]:
+                listen_conn.poll()
+            ids, reload = set(), False
+            while listen_conn.notifies:
+                payload = listen_conn.notifies.pop(0).payload
+                if payload == 'reload':
+                    reload = True
+                else:
+                    ids.update(int(value) for value in payload.split(',') if value)
+            if reload or time.monotonic() >= next_resync:
+                self._reload()
+                next_resync = time.monotonic() + self.resync_interval
+            elif ids:
+                with db_pool.connection() as db_conn:
+                    refresh(self.index, db_conn, ids)
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start():
+    """Starts this process's index listener once. Returns it, or None if disabled."""
+    global _listener
+    if not AUTOCOMPLETE_CONFIG['enabled']:
+        return None
+    with _listener_lock:
+        if _listener is None:
+            _listener = IndexListener(AUTOCOMPLETE_CONFIG['resync_interval'],
+                                      AUTOCOMPLETE_CONFIG['retry_interval'])
+            _listener.start()
+    return _listener
+
+def search(query, limit=None):
+    """Autocomplete matches from memory, or None while the index is not available."""
+    index = _listener.index if _listener is not None else None
+    if index is None:
+        return None
+    return index.search(query, limit or AUTOCOMPLETE_CONFIG['limit'])
+
+def search_database(cursor, query, limit=None):
+    """The same search as an ILIKE query, for when the index is not available."""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f"%{escaped}%"
+    cursor.execute("""
+        SELECT id, patient_code, name
+        FROM Patient
+        WHERE name ILIKE %s OR patient_code ILIKE %s OR mobile_number ILIKE %s
+        ORDER BY name
+        LIMIT %s
+    """, (pattern, pattern, pattern, limit or AUTOCOMPLETE_CONFIG['limit']))
+    return [{'id': row[0], 'patient_code': row[1], 'name': row[2]} for row in cursor.fetchall()]
+
+def set_response_headers(response, query, source, started):
+    """
+    Headers for autocomplete answers: the browser may reuse an answer for a query
+    it asked recently (backspacing), the query is echoed so a client can drop
+    answers that arrive after the input has changed, and the suggested debounce.
+    """
+    response.headers['Cache-Control'] = f"private, max-age={AUTOCOMPLETE_CONFIG['max_age']}"
+    response.headers['Vary'] = 'Cookie'
+    response.headers['X-Autocomplete-Query'] = quote(query, safe='')
+    response.headers['X-Autocomplete-Debounce-Ms'] = str(AUTOCOMPLETE_CONFIG['debounce_ms'])
+    response.headers['Server-Timing'] = (f'autocomplete;desc="{source}";'
+                                         f'dur={(time.perf_counter() - started) * 1000:.2f}')
+    return response
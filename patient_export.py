@@ -0,0 +1,116 @@
+# patient_export.py
+# Streaming CSV export of patients for /patients/download.
+# Rows are read through a server-side (named) cursor in batches of FETCH_SIZE and
+# written to the response in chunks of about CHUNK_SIZE bytes, so memory use stays
+# flat however many patients are exported. The latest follow-up and the medications
+# are looked up per patient (LATERAL, on the patient_id indexes) instead of aggregating
+# the whole FollowUpVisit / Prescription tables first, so the first rows are sent
+# immediately. Optionally the stream is gzip-compressed on the fly.
+import csv
+import io
+import zlib
+
+import db_pool
+
+FETCH_SIZE = 2000        # rows per round trip of the named cursor
+CHUNK_SIZE = 64 * 1024   # bytes buffered before a chunk is handed to the client
+
+EXPORT_HEADER = [
+    'Patient Code', 'Name', 'Age', 'Gender', 'Initial Diagnosis',
+    'Registration Date', 'Mobile', 'Email', 'Initial Treatment',
+    'Last Follow-up Date', 'Prescribed Medications'
+]
+
+EXPORT_QUERY = """
+    SELECT
+        p.patient_code, p.name,
+        CASE
+            WHEN p.dob IS NULL OR p.dob = 'infinity'::date OR p.dob = '-infinity'::date THEN NULL
+            ELSE date_part('year', age(p.dob))
+        END as age,
+        p.gender, p.diagnosis,
+        to_char(p.date_of_registration, 'YYYY-MM-DD') as date_of_registration,
+        p.mobile_number, p.email, p.initial_treatment_plan,
+        latest_follow_up.visit_date as last_follow_up_date,
+        prescriptions.all_medications
+    FROM Patient p
+    LEFT JOIN LATERAL (
+        SELECT MAX(visit_date) as visit_date
+        FROM FollowUpVisit
+        WHERE patient_id = p.id
+    ) latest_follow_up ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT STRING_AGG(pi.medication_name || ' (' || pi.dosage || ')', '; ' ORDER BY pr.id, pi.id) as all_medications
+        FROM Prescription pr
+        JOIN PrescriptionItem pi ON pr.id = pi.prescription_id
+        WHERE pr.patient_id = p.id
+    ) prescriptions ON TRUE
+"""
+
+
+def build_export_query(args):
+    """Returns (sql, params) for the export, applying the patient_id / mobile filters."""
+    filters = []
+    params = []
+    patient_id = args.get('patient_id')
+    mobile = args.get('mobile')
+    if patient_id:
+        filters.append("(LOWER(p.patient_code) LIKE %s OR CAST(p.id AS TEXT) LIKE %s)")
+        params.extend([f"%{patient_id.lower()}%", f"%{patient_id}%"])
+    if mobile:
+        filters.append("p.mobile_number LIKE %s")
+        params.append(f"%{mobile}%")
+
+    query = EXPORT_QUERY
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    query += " ORDER BY p.id DESC"
+    return query, tuple(params)
+
+
+def iter_csv_chunks(query, params):
+    """
+    Yields the export as CSV-encoded bytes chunks. Borrows its own pooled
+    connection for the duration of the stream (the response outlives the
+    request's g.db); a read replica serves it when one is configured.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    with db_pool.connection(read_only=True) as db_conn:
+        with db_conn.cursor(name='patient_export') as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(query, params)
+            # Send the header at once so the download starts before the first batch arrives.
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            for row in cursor:
+                writer.writerow(row)
+                if buffer.tell() >= CHUNK_SIZE:
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+        db_conn.rollback()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses a stream of bytes chunks into a single gzip member. Each chunk is
+    sync-flushed so the client receives data as it is produced.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream_export(args, compress=False):
+    """
+    Returns the chunk generator for the export, gzip-compressed if requested.
+    The filters are read from `args` (request.args) right away.
+    """
+    chunks = iter_csv_chunks(*build_export_query(args))
+    return gzip_chunks(chunks) if compress else chunks
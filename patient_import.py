@@ -0,0 +1,345 @@
+# patient_import.py
+# Bulk patient import (e.g. onboarding a satellite clinic) from CSV or JSON Lines,
+# for the admin endpoint /patients/import and the command line:
+#     python patient_import.py clinic.csv --doctor-id 1 --rejects rejected.csv
+#
+# Rows are checked while they are streamed into a temporary staging table with
+# COPY; rows with an unusable value are set aside with the reason. The rest is
+# done set-based in SQL: rows repeating an external_patient_id (within the file
+# or of an existing patient) are rejected, and a single INSERT ... SELECT takes
+# ids from the Patient sequence, builds the DERM-xxxxx codes from them and
+# computes BMI / BSA, so no per-patient UPDATE is needed. Everything runs in one
+# transaction: either all accepted rows are imported or none are.
+import argparse
+import csv
+import io
+import json
+import logging
+import math
+import os
+import sys
+import time
+from datetime import date, datetime
+
+import db_pool
+
+MAX_REPORTED_REJECTS = 1000  # rejected rows listed in the endpoint's response
+
+# Patient column -> (kind, maximum length)
+IMPORT_FIELDS = {
+    'external_patient_id': ('text', 50),
+    'name': ('text', 100),
+    'dob': ('date', None),
+    'gender': ('gender', None),
+    'mobile_number': ('text', 15),
+    'email': ('text', 100),
+    'address': ('text', None),
+    'city': ('text', 100),
+    'state': ('text', 100),
+    'pincode': ('text', 20),
+    'date_of_registration': ('date', None),
+    'complaints': ('text', None),
+    'examination_findings': ('text', None),
+    'past_medical_history': ('text', None),
+    'diagnosis': ('text', None),
+    'initial_treatment_plan': ('text', None),
+    'initial_blood_pressure': ('text', 10),
+    'initial_temperature': ('real', None),
+    'blood_sugar': ('real', None),
+    'initial_pulse_rate': ('int', None),
+    'initial_height': ('real', None),
+    'initial_weight': ('real', None),
+    'affected_bsa_percentage': ('real', None),
+}
+REQUIRED_FIELDS = ('name', 'dob', 'gender')
+
+# Other accepted column names (compared lower-cased, spaces as underscores).
+FIELD_ALIASES = {
+    'patient_name': 'name', 'date_of_birth': 'dob', 'sex': 'gender',
+    'mobile': 'mobile_number', 'phone': 'mobile_number', 'external_id': 'external_patient_id',
+    'registration_date': 'date_of_registration', 'height': 'initial_height', 'height_cm': 'initial_height',
+    'weight': 'initial_weight', 'weight_kg': 'initial_weight', 'temperature': 'initial_temperature',
+    'blood_pressure': 'initial_blood_pressure', 'pulse': 'initial_pulse_rate', 'pulse_rate': 'initial_pulse_rate',
+    'sugar': 'blood_sugar', 'treatment_plan': 'initial_treatment_plan',
+}
+GENDERS = {'m': 'Male', 'male': 'Male', 'f': 'Female', 'female': 'Female', 'o': 'Other', 'other': 'Other'}
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y')  # besides ISO (YYYY-MM-DD)
+FORMATS = ('csv', 'jsonl')
+
+STAGING_COLUMNS = list(IMPORT_FIELDS)
+_SQL_TYPES = {'text': 'TEXT', 'gender': 'TEXT', 'date': 'DATE', 'real': 'REAL', 'int': 'INT'}
+
+
+def detect_format(filename):
+    """'csv' or 'jsonl' from a file name, or None."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}.get(extension)
+
+def _field_name(header):
+    key = str(header).strip().lower().replace(' ', '_')
+    return key if key in IMPORT_FIELDS else FIELD_ALIASES.get(key)
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError
+
+def clean_row(raw):
+    """
+    Checks one input row (a dict keyed by Patient column). Returns (values, None)
+    with a value for every staging column, or (None, reason).
+    """
+    values = dict.fromkeys(STAGING_COLUMNS)
+    for column, value in raw.items():
+        if value is None:
+            continue
+        if value.__class__ is not str:
+            value = str(value)
+        if '\x00' in value:
+            value = value.replace('\x00', '')
+        value = value.strip()
+        if not value:
+            continue
+        kind, max_length = IMPORT_FIELDS[column]
+        text = value
+        try:
+            if kind == 'date':
+                value = _parse_date(value)
+            elif kind == 'real':
+                value = float(value)
+                if not math.isfinite(value):
+                    raise ValueError
+            elif kind == 'int':
+                value = int(float(value))
+                if abs(value) >= 2 ** 31:
+                    raise ValueError
+            elif kind == 'gender':
+                value = GENDERS[value.lower()]
+            elif max_length and len(value) > max_length:
+                return None, f"{column} longer than {max_length} characters"
+        except (ValueError, KeyError):
+            return None, f"invalid {column} '{text[:40]}'"
+        values[column] = value
+    for column in REQUIRED_FIELDS:
+        if values[column] is None:
+            return None, f"missing {column}"
+    return list(values.values()), None
+
+def read_rows(stream, fmt):
+    """
+    Returns an iterator of (line number, row dict keyed by Patient column or None,
+    error) over a text stream. A missing or unusable CSV header raises ValueError.
+    """
+    if fmt == 'csv':
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if not header:
+            raise ValueError("The CSV file is empty.")
+        columns = [_field_name(name) for name in header]
+        missing = [field for field in REQUIRED_FIELDS if field not in columns]
+        if missing:
+            raise ValueError(f"The CSV header has no column for: {', '.join(missing)}.")
+        return ((reader.line_num, {column: value for column, value in zip(columns, record) if column}, None)
+                for record in reader if any(record))
+    if fmt == 'jsonl':
+        return _read_json_lines(stream)
+    raise ValueError(f"Unknown import format '{fmt}'; use one of: {', '.join(FORMATS)}.")
+
+def _read_json_lines(stream):
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None, "invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "not a JSON object"
+            continue
+        row = {}
+        for key, value in record.items():
+            column = _field_name(key)
+            if column:
+                row[column] = value
+        yield line_no, row, None
+
+
+class _CopySource:
+    """File-like object that COPY reads the checked rows from as CSV, collecting rejects on the way."""
+
+    def __init__(self, rows, rejects):
+        self._rows = rows
+        self._rejects = rejects
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = ''
+        self.accepted = 0
+
+    def _fill(self, size):
+        for line_no, raw, error in self._rows:
+            values, reason = clean_row(raw) if raw is not None else (None, error)
+            if reason:
+                self._rejects.append({'line': line_no, 'external_patient_id': (raw or {}).get('external_patient_id'),
+                                      'name': (raw or {}).get('name'), 'reason': reason})
+                continue
+            self._writer.writerow([line_no] + values)
+            self.accepted += 1
+            if self._buffer.tell() >= size:
+                break
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return chunk
+
+    def read(self, size=65536):
+        if not self._pending:
+            self._pending = self._fill(size)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+def import_patients(db_conn, stream, fmt, doctor_id=None, dry_run=False):
+    """
+    Imports the patients of a CSV / JSON Lines text stream. Returns a report dict
+    with the counts, the first and last patient code assigned, and 'rejects'
+    (line, external_patient_id, name, reason) for every row not imported.
+    With dry_run the transaction is rolled back after checking.
+    """
+    started = time.monotonic()
+    rejects = []
+    source = _CopySource(read_rows(stream, fmt), rejects)
+    with db_conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TEMP TABLE patient_import_staging (
+                line_no INT PRIMARY KEY,
+                {", ".join(f"{column} {_SQL_TYPES[kind]}" for column, (kind, _) in IMPORT_FIELDS.items())},
+                reject_reason TEXT
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(f"COPY patient_import_staging (line_no, {', '.join(STAGING_COLUMNS)}) "
+                           f"FROM STDIN WITH (FORMAT csv)", source)
+        rows = source.accepted + len(rejects)
+
+        # --- Deduplicate on external_patient_id ---
+        cursor.execute("""
+            UPDATE patient_import_staging s
+            SET reject_reason = 'external_patient_id repeats line ' || f.first_line
+            FROM (
+                SELECT external_patient_id, MIN(line_no) AS first_line
+                FROM patient_import_staging
+                WHERE external_patient_id IS NOT NULL
+                GROUP BY external_patient_id HAVING COUNT(*) > 1
+            ) f
+            WHERE s.external_patient_id = f.external_patient_id AND s.line_no > f.first_line
+        """)
+        cursor.execute("""
+            UPDATE patient_import_staging s
+            SET reject_reason = 'external_patient_id already registered as ' || coalesce(p.patient_code, 'patient ' || p.id)
+            FROM Patient p
+            WHERE p.external_patient_id = s.external_patient_id AND s.reject_reason IS NULL
+        """)
+
+        # --- One INSERT: ids, codes and BMI / BSA for every accepted row ---
+        # A row whose external_patient_id was registered concurrently is skipped by
+        # ON CONFLICT and reported below.
+        fields = [column for column in STAGING_COLUMNS if column != 'date_of_registration']
+        cursor.execute(f"""
+            WITH numbered AS MATERIALIZED (
+                SELECT nextval(pg_get_serial_sequence('patient', 'id')) AS id, s.*
+                FROM (SELECT * FROM patient_import_staging WHERE reject_reason IS NULL ORDER BY line_no) s
+            ),
+            inserted AS (
+                INSERT INTO Patient (id, patient_code, {", ".join(fields)}, date_of_registration,
+                                     initial_bmi, initial_bsa, registered_by_doctor_id)
+                SELECT id, 'DERM-' || lpad(id::text, greatest(5, length(id::text)), '0'),
+                       {", ".join(fields)}, coalesce(date_of_registration, CURRENT_DATE),
+                       CASE WHEN initial_height > 0 AND initial_weight > 0
+                            THEN round((initial_weight / ((initial_height / 100.0) ^ 2))::numeric, 2) END,
+                       CASE WHEN initial_height > 0 AND initial_weight > 0
+                            THEN round(sqrt(initial_height * initial_weight / 3600.0)::numeric, 2) END,
+                       %s
+                FROM numbered
+                ON CONFLICT (external_patient_id) DO NOTHING
+                RETURNING id, patient_code
+            )
+            SELECT
+                (SELECT COUNT(*) FROM inserted),
+                (SELECT patient_code FROM inserted ORDER BY id LIMIT 1),
+                (SELECT patient_code FROM inserted ORDER BY id DESC LIMIT 1),
+                (SELECT array_agg(line_no ORDER BY line_no) FROM numbered
+                 WHERE id NOT IN (SELECT id FROM inserted))
+        """, (doctor_id,))
+        imported, first_code, last_code, conflicting_lines = cursor.fetchone()
+        if conflicting_lines:
+            cursor.execute("""
+                UPDATE patient_import_staging SET reject_reason = 'external_patient_id already registered'
+                WHERE line_no = ANY(%s)
+            """, (conflicting_lines,))
+        cursor.execute("""
+            SELECT line_no, external_patient_id, name, reject_reason
+            FROM patient_import_staging WHERE reject_reason IS NOT NULL
+        """)
+        rejects.extend({'line': line_no, 'external_patient_id': external_id, 'name': name, 'reason': reason}
+                       for line_no, external_id, name, reason in cursor.fetchall())
+    if dry_run:
+        db_conn.rollback()
+    else:
+        db_conn.commit()
+    rejects.sort(key=lambda reject: reject['line'])
+    return {
+        'format': fmt,
+        'rows': rows,
+        'imported': imported,
+        'rejected': len(rejects),
+        'first_patient_code': first_code,
+        'last_patient_code': last_code,
+        'dry_run': dry_run,
+        'seconds': round(time.monotonic() - started, 2),
+        'rejects': rejects,
+    }
+
+
+def write_rejects(rejects, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['line', 'external_patient_id', 'name', 'reason'])
+        writer.writeheader()
+        writer.writerows(rejects)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import patients from a CSV or JSON Lines file.")
+    parser.add_argument("file", help="CSV (with a header row) or JSON Lines file; '-' reads standard input")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--doctor-id", type=int, help="Users.id recorded as the registering doctor")
+    parser.add_argument("--rejects", help="write the rejected rows, with reasons, to this CSV file")
+    parser.add_argument("--dry-run", action="store_true", help="check and report without importing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    fmt = args.format or detect_format(args.file)
+    if not fmt:
+        parser.error("cannot tell the format from the file name; pass --format")
+    stream = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8-sig', newline='')
+    try:
+        with db_pool.connection() as db_conn:
+            report = import_patients(db_conn, stream, fmt, args.doctor_id, args.dry_run)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    if args.rejects:
+        write_rejects(report['rejects'], args.rejects)
+    logging.info(f"{'Checked' if args.dry_run else 'Imported'} {report['imported']} of {report['rows']} rows "
+                 f"in {report['seconds']} s ({report['first_patient_code']} .. {report['last_patient_code']}); "
+                 f"{report['rejected']} rejected.")
+    for reject in report['rejects'][:20]:
+        logging.info(f"  line {reject['line']}: {reject['reason']}")
@@ -0,0 +1,116 @@
+# patient_record.py
+# Loads a patient's header and record sections for patient_detail in a single query.
+# Each section is assembled in PostgreSQL with jsonb_agg (prescriptions carry their
+# items nested), replacing the per-section queries and the per-prescription N+1.
+# The same section queries back the /api/patient_record/<id>/<section> endpoints
+# that the page uses to load non-visible tabs lazily.
+from datetime import date, datetime
+
+# jsonb subqueries correlated on the outer "p" (Patient) row.
+SECTION_QUERIES = {
+    'visits': """
+        SELECT COALESCE(jsonb_agg(to_jsonb(fv) || jsonb_build_object('doctor_name', u.username)
+                                  ORDER BY fv.visit_date DESC, fv.id DESC), '[]'::jsonb)
+        FROM FollowUpVisit fv JOIN Users u ON fv.doctor_id = u.id
+        WHERE fv.patient_id = p.id
+    """,
+    'prescriptions': """
+        SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                   'prescription', to_jsonb(pr) || jsonb_build_object('doctor_name', u.username),
+                   'items', (SELECT COALESCE(jsonb_agg(to_jsonb(pi) ORDER BY pi.id), '[]'::jsonb)
+                             FROM PrescriptionItem pi WHERE pi.prescription_id = pr.id)
+               ) ORDER BY pr.prescription_date DESC), '[]'::jsonb)
+        FROM Prescription pr JOIN Users u ON pr.doctor_id = u.id
+        WHERE pr.patient_id = p.id
+    """,
+    'images': """
+        SELECT COALESCE(jsonb_agg(to_jsonb(pi) ORDER BY pi.upload_date DESC, pi.id DESC), '[]'::jsonb)
+        FROM PatientImage pi
+        WHERE pi.patient_id = p.id
+    """,
+    'labs': """
+        SELECT COALESCE(jsonb_agg(to_jsonb(lr) || jsonb_build_object('doctor_name', u.username)
+                                  ORDER BY lr.report_date DESC, lr.id DESC), '[]'::jsonb)
+        FROM LabReport lr LEFT JOIN Users u ON lr.requested_by_doctor_id = u.id
+        WHERE lr.patient_id = p.id
+    """,
+    'admissions': """
+        SELECT jsonb_build_object(
+            'current', (
+                SELECT jsonb_build_object(
+                    'id', ba.id, 'admission_date', ba.admission_date, 'bed_number', b.bed_number,
+                    'daily_notes', (
+                        SELECT COALESCE(jsonb_agg(to_jsonb(dpn) || jsonb_build_object('doctor_name', du.username)
+                                                  ORDER BY dpn.note_date DESC), '[]'::jsonb)
+                        FROM DailyProgressNote dpn JOIN Users du ON dpn.doctor_id = du.id
+                        WHERE dpn.assignment_id = ba.id))
+                FROM BedAssignment ba JOIN Bed b ON ba.bed_id = b.id
+                WHERE ba.patient_id = p.id AND ba.discharge_date IS NULL
+                ORDER BY ba.admission_date DESC
+                LIMIT 1),
+            'history', (
+                SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                           'id', ba.id, 'admission_date', ba.admission_date, 'discharge_date', ba.discharge_date,
+                           'discharge_summary', ba.discharge_summary, 'bed_number', b.bed_number
+                       ) ORDER BY ba.discharge_date DESC), '[]'::jsonb)
+                FROM BedAssignment ba JOIN Bed b ON ba.bed_id = b.id
+                WHERE ba.patient_id = p.id AND ba.discharge_date IS NOT NULL))
+    """,
+}
+
+SECTIONS = tuple(SECTION_QUERIES)
+
+
+def _restore_dates(value):
+    """Turns the ISO strings jsonb produces for *_date keys back into date/datetime objects."""
+    if isinstance(value, list):
+        return [_restore_dates(v) for v in value]
+    if isinstance(value, dict):
+        restored = {}
+        for key, v in value.items():
+            if isinstance(v, str) and key.endswith('_date'):
+                try:
+                    v = date.fromisoformat(v) if len(v) == 10 else datetime.fromisoformat(v)
+                except ValueError:
+                    pass
+            restored[key] = _restore_dates(v)
+        return restored
+    return value
+
+
+def load_patient_record(cursor, patient_id, sections=SECTIONS):
+    """
+    Loads the Patient row (plus age) and the requested sections in one query.
+    `cursor` must be a DictCursor. Returns None if the patient does not exist,
+    otherwise a dict with 'patient' and one key per section, dates restored to
+    Python objects for the templates.
+    """
+    unknown = set(sections) - set(SECTION_QUERIES)
+    if unknown:
+        raise ValueError(f"Unknown patient record sections: {', '.join(sorted(unknown))}")
+    section_sql = "".join(f",\n            ({SECTION_QUERIES[name]}) AS section_{name}" for name in sections)
+    cursor.execute(f"""
+        SELECT p.*, date_part('year', age(p.dob)) as age{section_sql}
+        FROM Patient p
+        WHERE p.id = %s
+    """, (patient_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    patient = dict(row)
+    record = {'patient': patient}
+    for name in sections:
+        record[name] = _restore_dates(patient.pop(f'section_{name}'))
+    return record
+
+
+def load_section(cursor, patient_id, section):
+    """
+    Loads one section as plain JSON-ready data (ISO date strings) for the lazy tab
+    endpoints. Returns None if the patient does not exist.
+    """
+    if section not in SECTION_QUERIES:
+        raise ValueError(f"Unknown patient record section: {section}")
+    cursor.execute(f"SELECT ({SECTION_QUERIES[section]}) FROM Patient p WHERE p.id = %s", (patient_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
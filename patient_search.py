@@ -0,0 +1,175 @@
+# patient_search.py
+# Shared patient list search used by the dashboard and /patients.
+# Pages are addressed with keyset cursors on Patient.id instead of OFFSET, so
+# page 5,000 costs the same as page 1, and totals come from the planner's
+# estimate (unfiltered) or a capped/cached count (filtered) instead of COUNT(*).
+import threading
+import time
+from datetime import datetime
+
+PER_PAGE = 15
+COUNT_CAP = 1000          # filtered counts stop at this many rows and show "1000+"
+COUNT_CACHE_TTL = 60.0    # seconds a filtered count is reused for identical filters
+EXACT_COUNT_BELOW = 10000 # small tables are counted exactly; the estimate can lag behind
+
+FILTER_FIELDS = ('name', 'patient_code', 'mobile_number', 'status',
+                 'registered_from', 'registered_to', 'diagnosis', 'city')
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+def _like_escape(value):
+    """Escapes LIKE wildcards so user input only matches literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def _parse_cursor(value):
+    try:
+        cursor_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor_id if cursor_id > 0 else None
+
+
+def read_filters(args):
+    """Extracts the non-empty search filters from request.args."""
+    filters = {}
+    for field in FILTER_FIELDS:
+        value = (args.get(field) or '').strip()
+        if value:
+            filters[field] = value
+    return filters
+
+def build_where(filters):
+    """Returns (clauses, params): SQL conditions on Patient and their parameters."""
+    clauses = []
+    params = []
+    for field in ('name', 'patient_code', 'mobile_number', 'diagnosis'):
+        if field in filters:
+            clauses.append(f"{field} ILIKE %s")
+            params.append(f"%{_like_escape(filters[field])}%")
+    if 'city' in filters:
+        clauses.append("LOWER(city) = LOWER(%s)")
+        params.append(filters['city'])
+    if filters.get('status') == 'admitted':
+        clauses.append("is_admitted = TRUE")
+    elif filters.get('status') == 'discharged':
+        clauses.append("is_admitted = FALSE")
+    registered_from = _parse_date(filters.get('registered_from'))
+    if registered_from:
+        clauses.append("date_of_registration >= %s")
+        params.append(registered_from)
+    registered_to = _parse_date(filters.get('registered_to'))
+    if registered_to:
+        clauses.append("date_of_registration <= %s")
+        params.append(registered_to)
+    return clauses, params
+
+
+# --- Counts ---
+def estimated_patient_count(cursor):
+    """Planner estimate of the Patient row count; exact for small or never-analyzed tables."""
+    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'patient'::regclass")
+    row = cursor.fetchone()
+    estimate = row[0] if row else -1
+    if estimate is None or estimate < EXACT_COUNT_BELOW:
+        cursor.execute("SELECT COUNT(*) FROM Patient")
+        return cursor.fetchone()[0]
+    return estimate
+
+def capped_count(cursor, clauses, params):
+    """Counts matching patients up to COUNT_CAP + 1, caching the result for COUNT_CACHE_TTL."""
+    key = (tuple(clauses), tuple(str(p) for p in params))
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if cached and now - cached[1] < COUNT_CACHE_TTL:
+            return cached[0]
+    where_sql = "WHERE " + " AND ".join(clauses)
+    cursor.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM Patient {where_sql} LIMIT %s) capped",
+        tuple(params) + (COUNT_CAP + 1,)
+    )
+    count = cursor.fetchone()[0]
+    with _count_cache_lock:
+        if len(_count_cache) > 1000:
+            _count_cache.clear()
+        _count_cache[key] = (count, now)
+    return count
+
+
+# --- Search ---
+def search_patients(cursor, args, per_page=PER_PAGE, with_count=True):
+    """
+    Runs one page of the patient list search.
+
+    `args` is request.args; `after` / `before` are keyset cursors (patient ids)
+    for the next and previous page. Returns a dict with the page of patients,
+    the cursors for neighbouring pages, the active filters and the total count
+    (an estimate or capped count; see `count_label`).
+    """
+    filters = read_filters(args)
+    clauses, params = build_where(filters)
+    after = _parse_cursor(args.get('after'))
+    before = None if after else _parse_cursor(args.get('before'))
+
+    page_clauses = list(clauses)
+    page_params = list(params)
+    if after:
+        page_clauses.append("id < %s")
+        page_params.append(after)
+        order = "DESC"
+    elif before:
+        page_clauses.append("id > %s")
+        page_params.append(before)
+        order = "ASC"
+    else:
+        order = "DESC"
+    where_sql = ("WHERE " + " AND ".join(page_clauses)) if page_clauses else ""
+
+    # Fetch one extra row to learn whether another page exists in this direction.
+    cursor.execute(f"""
+        SELECT id, patient_code, name, DATE_PART('year', AGE(dob)) as age, gender, diagnosis, is_admitted
+        FROM Patient
+        {where_sql}
+        ORDER BY id {order}
+        LIMIT %s
+    """, tuple(page_params) + (per_page + 1,))
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    if before:
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None
+
+    result = {
+        'patients': rows,
+        'filters': filters,
+        'next_cursor': rows[-1]['id'] if rows and has_next else None,
+        'prev_cursor': rows[0]['id'] if rows and has_prev else None,
+        'total_count': None,
+        'count_is_estimate': False,
+        'count_label': '',
+    }
+    if with_count:
+        if clauses:
+            count = capped_count(cursor, clauses, params)
+            result['total_count'] = min(count, COUNT_CAP)
+            result['count_is_estimate'] = count > COUNT_CAP
+            result['count_label'] = f"{COUNT_CAP}+" if count > COUNT_CAP else str(count)
+        else:
+            count = estimated_patient_count(cursor)
+            result['total_count'] = count
+            result['count_is_estimate'] = count >= EXACT_COUNT_BELOW
+            result['count_label'] = f"~{count}" if result['count_is_estimate'] else str(count)
+    return result
@@ -1,13 +1,22 @@
-import os
+import hashlib
+import hmac
+import json
 import time
 import requests
 import logging
 from datetime import datetime
-from flask import Blueprint, request, session, flash, redirect, url_for
+from flask import Blueprint, request, session, flash, redirect, url_for, jsonify
 import psycopg2
 import psycopg2.extras
 from werkzeug.utils import secure_filename
 
+import db_pool
+import image_derivatives
+import radiology_cache
+import radiology_client
+import radiology_download
+import radiology_jobs
+
 # --- Blueprint Setup for Radiology ---
 radiology_bp = Blueprint('radiology_api', __name__)
 
@@ -15,72 +24,181 @@ radiology_bp = Blueprint('radiology_api', __name__)
 RADIOLOGY_API_HOST = "http://127.0.0.1:5000" # Target Radiology Server
 UPLOAD_FOLDER = 'uploads' # Main app's upload folder
 
-DB_CONFIG = {
-    'dbname': 'dermatology_db', 'user': 'postgres', 'password': 'Noor@818',
-    'host': 'localhost', 'port': '5432', 'sslmode': 'disable'
+# Statuses (lower-cased) of a radiology request whose scan can be downloaded, or never will be.
+READY_STATUSES = ('attended', 'completed')
+FAILED_STATUSES = ('failed', 'rejected', 'cancelled')
+
+# --- Completion callbacks (optional) ---
+# With a url and a shared secret, every order asks the radiology server to POST to the
+# url once the scan is ready (see radiology_callback()); status polling then only runs
+# as a rare safety net. The server signs the callback: header
+#     X-Radiology-Signature: t=<unix time>,v1=<hex HMAC-SHA256 of "<t>." + body, keyed with the secret>
+RADIOLOGY_CALLBACK_CONFIG = {
+    'url': None,        # e.g. "https://dermosys.example.org/api/radiology/callback", as the server reaches it
+    'secret': None,     # shared with the radiology server
+    'max_skew_s': 300,  # callbacks signed longer ago (or ahead) than this are refused, against replays
 }
 
-# --- Database Connection Helper ---
+# --- Database Connection Helpers ---
 def get_db_connection():
-    """Establishes a new database connection."""
-    return psycopg2.connect(**DB_CONFIG)
+    """Borrows a connection from the shared pool."""
+    return db_pool.getconn()
+
+def release_db_connection(db_conn):
+    """Returns a connection obtained from get_db_connection() to the pool."""
+    db_pool.putconn(db_conn)
+
+# --- Callback Signatures ---
+def callbacks_enabled():
+    return bool(RADIOLOGY_CALLBACK_CONFIG['url'] and RADIOLOGY_CALLBACK_CONFIG['secret'])
+
+def callback_signature(secret, timestamp, body):
+    """The v1 signature of a callback body sent at `timestamp` (unix seconds)."""
+    return hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+def verify_callback(signature_header, body, now=None):
+    """True if X-Radiology-Signature is a valid, recent signature of `body` (bytes)."""
+    secret = RADIOLOGY_CALLBACK_CONFIG['secret']
+    if not secret or not signature_header:
+        return False
+    parts = dict(part.strip().split('=', 1) for part in signature_header.split(',') if '=' in part)
+    try:
+        timestamp = int(parts.get('t', ''))
+    except ValueError:
+        return False
+    if abs((time.time() if now is None else now) - timestamp) > RADIOLOGY_CALLBACK_CONFIG['max_skew_s']:
+        return False
+    return hmac.compare_digest(parts.get('v1', ''), callback_signature(secret, timestamp, body))
 
 # --- Radiology API Helper Functions ---
-def save_stream_to_file(resp, out_path, chunk_size=8192):
-    """Saves a streaming response content to a file."""
-    with open(out_path, 'wb') as f:
-        for chunk in resp.iter_content(chunk_size):
-            if chunk:
-                f.write(chunk)
+def build_scan_filename(patient_id, scan_type, body_part):
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_fname = f"scan_{patient_id}_{scan_type}_{body_part}_{ts}.dcm"
+    return secure_filename(base_fname)
 
-def download_scan(db_conn, host, scan_id, patient_id, scan_type, body_part):
-    """Downloads the scan and, crucially, creates a PatientImage record."""
+def record_scan_image(db_conn, patient_id, stored, scan_type, body_part, commit=True):
+    """
+    Creates the PatientImage record that makes a downloaded scan appear in the galleries,
+    or links the patient's existing image of the same content (a scan ordered again).
+    `stored` is the dict returned by file_storage for the scan file. Returns the image id.
+    """
+    notes = f"{scan_type.upper()} of {body_part.upper()}"
+    with db_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id FROM PatientImage WHERE patient_id = %s AND content_sha256 = %s
+            ORDER BY id LIMIT 1
+        """, (patient_id, stored['sha256']))
+        existing = cursor.fetchone()
+        if existing:
+            logging.info(f"Radiology {notes} for patient {patient_id} is already image {existing[0]}; linked it")
+            return existing[0]
+        cursor.execute("""
+            INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes,
+                                      content_sha256, size_bytes, original_filename)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (patient_id, stored['path'], datetime.now(), notes,
+              stored['sha256'], stored['size'], stored['original_filename']))
+        image_id = cursor.fetchone()[0]
+    if commit:
+        db_conn.commit()
+    image_derivatives.submit(stored['path'], UPLOAD_FOLDER)
+    return image_id
+
+def fetch_scan_file(host, scan_id, patient_id, scan_type, body_part, uhid=None):
+    """
+    Downloads a finished scan into the file store (radiology_download: verified,
+    resumable, in parallel ranges), unless radiology_cache has it and it is fresh or
+    the server answers 304 Not Modified. Returns the file_storage dict, or None on failure.
+    Raises radiology_client.RadiologyUnavailable while the circuit breaker is open.
+    """
+    cached = radiology_cache.lookup(scan_id, UPLOAD_FOLDER)
+    if cached and radiology_cache.is_fresh(cached):
+        return radiology_cache.reuse(cached, 'fresh')
     url = f"{host.rstrip('/')}/api/scans/download/{scan_id}"
     try:
-        with requests.get(url, stream=True, timeout=30) as r:
-            if not r.ok:
-                return None
-            
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            base_fname = f"scan_{patient_id}_{scan_type}_{body_part}_{ts}.dcm"
-            filename = secure_filename(base_fname)
-            out_path = os.path.join(UPLOAD_FOLDER, filename)
-            save_stream_to_file(r, out_path)
-
-            # *** KEY CHANGE: Create a PatientImage record, not a LabReport ***
-            # This makes the scan appear in the image galleries.
-            notes = f"{scan_type.upper()} of {body_part.upper()}"
-            with db_conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes)
-                    VALUES (%s, %s, %s, %s)
-                """, (patient_id, filename, datetime.now(), notes))
-                db_conn.commit()
-            return filename
-    except Exception as e:
+        stored, r = radiology_download.download(url, build_scan_filename(patient_id, scan_type, body_part),
+                                                UPLOAD_FOLDER, radiology_cache.conditional_headers(cached))
+    except radiology_client.RadiologyUnavailable:
+        raise
+    except (requests.RequestException, OSError) as e:
+        logging.error(f"Error in fetch_scan_file: {e}")
+        return None
+    if r.status_code == 304 and cached:
+        return radiology_cache.reuse(cached, 'not_modified')
+    if not stored:
+        return None
+    radiology_cache.remember(scan_id, stored, r.headers, uhid, scan_type, body_part,
+                             outcome='changed' if cached else 'miss')
+    return stored
+
+def download_scan(db_conn, host, scan_id, patient_id, scan_type, body_part):
+    """Downloads the scan and, crucially, creates a PatientImage record. Returns its stored path."""
+    try:
+        stored = fetch_scan_file(host, scan_id, patient_id, scan_type, body_part)
+    except radiology_client.RadiologyUnavailable as e:
+        logging.error(f"Error in download_scan: {e}")
+        return None
+    if not stored:
+        return None
+    try:
+        record_scan_image(db_conn, patient_id, stored, scan_type, body_part)
+    except psycopg2.Error as e:
+        db_conn.rollback()
         logging.error(f"Error in download_scan: {e}")
         return None
+    return stored['path']
 
-def poll_request_status(db_conn, host, request_id, patient_id, scan_type, body_part, timeout_s=300.0, poll_interval_s=3.0):
-    """Polls the status of a request until it's completed or times out."""
+def check_request_status(host, request_id):
+    """
+    Asks the radiology server once about an accepted request.
+    Returns the scan_id when the scan is ready, otherwise None.
+    Raises requests.RequestException on connection errors.
+    """
     status_url = f"{host.rstrip('/')}/api/request_status/{request_id}"
+    with radiology_client.get_client().call('status', 'GET', status_url, timeout=15) as r:
+        j = r.json() if r.ok else None
+    if j:
+        status = j.get('status')
+        scan_id = j.get('scan_id')
+        if status and status.lower() in READY_STATUSES and scan_id:
+            return scan_id
+    return None
+
+def wait_for_scan(host, request_id, timeout_s=300.0, poll_interval_s=3.0, max_interval_s=30.0):
+    """
+    Polls an accepted request until its scan is ready, doubling the pause after each
+    check up to max_interval_s. Returns the scan_id, or None on timeout.
+    """
     started = time.time()
+    interval = poll_interval_s
     while time.time() - started < timeout_s:
         try:
-            r = requests.get(status_url, timeout=15)
-            if r.ok:
-                j = r.json()
-                status = j.get('status')
-                scan_id = j.get('scan_id')
-                if status and status.lower() in ('attended', 'completed') and scan_id:
-                    return download_scan(db_conn, host, scan_id, patient_id, scan_type, body_part)
-        except requests.RequestException:
-            pass # Ignore connection errors and continue polling
-        time.sleep(poll_interval_s)
+            scan_id = check_request_status(host, request_id)
+            if scan_id:
+                return scan_id
+        except (requests.RequestException, ValueError):
+            pass # Ignore connection errors and bad replies and continue polling
+        time.sleep(max(0.0, min(interval, timeout_s - (time.time() - started))))
+        interval = min(interval * 2, max_interval_s)
     return None
 
-def perform_radiology_request(db_conn, patient_id, uhid, scan_type, body_part):
-    """Performs the full API request cycle for a radiology scan."""
+def poll_request_status(db_conn, host, request_id, patient_id, scan_type, body_part, timeout_s=300.0, poll_interval_s=3.0):
+    """Polls the status of a request until it's completed or times out."""
+    scan_id = wait_for_scan(host, request_id, timeout_s, poll_interval_s)
+    if not scan_id:
+        return None
+    return download_scan(db_conn, host, scan_id, patient_id, scan_type, body_part)
+
+def submit_radiology_request(patient_id, uhid, scan_type, body_part):
+    """
+    Sends the order to the radiology server. Returns a (kind, value) pair:
+      ('file', stored)          the scan was returned immediately and saved (file_storage dict),
+                                or it is the cached copy the server confirmed with 304 Not Modified
+      ('accepted', request_id)  the server queued the order; poll check_request_status()
+      ('error', message)        the order was rejected
+    Raises requests.RequestException on connection errors.
+    """
     url = f"{RADIOLOGY_API_HOST.rstrip('/')}/api/v1/get_or_request_scan"
     payload = {
         "department_name": "Dermatology",
@@ -88,42 +206,172 @@ def perform_radiology_request(db_conn, patient_id, uhid, scan_type, body_part):
         "type_of_scan": scan_type,
         "body_part": body_part
     }
+    if callbacks_enabled():
+        payload["callback_url"] = RADIOLOGY_CALLBACK_CONFIG['url']
     headers = {'Accept': 'application/json, application/dicom, */*'}
+    # Should the server answer with the scan itself, an unchanged study comes back as 304.
+    cached = radiology_cache.lookup_study(uhid, scan_type, body_part, UPLOAD_FOLDER)
+    headers.update(radiology_cache.conditional_headers(cached))
+
+    with radiology_client.get_client().call('submit', 'POST', url, json=payload, headers=headers,
+                                            timeout=30, stream=True) as resp:
+        # Case 0: The cached copy of the study is still current
+        if resp.status_code == 304 and cached:
+            return 'file', radiology_cache.reuse(cached, 'not_modified')
+
+        # Case 1: Immediate DICOM file download
+        if resp.status_code == 200 and 'application/dicom' in resp.headers.get('Content-Type', ''):
+            stored = radiology_download.store_response(resp, build_scan_filename(patient_id, scan_type, body_part), UPLOAD_FOLDER)
+            scan_id = resp.headers.get('X-Scan-Id') or radiology_cache.study_key(uhid, scan_type, body_part)
+            radiology_cache.remember(scan_id, stored, resp.headers, uhid, scan_type, body_part,
+                                     outcome='changed' if cached else 'miss')
+            return 'file', stored
 
+        # Case 2: Request was accepted, the caller polls for it
+        if resp.status_code == 202:
+            j = resp.json()
+            request_id = j.get('request_id') or j.get('id')
+            if not request_id:
+                return 'error', f"Server returned 202 but no request_id was found: {j}"
+            return 'accepted', str(request_id)
+
+        # Case 3: An error occurred
+        return 'error', f"Server returned error {resp.status_code}: {resp.text[:400]}"
+
+def fetch_radiology_scan(patient_id, uhid, scan_type, body_part):
+    """
+    Orders one scan and waits for it: submit, poll, download into the file store.
+    Holds no database connection while waiting (the scan cache borrows one briefly),
+    so several can run at once. Returns (stored, error).
+    """
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=30, stream=True)
+        kind, value = submit_radiology_request(patient_id, uhid, scan_type, body_part)
+    except radiology_client.RadiologyUnavailable as e:
+        return None, str(e)
     except requests.RequestException as e:
         return None, f"Request error: {e}"
 
-    # Case 1: Immediate DICOM file download
-    if resp.status_code == 200 and 'application/dicom' in resp.headers.get('Content-Type', ''):
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_fname = f"scan_{patient_id}_{scan_type}_{body_part}_{ts}.dcm"
-        filename = secure_filename(base_fname)
-        out_path = os.path.join(UPLOAD_FOLDER, filename)
-        save_stream_to_file(resp, out_path)
-        
-        notes = f"{scan_type.upper()} of {body_part.upper()}"
-        with db_conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO PatientImage (patient_id, image_filename, upload_date, notes)
-                VALUES (%s, %s, %s, %s)
-            """, (patient_id, filename, datetime.now(), notes))
-            db_conn.commit()
-        return filename, None
-
-    # Case 2: Request was accepted, start polling
-    if resp.status_code == 202:
-        j = resp.json()
-        request_id = j.get('request_id') or j.get('id')
-        if not request_id:
-            return None, f"Server returned 202 but no request_id was found: {j}"
-        
-        filename = poll_request_status(db_conn, RADIOLOGY_API_HOST, request_id, patient_id, scan_type, body_part)
-        if filename:
-            return filename, None
+    if kind == 'file':
+        return value, None
+
+    if kind == 'accepted':
+        scan_id = wait_for_scan(RADIOLOGY_API_HOST, value)
+        try:
+            stored = scan_id and fetch_scan_file(RADIOLOGY_API_HOST, scan_id, patient_id, scan_type, body_part, uhid)
+        except radiology_client.RadiologyUnavailable as e:
+            return None, str(e)
+        if stored:
+            return stored, None
+        return None, "Polling timed out or the final download failed."
+
+    return None, value
+
+def perform_radiology_request(db_conn, patient_id, uhid, scan_type, body_part):
+    """
+    Performs the full API request cycle for a radiology scan, blocking until it
+    finishes. Web routes enqueue a job with radiology_jobs.enqueue_jobs() instead.
+    """
+    stored, error = fetch_radiology_scan(patient_id, uhid, scan_type, body_part)
+    if not stored:
+        return None, error
+    record_scan_image(db_conn, patient_id, stored, scan_type, body_part)
+    return stored['path'], None
+
+def perform_radiology_requests(db_conn, patient_id, uhid, scans):
+    """
+    Like perform_radiology_request() for several (scan_type, body_part) pairs of one
+    patient, which are submitted, polled and downloaded concurrently (at most
+    RADIOLOGY_CLIENT_CONFIG['max_parallel'] at a time). Returns a (filename, error)
+    pair per scan, in order.
+    """
+    results = radiology_client.get_client().fan_out(
+        lambda scan: fetch_radiology_scan(patient_id, uhid, *scan), scans)
+    outcomes = []
+    for (scan_type, body_part), (result, error, seconds) in zip(scans, results):
+        stored, message = result if error is None else (None, f"Internal error: {error}")
+        logging.info(f"Radiology {scan_type} of {body_part} for patient {patient_id}: "
+                     f"{'stored' if stored else message} after {seconds:.1f}s")
+        if stored:
+            record_scan_image(db_conn, patient_id, stored, scan_type, body_part)
+            outcomes.append((stored['path'], None))
         else:
-            return None, "Polling timed out or the final download failed."
+            outcomes.append((None, message))
+    return outcomes
+
+# --- Radiology Job Status Routes ---
+@radiology_bp.route('/jobs/<int:job_id>')
+def radiology_job_status(job_id):
+    """Returns the state of one radiology order job."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    db_conn = get_db_connection()
+    try:
+        with db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            job = radiology_jobs.get_job(cursor, job_id)
+    finally:
+        release_db_connection(db_conn)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(radiology_jobs.job_to_json(job))
+
+@radiology_bp.route('/jobs')
+def radiology_jobs_for_patient():
+    """Returns the most recent radiology order jobs of ?patient_id=."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    patient_id = request.args.get('patient_id', type=int)
+    if not patient_id:
+        return jsonify({'error': 'patient_id is required'}), 400
+    db_conn = get_db_connection()
+    try:
+        with db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            jobs = radiology_jobs.list_patient_jobs(cursor, patient_id)
+    finally:
+        release_db_connection(db_conn)
+    return jsonify({
+        'patient_id': patient_id,
+        'jobs': [radiology_jobs.job_to_json(job) for job in jobs],
+        'active': any(job['status'] in radiology_jobs.ACTIVE_STATUSES for job in jobs),
+        'server': radiology_client.server_status(),
+    })
+
+@radiology_bp.route('/callback', methods=['POST'])
+def radiology_callback():
+    """
+    Called by the radiology server when a request changes state:
+    {"request_id": "...", "status": "completed", "scan_id": "..."}, signed (see
+    RADIOLOGY_CALLBACK_CONFIG). A ready scan makes its job due at once, and a job
+    worker downloads it into the gallery; a failed request fails the job.
+    """
+    body = request.get_data()
+    if not verify_callback(request.headers.get('X-Radiology-Signature'), body):
+        return jsonify({'error': 'Invalid or missing signature'}), 401
+    try:
+        payload = json.loads(body)
+        request_id = str(payload['request_id'])
+        status = str(payload.get('status') or '').lower()
+        scan_id = payload.get('scan_id')
+    except (ValueError, KeyError, TypeError):
+        return jsonify({'error': 'Expected a JSON object with request_id and status'}), 400
+
+    db_conn = get_db_connection()
+    try:
+        job_id = radiology_jobs.apply_callback(db_conn, request_id, status, scan_id and str(scan_id))
+    except psycopg2.Error as e:
+        db_conn.rollback()
+        logging.error(f"Error in radiology_callback: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    finally:
+        release_db_connection(db_conn)
+    if job_id is None:
+        # Unknown, finished, or not yet recorded as submitted: a retry of the callback or
+        # the fallback status check picks it up.
+        return jsonify({'error': f"No pending order for request '{request_id}'"}), 404
+    return jsonify({'job_id': job_id, 'status': status})
 
-    # Case 3: An error occurred
-    return None, f"Server returned error {resp.status_code}: {resp.text[:400]}"
+@radiology_bp.route('/client_stats')
+def radiology_client_stats():
+    """Keep-alive client settings and per-operation latency of calls to the radiology server."""
+    if session.get('role_id') != 1:
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify(radiology_client.stats())
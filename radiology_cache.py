@@ -0,0 +1,142 @@
+# radiology_cache.py
+# Local cache of the scans downloaded from the radiology server (migration 0016).
+#
+# Ordering the same uhid / scan_type / body_part again usually yields the same study,
+# and a DICOM file is several megabytes. Every downloaded scan is therefore recorded
+# in RadiologyScanCache under the server's scan_id, with the path of its file in the
+# content store (file_storage.py) and the ETag / Last-Modified headers it came with.
+# The next time that scan is wanted (radiology_api.fetch_scan_file()):
+#   - validated less than fresh_seconds ago: the stored file is used as it is;
+#   - otherwise the download is sent with If-None-Match / If-Modified-Since, and a
+#     304 Not Modified answer reuses the stored file without transferring it again.
+# Orders the server answers with the scan itself are sent with the validators of the
+# newest cached scan of that study, so an unchanged study is not transferred either.
+# Entries whose file has gone missing are ignored. The cache is best-effort: a
+# database error while consulting it only means the scan is downloaded again.
+#
+# What the cache saved shows in /metrics as dermosys_radiology_cache_total{outcome}.
+import logging
+import os
+
+import psycopg2
+import psycopg2.extras
+
+import db_pool
+import request_metrics
+
+RADIOLOGY_CACHE_CONFIG = {
+    'enabled': True,
+    'fresh_seconds': 300,   # a scan validated this recently is reused without asking the server
+}
+
+CACHE_COLUMNS = """
+    scan_id, uhid, scan_type, body_part, image_filename, content_sha256, size_bytes,
+    original_filename, etag, last_modified, EXTRACT(EPOCH FROM NOW() - validated_at) AS age_s
+"""
+
+
+def study_key(uhid, scan_type, body_part):
+    """Cache key of a scan the server sent without naming its scan_id."""
+    return f"study:{uhid}:{scan_type.upper()}:{body_part.upper()}"
+
+def _fetch_entry(query, params, upload_folder):
+    if not RADIOLOGY_CACHE_CONFIG['enabled']:
+        return None
+    try:
+        with db_pool.connection() as db_conn:
+            with db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(query, params)
+                entry = cursor.fetchone()
+            db_conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Radiology cache lookup failed: {e}")
+        return None
+    if entry is None or not os.path.exists(os.path.join(upload_folder, entry['image_filename'])):
+        return None
+    return entry
+
+def lookup(scan_id, upload_folder):
+    """The cache entry of a scan whose file is still stored, or None."""
+    return _fetch_entry(f"SELECT {CACHE_COLUMNS} FROM RadiologyScanCache WHERE scan_id = %s",
+                        (scan_id,), upload_folder)
+
+def lookup_study(uhid, scan_type, body_part, upload_folder):
+    """The most recently validated cached scan of a study, or None."""
+    return _fetch_entry(f"""
+        SELECT {CACHE_COLUMNS} FROM RadiologyScanCache
+        WHERE uhid = %s AND scan_type = %s AND body_part = %s
+        ORDER BY validated_at DESC LIMIT 1
+    """, (uhid, scan_type.upper(), body_part.upper()), upload_folder)
+
+def is_fresh(entry):
+    return entry['age_s'] < RADIOLOGY_CACHE_CONFIG['fresh_seconds']
+
+def conditional_headers(entry):
+    """If-None-Match / If-Modified-Since headers that revalidate a cached scan."""
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def as_stored(entry):
+    """The cached file as the dict file_storage returns for a stored file."""
+    return {
+        'path': entry['image_filename'],
+        'sha256': entry['content_sha256'],
+        'size': entry['size_bytes'],
+        'original_filename': entry['original_filename'],
+        'deduplicated': True,
+    }
+
+def _execute(query, params):
+    try:
+        with db_pool.connection() as db_conn:
+            with db_conn.cursor() as cursor:
+                cursor.execute(query, params)
+            db_conn.commit()
+    except psycopg2.Error as e:
+        logging.error(f"Radiology cache update failed: {e}")
+
+def reuse(entry, outcome):
+    """
+    Counts a scan served from the cache: 'fresh' (not asked) or 'not_modified'
+    (revalidated with a 304). Returns the stored-file dict.
+    """
+    request_metrics.RADIOLOGY_CACHE.inc(1, outcome)
+    _execute(f"""
+        UPDATE RadiologyScanCache
+        SET hits = hits + 1{', validated_at = NOW()' if outcome == 'not_modified' else ''}
+        WHERE scan_id = %s
+    """, (entry['scan_id'],))
+    return as_stored(entry)
+
+def remember(scan_id, stored, response_headers, uhid=None, scan_type=None, body_part=None, outcome='miss'):
+    """
+    Records a scan just downloaded into the store (outcome 'miss', or 'changed' when a
+    cached copy was out of date), with the validators from its response headers.
+    """
+    request_metrics.RADIOLOGY_CACHE.inc(1, outcome)
+    if not RADIOLOGY_CACHE_CONFIG['enabled']:
+        return
+    _execute("""
+        INSERT INTO RadiologyScanCache (scan_id, uhid, scan_type, body_part, image_filename, content_sha256,
+                                        size_bytes, original_filename, etag, last_modified)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (scan_id) DO UPDATE SET
+            uhid = COALESCE(EXCLUDED.uhid, RadiologyScanCache.uhid),
+            scan_type = COALESCE(EXCLUDED.scan_type, RadiologyScanCache.scan_type),
+            body_part = COALESCE(EXCLUDED.body_part, RadiologyScanCache.body_part),
+            image_filename = EXCLUDED.image_filename,
+            content_sha256 = EXCLUDED.content_sha256,
+            size_bytes = EXCLUDED.size_bytes,
+            original_filename = EXCLUDED.original_filename,
+            etag = EXCLUDED.etag,
+            last_modified = EXCLUDED.last_modified,
+            fetched_at = NOW(),
+            validated_at = NOW()
+    """, (scan_id, uhid, scan_type and scan_type.upper(), body_part and body_part.upper(), stored['path'],
+          stored['sha256'], stored['size'], stored['original_filename'],
+          response_headers.get('ETag'), response_headers.get('Last-Modified')))
@@ -0,0 +1,280 @@
+# radiology_client.py
+# The one HTTP client for the radiology server (radiology_api.py, radiology_jobs.py).
+#
+# Calls go through a shared requests.Session whose connection pool keeps up to
+# pool_size connections to the server alive, so an order, its status checks and the
+# download reuse one TCP (and TLS) connection instead of opening one each. The
+# session is shared by all threads; when every pooled connection is busy a call
+# waits for one rather than opening more.
+#
+# fan_out() runs a function for several items at once, at most max_parallel at a
+# time - e.g. the scans of one order, each submitted, polled and downloaded in its
+# own thread. Every call is timed: per operation in stats() (count, errors and
+# latency percentiles, in milliseconds) and in the
+# dermosys_radiology_http_duration_seconds histogram of /metrics (request_metrics.py).
+#
+# A circuit breaker guards the server. Calls that fail to connect, time out, answer
+# 5xx or take longer than slow_call_s to answer are failures (an answer the caller
+# itself refuses, by raising ResponseRejected, is not); once they make up
+# failure_rate of the last `window` calls the breaker opens, and for open_seconds
+# every call raises RadiologyUnavailable at once instead of waiting on the server.
+# Then one probe call is let through (half-open): success closes the breaker,
+# failure opens it again. Job workers put their jobs off while it is open, and the
+# patient page shows that the server is unavailable. Each process has its own.
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import request_metrics
+
+RADIOLOGY_CLIENT_CONFIG = {
+    'pool_size': 10,          # keep-alive connections to the radiology server; >= the job workers
+    'max_parallel': 4,        # items fan_out() handles at once
+    'connect_timeout': 5.0,   # seconds to establish a connection (read timeouts are per call)
+}
+
+RADIOLOGY_BREAKER_CONFIG = {
+    'window': 20,             # most recent calls the failure rate is taken over
+    'min_calls': 5,           # calls needed in the window before the breaker can open
+    'failure_rate': 0.5,      # share of failed calls that opens the breaker
+    'slow_call_s': 10.0,      # a call whose response headers take longer counts as failed
+    'open_seconds': 30.0,     # calls fail at once for this long, then one probe is let through
+}
+
+LATENCY_SAMPLES = 1024
+PROBE_WAIT_S = 1.0  # retry_in reported to other calls while the half-open probe is in flight
+
+
+class RadiologyUnavailable(requests.ConnectionError):
+    """Raised instead of calling the radiology server while the circuit breaker is open."""
+
+    def __init__(self, retry_in):
+        when = f"in {retry_in:.0f}s" if retry_in >= 1 else "shortly"
+        super().__init__(f"The radiology server is unavailable; it will be tried again {when}.")
+        self.retry_in = retry_in
+
+
+class ResponseRejected(requests.RequestException):
+    """
+    Raised by callers for a response they refuse themselves (too large, checksum
+    mismatch, ...); the server answered, so the circuit breaker does not count it.
+    """
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker: closed, open (fail fast) and half-open (one probe)."""
+
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, slow_call_s=10.0, open_seconds=30.0):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_s = slow_call_s
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True for each successful call
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._probing = False
+        self._counters = {'opened': 0, 'rejected': 0}
+
+    def before_call(self):
+        """Raises RadiologyUnavailable unless a call may go to the server now."""
+        with self._lock:
+            if self._state == 'closed':
+                return
+            now = time.monotonic()
+            if self._state == 'open' and now - self._opened_at >= self.open_seconds:
+                self._state = 'half_open'
+            if self._state == 'half_open' and not self._probing:
+                self._probing = True
+                return
+            self._counters['rejected'] += 1
+            retry_in = self._retry_in_locked(now)
+        raise RadiologyUnavailable(retry_in)
+
+    def record(self, ok):
+        """Records the outcome of a call that before_call() let through."""
+        with self._lock:
+            if self._state == 'half_open':
+                self._probing = False
+                if ok:
+                    self._state = 'closed'
+                    self._outcomes.clear()
+                    logging.info("Radiology server is reachable again; circuit breaker closed.")
+                else:
+                    self._open_locked()
+                return
+            if self._state == 'open':
+                return  # a call that started before the breaker opened
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._open_locked()
+
+    def _open_locked(self):
+        self._state = 'open'
+        self._opened_at = time.monotonic()
+        self._counters['opened'] += 1
+        logging.warning(f"Radiology server failing; circuit breaker open, calls fail at once "
+                        f"for {self.open_seconds:.0f}s.")
+
+    def _retry_in_locked(self, now):
+        if self._state == 'half_open' and self._probing:
+            return PROBE_WAIT_S  # the open window is over, but until the probe ends calls are refused
+        return max(0.0, self._opened_at + self.open_seconds - now)
+
+    def unavailable_for(self):
+        """Seconds until a call may be tried again (0.0 when calls go through now)."""
+        with self._lock:
+            if self._state == 'closed' or (self._state == 'half_open' and not self._probing):
+                return 0.0
+            return self._retry_in_locked(time.monotonic())
+
+    def status(self):
+        retry_in = self.unavailable_for()
+        with self._lock:
+            calls = len(self._outcomes)
+            state = 'half_open' if self._state == 'open' and not retry_in else self._state
+            return {
+                'state': state,
+                'retry_in_s': round(retry_in, 1),
+                'failure_rate': round(self._outcomes.count(False) / calls, 3) if calls else 0.0,
+                'window_calls': calls,
+                **self._counters,
+            }
+
+
+class RadiologyClient:
+    """Keep-alive HTTP session with a circuit breaker and per-operation latency statistics."""
+
+    def __init__(self, pool_size=10, max_parallel=4, connect_timeout=5.0, breaker=None):
+        self.pool_size = pool_size
+        self.max_parallel = max_parallel
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._operations = {}  # operation -> {'calls', 'errors', 'total', 'max', 'samples'}
+
+    @contextmanager
+    def call(self, operation, method, url, timeout=30, **kwargs):
+        """
+        Sends one request and yields the response; the with-block (reading a
+        streamed body included) is timed as `operation`, e.g. 'status'.
+        Raises requests.RequestException on connection errors, and
+        RadiologyUnavailable at once while the circuit breaker is open.
+        ResponseRejected raised in the with-block does not count as a server failure.
+        """
+        try:
+            self.breaker.before_call()
+        except RadiologyUnavailable:
+            request_metrics.RADIOLOGY_REJECTED.inc(1, operation)
+            raise
+        started = time.perf_counter()
+        ok = False
+        server_ok = False
+        try:
+            with request_metrics.radiology_call(operation), \
+                    self._session.request(method, url, timeout=(self.connect_timeout, timeout), **kwargs) as response:
+                server_ok = response.status_code < 500 and time.perf_counter() - started <= self.breaker.slow_call_s
+                yield response
+            ok = True
+        except ResponseRejected:
+            raise
+        except requests.RequestException:
+            server_ok = False  # includes a body transfer that broke off
+            raise
+        finally:
+            self.breaker.record(server_ok)
+            self._record(operation, time.perf_counter() - started, ok)
+
+    def fan_out(self, fn, items):
+        """
+        Calls fn(item) for every item, at most max_parallel at a time. Returns a
+        (result, exception, seconds) tuple per item, in the order of `items`.
+        """
+        items = list(items)
+        if not items:
+            return []
+
+        def timed(item):
+            started = time.perf_counter()
+            try:
+                return fn(item), None, time.perf_counter() - started
+            except Exception as e:
+                return None, e, time.perf_counter() - started
+
+        # Each thread runs in a copy of the caller's context, so the calls count
+        # towards the current request's radiology time.
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(items)),
+                                thread_name_prefix="radiology-fan-out") as executor:
+            futures = [executor.submit(contextvars.copy_context().run, timed, item) for item in items]
+            return [future.result() for future in futures]
+
+    def _record(self, operation, elapsed, ok):
+        logging.debug(f"Radiology {operation} call took {elapsed * 1000:.1f} ms{'' if ok else ' (failed)'}")
+        with self._lock:
+            entry = self._operations.get(operation)
+            if entry is None:
+                entry = self._operations[operation] = {'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                                                       'samples': deque(maxlen=LATENCY_SAMPLES)}
+            entry['calls'] += 1
+            entry['errors'] += 0 if ok else 1
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['samples'].append(elapsed)
+
+    def stats(self):
+        """Returns the client settings, breaker state and per-operation call latency (milliseconds)."""
+        with self._lock:
+            operations = {name: (entry['calls'], entry['errors'], entry['total'], entry['max'],
+                                 sorted(entry['samples']))
+                          for name, entry in self._operations.items()}
+        snapshot = {'pool_size': self.pool_size, 'max_parallel': self.max_parallel,
+                    'breaker': self.breaker.status(), 'operations': {}}
+        for name, (calls, errors, total, longest, samples) in sorted(operations.items()):
+            entry = {'calls': calls, 'errors': errors,
+                     'ms_avg': round(total / calls * 1000, 3), 'ms_max': round(longest * 1000, 3)}
+            for label, q in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+                entry[f'ms_{label}'] = round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+            snapshot['operations'][name] = entry
+        return snapshot
+
+
+# --- Module-level shared client ---
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RadiologyClient(breaker=CircuitBreaker(**RADIOLOGY_BREAKER_CONFIG),
+                                          **RADIOLOGY_CLIENT_CONFIG)
+    return _client
+
+
+def stats():
+    return get_client().stats()
+
+
+def server_status():
+    """The circuit breaker's view of the radiology server, for the patient page."""
+    return get_client().breaker.status()
+
+
+def unavailable_for():
+    """Seconds the radiology server is still considered down (0.0 when it may be called)."""
+    return get_client().breaker.unavailable_for()
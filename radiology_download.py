@@ -0,0 +1,230 @@
+# radiology_download.py
+# Downloads of scans from the radiology server into the file store (file_storage.py).
+#
+# A CT or MR study can run to hundreds of megabytes, and a transfer that breaks off
+# must never end up in the gallery as a truncated .dcm. A download therefore:
+#   - is written to a temporary file in uploads/tmp and only renamed into the store
+#     once it is complete; a failed one leaves nothing behind;
+#   - must have exactly the size the server announced (Content-Length or
+#     Content-Range; a partial answer that does not name the full size is
+#     refused), must match the SHA-256 digest when the server sends one
+#     (Repr-Digest, or the older Digest header), and may not exceed max_bytes;
+#   - is resumed with a Range request where it broke off, when the server accepts
+#     ranges, up to resume_attempts times per part. If-Range (the strong ETag, or
+#     Last-Modified) makes sure every piece comes from the same version of the scan;
+#   - is fetched in part_bytes pieces, several at once (at most
+#     RADIOLOGY_CLIENT_CONFIG['max_parallel'], see radiology_client.fan_out()),
+#     when it is larger than one part and the server accepts ranges.
+# The first request asks for the first part only. A server without range support
+# answers it with the whole scan, which is then streamed in one piece.
+#
+# Compare the modes against the fake radiology server with
+#     python -m benchmarks.radiology_download_benchmark
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+
+import requests
+
+import file_storage
+import radiology_client
+
+RADIOLOGY_DOWNLOAD_CONFIG = {
+    'chunk_size': 1024 * 1024,        # bytes read from the network and written at a time
+    'part_bytes': 8 * 1024 * 1024,    # a larger scan is fetched in ranges of this size
+    'parallel': True,                 # fetch the ranges of a scan side by side
+    'resume_attempts': 3,             # Range requests that continue a part that broke off
+    'max_bytes': 4 * 1024 ** 3,       # larger scans are refused
+    'timeout': 30,                    # read timeout per request, in seconds
+}
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+DIGEST_HEADERS = (
+    ('Repr-Digest', re.compile(r'sha-256=:([A-Za-z0-9+/=]+):', re.IGNORECASE)),  # RFC 9530
+    ('Digest', re.compile(r'sha-256=([A-Za-z0-9+/=]+)', re.IGNORECASE)),         # RFC 3230
+)
+
+
+class DownloadError(radiology_client.ResponseRejected):
+    """A download that is incomplete, too large or does not match its checksum."""
+
+
+class _Part:
+    """Bytes start..end (inclusive; end None: up to the end) of a download, written into the temp file."""
+
+    def __init__(self, path, start, end):
+        self.path, self.start, self.end = path, start, end
+        self.position = start
+
+    @property
+    def done(self):
+        return self.end is not None and self.position > self.end
+
+    def write(self, response):
+        with open(self.path, 'r+b') as out:
+            out.seek(self.position)
+            for chunk in response.iter_content(RADIOLOGY_DOWNLOAD_CONFIG['chunk_size']):
+                if self.end is not None and self.position + len(chunk) > self.end + 1:
+                    raise DownloadError(f"The server sent more than bytes {self.start}-{self.end}.")
+                if self.position + len(chunk) > RADIOLOGY_DOWNLOAD_CONFIG['max_bytes']:
+                    raise DownloadError("The scan is larger than RADIOLOGY_DOWNLOAD_CONFIG['max_bytes'].")
+                out.write(chunk)
+                self.position += len(chunk)
+
+
+def _extent(response):
+    """(first byte, last byte, full size) of a 200 or 206 answer; None where unknown."""
+    if response.status_code == 206:
+        match = CONTENT_RANGE.fullmatch(response.headers.get('Content-Range', '').strip())
+        if not match:
+            raise DownloadError(f"Unusable Content-Range: {response.headers.get('Content-Range')!r}")
+        total = None if match.group(3) == '*' else int(match.group(3))
+        return int(match.group(1)), int(match.group(2)), total
+    length = response.headers.get('Content-Length')
+    if length is None or not length.isdigit():
+        return 0, None, None
+    return 0, int(length) - 1, int(length)
+
+def _validator(headers):
+    """The If-Range value for later pieces of this scan, or None (weak ETags are not allowed there)."""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+def announced_sha256(headers):
+    """The SHA-256 digest (hex) the server sent for the whole scan, if any."""
+    for name, pattern in DIGEST_HEADERS:
+        match = pattern.search(headers.get(name, ''))
+        if match:
+            try:
+                return base64.b64decode(match.group(1), validate=True).hex()
+            except (binascii.Error, ValueError):
+                return None
+    return None
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(RADIOLOGY_DOWNLOAD_CONFIG['chunk_size']), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _check_size(total):
+    if total is not None and total > RADIOLOGY_DOWNLOAD_CONFIG['max_bytes']:
+        raise DownloadError(f"The scan is {total} bytes, more than RADIOLOGY_DOWNLOAD_CONFIG['max_bytes'].")
+
+def _finish(temp_path, total, headers, original_filename, upload_folder):
+    """Verifies the complete temp file and moves it into the store."""
+    size = os.path.getsize(temp_path)
+    if total is not None and size != total:
+        raise DownloadError(f"Received {size} of {total} bytes.")
+    sha256 = _file_sha256(temp_path)
+    expected = announced_sha256(headers)
+    if expected and expected != sha256:
+        raise DownloadError(f"Checksum mismatch: the server announced {expected}, received {sha256}.")
+    return file_storage.store_temp_file(temp_path, sha256, size, original_filename, upload_folder)
+
+def _fetch_part(client, url, part, validator):
+    """Fetches the rest of a part with Range requests, continuing where each one broke off."""
+    for _ in range(RADIOLOGY_DOWNLOAD_CONFIG['resume_attempts']):
+        headers = {'Range': f"bytes={part.position}-{part.end}"}
+        if validator:
+            headers['If-Range'] = validator
+        try:
+            with client.call('download_range', 'GET', url, headers=headers, stream=True,
+                             timeout=RADIOLOGY_DOWNLOAD_CONFIG['timeout']) as r:
+                if r.status_code != 206 or _extent(r)[0] != part.position:
+                    raise DownloadError(f"Range request for bytes {part.position}-{part.end} was answered "
+                                        f"with {r.status_code}; the scan may have changed meanwhile.")
+                part.write(r)
+        except (DownloadError, radiology_client.RadiologyUnavailable):
+            raise
+        except requests.RequestException as e:
+            logging.warning(f"Download of {url} broke off at byte {part.position}: {e}")
+        if part.done:
+            return
+    raise DownloadError(f"Download of {url} stopped at byte {part.position} of bytes {part.start}-{part.end}.")
+
+def download(url, original_filename, upload_folder=file_storage.UPLOAD_FOLDER, headers=None):
+    """
+    Downloads a scan into the file store. `headers` are sent with the first request,
+    e.g. radiology_cache.conditional_headers(). Returns (stored, response): the
+    file_storage dict, or None when the server did not answer 200/206 (e.g. 304 or
+    404), and the first response, whose status and headers stay readable.
+    Raises requests.RequestException, or DownloadError for a scan that could not be
+    fetched completely and intact.
+    """
+    config = RADIOLOGY_DOWNLOAD_CONFIG
+    client = radiology_client.get_client()
+    fd, temp_path = file_storage.new_temp_file(upload_folder)
+    os.close(fd)
+    try:
+        response, part, total = None, None, None
+        first_headers = dict(headers or {}, Range=f"bytes=0-{config['part_bytes'] - 1}")
+        try:
+            with client.call('download', 'GET', url, headers=first_headers, stream=True,
+                             timeout=config['timeout']) as r:
+                response = r
+                if r.status_code in (200, 206):
+                    start, end, total = _extent(r)
+                    if start != 0:
+                        raise DownloadError(f"Asked for the start of the scan, got bytes from {start}.")
+                    if r.status_code == 206 and total is None:
+                        # Without the full size, the rest of the scan could not be fetched or checked.
+                        raise DownloadError("The server answered with part of the scan but not its size.")
+                    _check_size(total)
+                    part = _Part(temp_path, 0, end)
+                    part.write(r)
+        except (DownloadError, radiology_client.RadiologyUnavailable):
+            raise
+        except requests.RequestException as e:
+            if part is None or part.end is None:  # not started, or of unknown length: cannot resume
+                raise
+            logging.warning(f"Download of {url} broke off at byte {part.position}: {e}")
+        if part is None:
+            return None, response
+
+        resumable = (response.status_code == 206 or response.headers.get('Accept-Ranges') == 'bytes')
+        validator = _validator(response.headers)
+        if not part.done and part.end is not None:
+            if not resumable:
+                raise DownloadError(f"Download of {url} broke off at byte {part.position} of {total}.")
+            _fetch_part(client, url, part, validator)
+
+        if total is not None and part.end is not None and total > part.end + 1:
+            rest = [_Part(temp_path, start, min(start + config['part_bytes'], total) - 1)
+                    for start in range(part.end + 1, total, config['part_bytes'])]
+            with open(temp_path, 'r+b') as out:
+                out.truncate(total)
+            if config['parallel'] and len(rest) > 1:
+                for _, error, _ in client.fan_out(lambda p: _fetch_part(client, url, p, validator), rest):
+                    if error is not None:
+                        raise error
+            else:
+                for p in rest:
+                    _fetch_part(client, url, p, validator)
+
+        return _finish(temp_path, total, response.headers, original_filename, upload_folder), response
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def store_response(response, original_filename, upload_folder=file_storage.UPLOAD_FOLDER):
+    """
+    Stores the body of a streaming 200 answer that cannot be asked for again in ranges
+    (the scan an order was answered with), checked like download().
+    """
+    fd, temp_path = file_storage.new_temp_file(upload_folder)
+    os.close(fd)
+    try:
+        _, end, total = _extent(response)
+        _check_size(total)
+        _Part(temp_path, 0, end).write(response)
+        return _finish(temp_path, total, response.headers, original_filename, upload_folder)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
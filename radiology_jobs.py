@@ -0,0 +1,420 @@
+# radiology_jobs.py
+# Background execution of radiology orders.
+# request_investigation stores a RadiologyJob row (migration 0007) and returns at once.
+# A small pool of worker threads claims due jobs with FOR UPDATE SKIP LOCKED and runs
+# a single step per claim: submit the order, or ask the radiology server once whether
+# the scan is ready. A job that is still waiting is rescheduled through
+# next_attempt_at rather than sleeping in a thread, so a handful of workers can follow
+# many orders, and no web worker is ever held while polling. A claim is renewed while
+# its step runs (a long download, say); should it go stale all the same and another
+# worker take the job over, the first one's outcome is dropped. An order of several
+# scans becomes one job per scan, run side by side; all HTTP calls share the
+# keep-alive connections of radiology_client.py. While its circuit breaker finds the
+# server down, due jobs are put off until the breaker lets a probe through.
+#
+# Status checks back off exponentially. With completion callbacks configured
+# (radiology_api.RADIOLOGY_CALLBACK_CONFIG) the radiology server announces a ready
+# scan itself: the callback makes the job due and the download starts right away,
+# and status checks are only a rare safety net for lost callbacks.
+#
+# The web app starts the workers in-process on its first request (see JOB_CONFIG).
+# They can also run as a separate process, e.g. when the web server forks many workers:
+#     python radiology_jobs.py
+import argparse
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.extras
+import requests
+
+import db_pool
+import radiology_api
+import radiology_client
+
+JOB_CONFIG = {
+    'workers': 4,               # concurrent job steps per process; 0 disables in-process workers
+    'dispatch_interval': 1.0,   # seconds between looks for due jobs when idle
+    'poll_interval': 3.0,       # seconds before the first status check of an accepted order
+    'poll_backoff': 2.0,        # each further check waits this many times longer...
+    'max_poll_interval': 30.0,  # ...up to this
+    'callback_poll_interval': 120.0,  # with completion callbacks, checks are only a safety net this rare
+    'poll_timeout': 300.0,      # give up on an accepted order after this long
+    'max_attempts': 5,          # connection failures tolerated before a job fails
+    'retry_backoff': 10.0,      # seconds, doubled per failed attempt
+    'stale_lock_after': 120.0,  # a claimed job whose worker vanished is reclaimed after this;
+                                # a runner refreshes the locks of its running steps 4x as often
+}
+
+ACTIVE_STATUSES = ('queued', 'polling')
+
+JOB_COLUMNS = """
+    id, patient_id, requested_by, uhid, scan_type, body_part, status, remote_request_id,
+    remote_scan_id, polls, image_filename, error, attempts, created_at, updated_at,
+    next_attempt_at, poll_deadline_at
+"""
+
+
+# --- Queue ---
+def enqueue_job(db_conn, patient_id, uhid, scan_type, body_part, requested_by=None):
+    """Stores a new radiology order and returns its job id. Commits."""
+    return enqueue_jobs(db_conn, patient_id, uhid, [(scan_type, body_part)], requested_by)[0]
+
+def enqueue_jobs(db_conn, patient_id, uhid, scans, requested_by=None):
+    """
+    Stores one job per (scan_type, body_part) of an order in a single INSERT and
+    returns their ids. The jobs are due at once, so the workers run them side by side.
+    Commits.
+    """
+    with db_conn.cursor() as cursor:
+        rows = psycopg2.extras.execute_values(cursor, """
+            INSERT INTO RadiologyJob (patient_id, requested_by, uhid, scan_type, body_part)
+            VALUES %s
+            RETURNING id
+        """, [(patient_id, requested_by, uhid, scan_type, body_part) for scan_type, body_part in scans],
+            page_size=len(scans), fetch=True)
+    db_conn.commit()
+    wake_workers()
+    return [row[0] for row in rows]
+
+def get_job(cursor, job_id):
+    cursor.execute(f"SELECT {JOB_COLUMNS} FROM RadiologyJob WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def list_patient_jobs(cursor, patient_id, limit=10):
+    """Most recent jobs of a patient, newest first."""
+    cursor.execute(f"""
+        SELECT {JOB_COLUMNS} FROM RadiologyJob
+        WHERE patient_id = %s
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, (patient_id, limit))
+    return [dict(row) for row in cursor.fetchall()]
+
+def job_to_json(job):
+    """JSON-ready copy of a job row (timestamps as ISO strings)."""
+    data = {key: (value.isoformat() if hasattr(value, 'isoformat') else value)
+            for key, value in job.items()}
+    data['active'] = job['status'] in ACTIVE_STATUSES
+    return data
+
+def claim_due_jobs(db_conn, worker_id, limit):
+    """Locks up to `limit` due jobs for this worker and returns them."""
+    with db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.execute(f"""
+            UPDATE RadiologyJob SET locked_by = %s, locked_at = NOW()
+            WHERE id IN (
+                SELECT id FROM RadiologyJob
+                WHERE status IN ('queued', 'polling')
+                  AND next_attempt_at <= NOW()
+                  AND (locked_at IS NULL OR locked_at < NOW() - make_interval(secs => %s))
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {JOB_COLUMNS}, locked_by, COALESCE(poll_deadline_at <= NOW(), FALSE) AS poll_expired
+        """, (worker_id, JOB_CONFIG['stale_lock_after'], limit))
+        jobs = [dict(row) for row in cursor.fetchall()]
+    db_conn.commit()
+    return jobs
+
+def refresh_locks(db_conn, worker_id, job_ids):
+    """Renews this worker's locks on jobs whose steps are still running, so they do not go stale. Commits."""
+    with db_conn.cursor() as cursor:
+        cursor.execute("UPDATE RadiologyJob SET locked_at = NOW() WHERE id = ANY(%s) AND locked_by = %s",
+                       (list(job_ids), worker_id))
+    db_conn.commit()
+
+def _write_job(db_conn, job, retry_in=None, poll_deadline_in=None, unless_announced=False, **fields):
+    """
+    Writes the outcome of a step and releases the job's lock (without committing).
+    `retry_in` reschedules the job that many seconds from now - or, with
+    `unless_announced`, at once if a completion callback stored the scan id
+    meanwhile; `poll_deadline_in` sets its polling deadline. Only writes while the
+    worker that claimed the job still holds it; returns False (and writes nothing)
+    when its lock went stale and another worker took the job over.
+    """
+    assignments = [f"{column} = %s" for column in fields]
+    params = list(fields.values())
+    if retry_in is not None and unless_announced:
+        assignments.append("next_attempt_at = CASE WHEN remote_scan_id IS NULL "
+                           "THEN NOW() + make_interval(secs => %s) ELSE NOW() END")
+        params.append(retry_in)
+    elif retry_in is not None:
+        assignments.append("next_attempt_at = NOW() + make_interval(secs => %s)")
+        params.append(retry_in)
+    if poll_deadline_in is not None:
+        assignments.append("poll_deadline_at = NOW() + make_interval(secs => %s)")
+        params.append(poll_deadline_in)
+    with db_conn.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE RadiologyJob
+            SET {", ".join(assignments + ["updated_at = NOW()", "locked_by = NULL", "locked_at = NULL"])}
+            WHERE id = %s AND locked_by = %s
+        """, tuple(params) + (job['id'], job['locked_by']))
+        written = cursor.rowcount > 0
+    if not written:
+        logging.warning(f"Radiology job {job['id']} is no longer locked by {job['locked_by']}; "
+                        f"dropped the outcome of its step.")
+    return written
+
+def _update_job(job, **kwargs):
+    with db_pool.connection() as db_conn:
+        _write_job(db_conn, job, **kwargs)
+        db_conn.commit()
+
+def apply_callback(db_conn, remote_request_id, status, scan_id=None):
+    """
+    Applies a completion callback to the job waiting on `remote_request_id`: a ready
+    scan makes it due at once (the worker downloads it without a status check), a
+    failed request fails it. Returns the job id, or None when no job is waiting on
+    that request. Commits.
+    """
+    with db_conn.cursor() as cursor:
+        if status in radiology_api.READY_STATUSES and scan_id:
+            cursor.execute("""
+                UPDATE RadiologyJob SET remote_scan_id = %s, next_attempt_at = NOW(), updated_at = NOW()
+                WHERE remote_request_id = %s AND status = 'polling'
+                RETURNING id
+            """, (scan_id, remote_request_id))
+        elif status in radiology_api.FAILED_STATUSES:
+            cursor.execute("""
+                UPDATE RadiologyJob SET status = 'failed', error = %s, updated_at = NOW(),
+                                        locked_by = NULL, locked_at = NULL
+                WHERE remote_request_id = %s AND status = 'polling'
+                RETURNING id
+            """, (f"The radiology server reported the request as {status}.", remote_request_id))
+        else:
+            cursor.execute("SELECT id FROM RadiologyJob WHERE remote_request_id = %s AND status = 'polling'",
+                           (remote_request_id,))
+        row = cursor.fetchone()
+    db_conn.commit()
+    if row and status in radiology_api.READY_STATUSES:
+        wake_workers()
+    return row[0] if row else None
+
+def next_poll_in(polls):
+    """
+    Seconds until the next status check of an accepted order that was checked
+    `polls` times: backing off exponentially, and with completion callbacks only
+    a rare safety net. Jittered so that orders submitted together spread out.
+    """
+    interval = min(JOB_CONFIG['poll_interval'] * JOB_CONFIG['poll_backoff'] ** polls, JOB_CONFIG['max_poll_interval'])
+    if radiology_api.callbacks_enabled():
+        interval = max(interval, JOB_CONFIG['callback_poll_interval'])
+    return interval * random.uniform(0.9, 1.1)
+
+
+# --- Job steps ---
+def _complete(job, stored):
+    # The gallery record and the job status are committed together, so a crash
+    # in between cannot add the scan twice when the job is retried; a worker that
+    # lost the job to another one adds nothing.
+    with db_pool.connection() as db_conn:
+        if not _write_job(db_conn, job, status='completed', image_filename=stored['path'], error=None):
+            db_conn.rollback()
+            return
+        radiology_api.record_scan_image(db_conn, job['patient_id'], stored, job['scan_type'], job['body_part'],
+                                        commit=False)
+        db_conn.commit()
+
+def _fail(job, message):
+    logging.error(f"Radiology job {job['id']} failed: {message}")
+    _update_job(job, status='failed', error=message)
+
+def _retry_or_fail(job, message):
+    attempts = job['attempts'] + 1
+    if attempts >= JOB_CONFIG['max_attempts']:
+        _fail(job, f"{message} (after {attempts} attempts)")
+    else:
+        _update_job(job, retry_in=JOB_CONFIG['retry_backoff'] * 2 ** (attempts - 1),
+                    attempts=attempts, error=message)
+
+def _defer(job, retry_in):
+    """Puts a job off while the circuit breaker refuses calls, without using up an attempt."""
+    _update_job(job, retry_in=max(retry_in, JOB_CONFIG['dispatch_interval']))
+
+def _submit(job):
+    try:
+        kind, value = radiology_api.submit_radiology_request(
+            job['patient_id'], job['uhid'], job['scan_type'], job['body_part'])
+    except radiology_client.RadiologyUnavailable as e:
+        _defer(job, e.retry_in)
+        return
+    except requests.RequestException as e:
+        _retry_or_fail(job, f"Request error: {e}")
+        return
+    if kind == 'file':
+        _complete(job, value)
+    elif kind == 'accepted':
+        _update_job(job, retry_in=next_poll_in(0), poll_deadline_in=JOB_CONFIG['poll_timeout'],
+                    status='polling', remote_request_id=value, error=None)
+    else:
+        _fail(job, value)
+
+def _poll(job):
+    if job['poll_expired']:
+        _fail(job, "Polling timed out.")
+        return
+    scan_id = job['remote_scan_id']  # announced by a completion callback
+    if not scan_id:
+        try:
+            scan_id = radiology_api.check_request_status(radiology_api.RADIOLOGY_API_HOST, job['remote_request_id'])
+        except radiology_client.RadiologyUnavailable as e:
+            _defer(job, e.retry_in)
+            return
+        except (requests.RequestException, ValueError):
+            scan_id = None  # connection errors and bad replies just mean "ask again later"
+    if not scan_id:
+        _update_job(job, retry_in=next_poll_in(job['polls'] + 1), unless_announced=True, polls=job['polls'] + 1)
+        return
+    try:
+        stored = radiology_api.fetch_scan_file(radiology_api.RADIOLOGY_API_HOST, scan_id,
+                                               job['patient_id'], job['scan_type'], job['body_part'], job['uhid'])
+    except radiology_client.RadiologyUnavailable as e:
+        _defer(job, e.retry_in)
+        return
+    if stored:
+        _complete(job, stored)
+    else:
+        _retry_or_fail(job, "The final download failed.")
+
+def run_job_step(job):
+    """Advances one claimed job by a single step; never raises."""
+    try:
+        # While the circuit breaker is open (or its probe is still out) the server is
+        # not called at all: the job waits without using up one of its attempts. A
+        # call refused because the breaker opened meanwhile is deferred the same way.
+        unavailable_for = radiology_client.unavailable_for()
+        if unavailable_for:
+            _defer(job, unavailable_for)
+            return
+        if job['status'] == 'queued':
+            _submit(job)
+        elif job['status'] == 'polling':
+            _poll(job)
+    except Exception as e:
+        logging.error(f"Radiology job {job['id']} step failed: {e}")
+        try:
+            _retry_or_fail(job, f"Internal error: {e}")
+        except psycopg2.Error:
+            pass  # the lock goes stale and another worker picks the job up
+
+
+# --- Worker pool ---
+class JobRunner:
+    """Dispatcher thread feeding claimed jobs into a bounded thread pool."""
+
+    def __init__(self, workers, dispatch_interval):
+        self.workers = workers
+        self.dispatch_interval = dispatch_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="radiology-job")
+        self._slots = threading.Semaphore(workers)
+        self._running = set()  # ids of the jobs whose steps are running
+        self._running_lock = threading.Lock()
+        self._locks_refreshed = time.monotonic()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._dispatch_loop, name="radiology-job-dispatch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self, job):
+        with self._running_lock:
+            self._running.add(job['id'])
+        try:
+            run_job_step(job)
+        finally:
+            with self._running_lock:
+                self._running.discard(job['id'])
+            self._slots.release()
+            self._wake.set()  # a slot is free again and the job may already be due
+
+    def _refresh_locks(self):
+        """Keeps long steps (a large download, say) from having their job reclaimed by another worker."""
+        if time.monotonic() - self._locks_refreshed < JOB_CONFIG['stale_lock_after'] / 4:
+            return
+        self._locks_refreshed = time.monotonic()
+        with self._running_lock:
+            running = list(self._running)
+        if running:
+            try:
+                with db_pool.connection() as db_conn:
+                    refresh_locks(db_conn, self.worker_id, running)
+            except psycopg2.Error as e:
+                logging.error(f"Could not refresh radiology job locks: {e}")
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self._refresh_locks()
+            free = 0
+            while self._slots.acquire(blocking=False):
+                free += 1
+            jobs = []
+            if free:
+                try:
+                    with db_pool.connection() as db_conn:
+                        jobs = claim_due_jobs(db_conn, self.worker_id, free)
+                except psycopg2.Error as e:
+                    logging.error(f"Could not claim radiology jobs: {e}")
+            for _ in range(free - len(jobs)):
+                self._slots.release()
+            for job in jobs:
+                self._executor.submit(self._run, job)
+            if not jobs or len(jobs) < free:
+                self._wake.wait(self.dispatch_interval)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def start_workers(workers=None):
+    """Starts this process's job runner once. Returns it, or None if disabled."""
+    global _runner
+    workers = JOB_CONFIG['workers'] if workers is None else workers
+    if workers <= 0:
+        return None
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(workers, JOB_CONFIG['dispatch_interval'])
+            _runner.start()
+    return _runner
+
+def wake_workers():
+    """Lets a local runner pick up a freshly queued job without waiting for its next tick."""
+    if _runner is not None:
+        _runner.wake()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run radiology order jobs.")
+    parser.add_argument("--workers", type=int, default=max(JOB_CONFIG['workers'], 1),
+                        help="concurrent job steps (default: %(default)s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    runner = start_workers(args.workers)
+    logging.info(f"Radiology job worker {runner.worker_id} running with {args.workers} workers.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.stop()
@@ -0,0 +1,368 @@
+# request_metrics.py
+# Per-request performance instrumentation, exported at /metrics in the Prometheus
+# text format (admins only, or a scraper sending METRICS_CONFIG['scrape_token']).
+#
+# Pooled connections (db_pool.py) are InstrumentedConnections: every cursor they
+# hand out - whatever cursor_factory the caller asks for - times execute(),
+# executemany(), callproc() and COPY. app.py opens a RequestStats for each request
+# and, when the response is ready, records per route:
+#   - request latency, SQL query count and SQL time per request (histograms),
+#   - response size (when the length is known, i.e. not for streamed exports),
+#   - time spent waiting on the radiology server inside the request.
+# Radiology calls are also timed on their own, since most run in the job workers.
+#
+# A request slower than METRICS_CONFIG['slow_request_ms'] is logged with its
+# slowest SQL statements, grouped by text so a query repeated per row shows up
+# as one line with its count. Statements are logged as passed to execute(), so
+# parameter values are not written to the log (multi-row VALUES lists built by
+# execute_values are, up to the truncation length).
+#
+# Metrics live in this process; with several server processes each one has to
+# be scraped.
+import bisect
+import contextvars
+import hmac
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+import psycopg2.sql
+
+METRICS_CONFIG = {
+    'enabled': True,
+    'slow_request_ms': 1000,       # requests at least this slow are logged
+    'slow_request_statements': 10, # statement groups written per slow request
+    'statement_length': 500,       # characters of each statement in the log
+    'scrape_token': None,          # lets a scraper fetch /metrics with "Authorization: Bearer <token>"
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+RADIOLOGY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+MAX_STATEMENT_GROUPS = 200  # distinct statements remembered per request for the slow log
+
+_lock = threading.Lock()
+
+
+# --- Metric types ---
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.buckets = tuple(float(b) for b in buckets)
+        self._series = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+
+    def observe(self, value, *label_values):
+        with _lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            series = sorted((label_values, list(counts), total)
+                            for label_values, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+def _number(value):
+    return str(value) if isinstance(value, int) else repr(round(value, 6))
+
+
+ROUTE_LABELS = ('route', 'method')
+
+REQUESTS = Counter('dermosys_http_requests_total', 'Requests handled, by route and status.',
+                   ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('dermosys_http_request_duration_seconds',
+                            'Time from the start of a request until its response was ready.',
+                            LATENCY_BUCKETS, ROUTE_LABELS)
+REQUEST_QUERIES = Histogram('dermosys_http_request_sql_queries', 'SQL statements executed per request.',
+                            QUERY_COUNT_BUCKETS, ROUTE_LABELS)
+REQUEST_SQL_SECONDS = Histogram('dermosys_http_request_sql_seconds', 'Time spent in SQL statements per request.',
+                                LATENCY_BUCKETS, ROUTE_LABELS)
+RESPONSE_BYTES = Histogram('dermosys_http_response_size_bytes',
+                           'Response body size (responses of known length only).',
+                           RESPONSE_SIZE_BUCKETS, ROUTE_LABELS)
+REQUEST_RADIOLOGY_SECONDS = Counter('dermosys_http_request_radiology_seconds_total',
+                                    'Time requests spent waiting on the radiology server.', ROUTE_LABELS)
+SLOW_REQUESTS = Counter('dermosys_http_slow_requests_total',
+                        'Requests slower than the slow-request threshold.', ROUTE_LABELS)
+RADIOLOGY_SECONDS = Histogram('dermosys_radiology_http_duration_seconds',
+                              'Calls to the radiology server, including the body transfer.',
+                              RADIOLOGY_BUCKETS, ('operation', 'outcome'))
+RADIOLOGY_REJECTED = Counter('dermosys_radiology_rejected_total',
+                             'Radiology calls refused at once because the circuit breaker was open.',
+                             ('operation',))
+RADIOLOGY_CACHE = Counter('dermosys_radiology_cache_total',
+                          'Radiology scans wanted, by how the local scan cache served them '
+                          '(fresh, not_modified, changed, miss).', ('outcome',))
+BACKGROUND_QUERIES = Counter('dermosys_background_sql_queries_total',
+                             'SQL statements executed outside requests (job workers, listeners).')
+BACKGROUND_SQL_SECONDS = Counter('dermosys_background_sql_seconds_total',
+                                 'Time spent in SQL statements outside requests.')
+
+METRICS = (REQUESTS, REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, RESPONSE_BYTES,
+           REQUEST_RADIOLOGY_SECONDS, SLOW_REQUESTS, RADIOLOGY_SECONDS, RADIOLOGY_REJECTED, RADIOLOGY_CACHE,
+           BACKGROUND_QUERIES, BACKGROUND_SQL_SECONDS)
+
+
+# --- Per-request state ---
+class RequestStats:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'radiology_seconds', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.radiology_seconds = 0.0
+        self.statements = {}  # statement -> [count, total seconds]
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+_captured = contextvars.ContextVar('request_metrics_capture', default=None)
+
+
+def _record_query(query, elapsed):
+    captured = _captured.get()
+    if captured is not None:
+        captured.queries += 1
+        captured.sql_seconds += elapsed
+    stats = _current.get()
+    if stats is None:
+        BACKGROUND_QUERIES.inc()
+        BACKGROUND_SQL_SECONDS.inc(elapsed)
+        return
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    group = stats.statements.get(query)
+    if group is not None:
+        group[0] += 1
+        group[1] += elapsed
+    elif len(stats.statements) < MAX_STATEMENT_GROUPS:
+        stats.statements[query] = [1, elapsed]
+
+
+# --- Instrumented connections and cursors ---
+class _TimedCursor:
+    """Mixed in before a cursor class; times the calls that run SQL."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_query(_statement_key(self, query), time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record_query(_statement_key(self, query), time.perf_counter() - started)
+
+    def callproc(self, procname, parameters=None):
+        started = time.perf_counter()
+        try:
+            return super().callproc(procname, parameters)
+        finally:
+            _record_query(f"CALL {procname}", time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _record_query(_statement_key(self, sql), time.perf_counter() - started)
+
+
+_timed_classes = {}
+
+def _timed_cursor_class(cursor_class):
+    timed = _timed_classes.get(cursor_class)
+    if timed is None:
+        timed = _timed_classes[cursor_class] = type(f"Timed{cursor_class.__name__}", (_TimedCursor, cursor_class), {})
+    return timed
+
+def _statement_key(cursor, query):
+    if isinstance(query, psycopg2.sql.Composable):
+        try:
+            return query.as_string(cursor)
+        except (psycopg2.Error, TypeError):
+            return repr(query)
+    return query
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """A connection whose cursors report their SQL to the current request's stats."""
+
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+
+def connection_factory():
+    """The connection class db_pool should open connections with (None: psycopg2's default)."""
+    return InstrumentedConnection if METRICS_CONFIG['enabled'] else None
+
+
+@contextmanager
+def capture_queries():
+    """
+    Counts the SQL run in this thread during the with-block, inside requests or not
+    (e.g. a test-client request including its streamed body). Yields a RequestStats.
+    """
+    stats = RequestStats()
+    token = _captured.set(stats)
+    try:
+        yield stats
+    finally:
+        _captured.reset(token)
+
+
+# --- Outbound radiology calls ---
+@contextmanager
+def radiology_call(operation):
+    """Times a call to the radiology server (the with-block), e.g. radiology_call('status')."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        RADIOLOGY_SECONDS.observe(elapsed, operation, outcome)
+        stats = _current.get()
+        if stats is not None:
+            stats.radiology_seconds += elapsed
+
+
+# --- Request hooks (registered in app.py) ---
+def begin_request():
+    if METRICS_CONFIG['enabled']:
+        _current.set(RequestStats())
+
+def end_request(request, response):
+    """Records the finished request; returns the response unchanged."""
+    stats = _current.get()
+    if stats is None:
+        return response
+    _current.set(None)
+    elapsed = time.perf_counter() - stats.started
+    # The URL rule, not the path, so /patient/1 and /patient/2 share one series.
+    route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    labels = (route, request.method)
+    REQUESTS.inc(1, route, request.method, str(response.status_code))
+    REQUEST_SECONDS.observe(elapsed, *labels)
+    REQUEST_QUERIES.observe(stats.queries, *labels)
+    REQUEST_SQL_SECONDS.observe(stats.sql_seconds, *labels)
+    if response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length, *labels)
+    if stats.radiology_seconds:
+        REQUEST_RADIOLOGY_SECONDS.inc(stats.radiology_seconds, *labels)
+    if elapsed * 1000 >= METRICS_CONFIG['slow_request_ms']:
+        SLOW_REQUESTS.inc(1, *labels)
+        log_slow_request(request, response, route, elapsed, stats)
+    return response
+
+def discard_request():
+    """Drops the stats of a request that ended without a response being recorded."""
+    _current.set(None)
+
+def log_slow_request(request, response, route, elapsed, stats):
+    groups = sorted(stats.statements.items(), key=lambda item: item[1][1], reverse=True)
+    lines = [f"Slow request: {request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+             f"in {elapsed * 1000:.0f} ms (route {route}; {stats.queries} SQL statements, "
+             f"{stats.sql_seconds * 1000:.0f} ms SQL; {stats.radiology_seconds * 1000:.0f} ms radiology)"]
+    for statement, (count, seconds) in groups[:METRICS_CONFIG['slow_request_statements']]:
+        lines.append(f"    {seconds * 1000:8.1f} ms  {count:4d}x  {_statement_text(statement)}")
+    if len(groups) > METRICS_CONFIG['slow_request_statements']:
+        lines.append(f"    ... {len(groups) - METRICS_CONFIG['slow_request_statements']} more distinct statements")
+    logging.warning("\n".join(lines))
+
+def _statement_text(statement):
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8', 'replace')
+    text = re.sub(r'\s+', ' ', str(statement)).strip()
+    limit = METRICS_CONFIG['statement_length']
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+# --- /metrics ---
+def scrape_authorized(request):
+    """True when the request carries the configured scrape token."""
+    token = METRICS_CONFIG['scrape_token']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and header.startswith('Bearer ') and hmac.compare_digest(header[7:], token)
+
+def render(pool_stats=None, read_routing=None):
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4), with the
+    primary pool's statistics and, given db_pool.replica_stats(), the replicas' and
+    how reads were routed.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    pools = ([pool_stats] if pool_stats else []) + (read_routing['replicas'] if read_routing else [])
+    for key, kind, help_text in (
+            ('in_use', 'gauge', 'Connections lent out.'),
+            ('idle', 'gauge', 'Idle connections.'),
+            ('waiting', 'gauge', 'Requests waiting for a connection.'),
+            ('checkouts', 'counter', 'Connections lent out since start.'),
+            ('timeouts', 'counter', 'Checkouts that timed out.')):
+        if not pools:
+            break
+        name = f"dermosys_db_pool_{key}" + ('_total' if kind == 'counter' else '')
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_labels(('pool',), (pool['name'],))} {pool[key]}" for pool in pools]
+    if read_routing:
+        lines += ["# HELP dermosys_db_replica_up Whether the replica is being used (0 while skipped after a failure).",
+                  "# TYPE dermosys_db_replica_up gauge"]
+        lines += [f"dermosys_db_replica_up{_labels(('pool',), (pool['name'],))} {int(pool['up'])}"
+                  for pool in read_routing['replicas']]
+        lines += ["# HELP dermosys_db_reads_total Read-only connections by where they were served: replica, "
+                  "sticky (primary, the session wrote recently) or fallback (primary, no replica available).",
+                  "# TYPE dermosys_db_reads_total counter"]
+        lines += [f"dermosys_db_reads_total{_labels(('target',), (target,))} {count}"
+                  for target, count in sorted(read_routing['reads'].items())]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,131 @@
+# user_activity.py
+# Activity timeline of one user for the dashboard's activity modal.
+# Registrations, visits, prescriptions, logins and logouts are merged by a single
+# UNION ALL query, newest first. Every branch reads only the newest rows it can
+# contribute to the page (on the per-user date indexes of migration 0011), and
+# pages are addressed with keyset cursors, so a page costs the same however long
+# the user's history is.
+from datetime import datetime, timedelta
+
+PER_PAGE = 50
+
+# key: (label, kind, id column, date column, FROM/JOIN, user column, name, patient id)
+# `kind` breaks ties between events at the same moment; it is part of the cursor.
+ACTIVITY_SOURCES = {
+    'registration': ('Patient Registration', 5, 'p.id', 'p.date_of_registration',
+                     'Patient p', 'p.registered_by_doctor_id', 'p.name', 'p.id'),
+    'visit': ('Follow-up Visit', 4, 'fv.id', 'fv.visit_date',
+              'FollowUpVisit fv JOIN Patient p ON fv.patient_id = p.id', 'fv.doctor_id', 'p.name', 'p.id'),
+    'prescription': ('Prescription Created', 3, 'pr.id', 'pr.prescription_date',
+                     'Prescription pr JOIN Patient p ON pr.patient_id = p.id', 'pr.doctor_id', 'p.name', 'p.id'),
+    'login': ('Login', 2, 'l.id', 'l.login_time',
+              'UserActivityLog l', 'l.user_id', "'System Access'", 'NULL::int'),
+    'logout': ('Logout', 1, 'l.id', 'l.logout_time',
+               'UserActivityLog l', 'l.user_id', "'System Access'", 'NULL::int'),
+}
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def _parse_cursor(value):
+    """Cursors look like '<activity timestamp>|<kind>|<id>' (the last row of a page)."""
+    try:
+        moment, kind, row_id = value.split('|')
+        return datetime.fromisoformat(moment), int(kind), int(row_id)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _format_cursor(row):
+    return f"{row['activity_date'].isoformat()}|{row['kind']}|{row['source_id']}"
+
+def read_filters(args):
+    """Activity types, date range and patient name from request.args."""
+    types = [t for t in args.getlist('type') if t in ACTIVITY_SOURCES] or list(ACTIVITY_SOURCES)
+    name = (args.get('q') or '').strip()
+    if name:
+        # Logins and logouts have no patient to match.
+        types = [t for t in types if t not in ('login', 'logout')]
+    return {
+        'types': types,
+        'from': _parse_date(args.get('from')),
+        'to': _parse_date(args.get('to')),
+        'q': name,
+    }
+
+def _branch(source, user_id, filters, cursor_key, limit):
+    label, kind, id_column, date_column, from_sql, user_column, name_sql, patient_sql = ACTIVITY_SOURCES[source]
+    clauses = [f"{user_column} = %s", f"{date_column} IS NOT NULL"]
+    params = [user_id]
+    if filters['from']:
+        clauses.append(f"{date_column} >= %s")
+        params.append(filters['from'])
+    if filters['to']:
+        clauses.append(f"{date_column} < %s")
+        params.append(filters['to'] + timedelta(days=1))
+    if filters['q']:
+        escaped = filters['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append("p.name ILIKE %s")
+        params.append(f"%{escaped}%")
+    if cursor_key:
+        # Rows after the cursor in (activity_date, kind, id) DESC order, written so
+        # each branch can still walk its (user, date, id) index.
+        moment, cursor_kind, cursor_id = cursor_key
+        if kind < cursor_kind:
+            clauses.append(f"{date_column} <= %s")
+            params.append(moment)
+        elif kind > cursor_kind:
+            clauses.append(f"{date_column} < %s")
+            params.append(moment)
+        else:
+            clauses.append(f"({date_column}, {id_column}) < (%s, %s)")
+            params.extend([moment, cursor_id])
+    sql = f"""
+        (SELECT '{label}' AS type, {kind} AS kind, {id_column} AS source_id, {name_sql} AS name,
+                {patient_sql} AS patient_id, {date_column}::timestamp AS activity_date
+         FROM {from_sql}
+         WHERE {" AND ".join(clauses)}
+         ORDER BY {date_column} DESC, {id_column} DESC
+         LIMIT %s)
+    """
+    return sql, params + [limit]
+
+def activity_page(cursor, user_id, args, per_page=PER_PAGE):
+    """
+    Returns one page of the user's activity, newest first, as a dict with
+    'activities', 'next_cursor' (None on the last page) and the active 'filters'.
+    `args` is request.args: type (repeatable), from, to, q and after.
+    """
+    filters = read_filters(args)
+    cursor_key = _parse_cursor(args.get('after'))
+    if not filters['types']:
+        return {'activities': [], 'next_cursor': None, 'filters': filters}
+
+    branches = []
+    params = []
+    for source in filters['types']:
+        sql, branch_params = _branch(source, user_id, filters, cursor_key, per_page + 1)
+        branches.append(sql)
+        params.extend(branch_params)
+    # Fetch one extra row to learn whether another page exists.
+    cursor.execute(f"""
+        SELECT type, kind, source_id, name, patient_id, activity_date
+        FROM ({" UNION ALL ".join(branches)}) activity
+        ORDER BY activity_date DESC, kind DESC, source_id DESC
+        LIMIT %s
+    """, tuple(params) + (per_page + 1,))
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    return {
+        'activities': [
+            {'type': row['type'], 'name': row['name'], 'patient_id': row['patient_id'],
+             'activity_date': row['activity_date']}
+            for row in rows
+        ],
+        'next_cursor': _format_cursor(rows[-1]) if rows and has_more else None,
+        'filters': filters,
+    }